@@ -13,26 +13,42 @@ from prompting.tools import (
     WikiDateDataset,
 )
 
+from prompting.tools.datasets.health import HEALTH
+
+import numpy as np
+from typing import List
 from transformers import Pipeline
 
+# Dataset which provides the context of each task
+TASK_DATASETS = {
+    "summarization": WikiDataset,
+    "qa": WikiDataset,
+    "debugging": HFCodingDataset,
+    "math": MathDataset,
+    "date_qa": WikiDateDataset,
+}
 
-def create_task(llm_pipeline: Pipeline, task_name: str) -> Task:
-    wiki_based_tasks = ["summarization", "qa"]
-    coding_based_tasks = ["debugging"]
-    # TODO Add math and date_qa to this structure
 
-    # TODO: Abstract dataset classes into common dynamic interface
-    if task_name in wiki_based_tasks:
-        dataset = WikiDataset()
+def task_probabilities(task_names: List[str], task_p: List[float]) -> np.ndarray:
+    """Lowers the selection probability of tasks whose dataset is unhealthy, and renormalizes.
 
-    elif task_name in coding_based_tasks:
-        dataset = HFCodingDataset()
+    Args:
+        task_names (List[str]): Names of the tasks.
+        task_p (List[float]): Configured selection probabilities of the tasks.
+    Returns:
+        np.ndarray: Selection probabilities. The configured ones are returned if every task has zero weight.
+    """
+    p = np.array(task_p, dtype=float)
+    weights = np.array([HEALTH.weight(TASK_DATASETS[name].__name__) if name in TASK_DATASETS else 1.0 for name in task_names])
+    if (p * weights).sum() <= 0:
+        return p / p.sum()
+    return p * weights / (p * weights).sum()
 
-    elif task_name == "math":
-        dataset = MathDataset()
 
-    elif task_name == "date_qa":
-        dataset = WikiDateDataset()
+def create_task(llm_pipeline: Pipeline, task_name: str) -> Task:
+    # TODO: Abstract dataset classes into common dynamic interface
+    if task_name in TASK_DATASETS:
+        dataset = TASK_DATASETS[task_name]()
 
     if task_name == "summarization":
         task = SummarizationTask(llm_pipeline=llm_pipeline, context=dataset.next())
@@ -24,11 +24,12 @@ import bittensor as bt
 from typing import List
 from prompting.agent import HumanAgent
 from prompting.dendrite import DendriteResponseEvent
-from prompting.conversation import create_task
+from prompting.conversation import create_task, task_probabilities
 from prompting.protocol import PromptingSynapse
 from prompting.rewards import RewardResult
 from prompting.utils.uids import get_random_uids
 from prompting.utils.logging import log_event
+from prompting.tools.datasets.health import HEALTH
 
 
 async def run_step(
@@ -74,6 +75,7 @@ async def run_step(
         agent=agent,
         response_event=response_event,
         device=self.device,
+        max_workers=self.config.neuron.reward_workers,
     )
     bt.logging.info(f"Created RewardResult:\n {reward_result}")
 
@@ -92,6 +94,7 @@ async def run_step(
         **agent.__state_dict__(full=self.config.neuron.log_full),
         **reward_result.__state_dict__(full=self.config.neuron.log_full),
         **response_event.__state_dict__(),
+        **HEALTH.state_dict(),
     }
 
     log_event(self, event)
@@ -103,12 +106,14 @@ async def forward(self):
     bt.logging.info("🚀 Starting forward loop...")
 
     while True:
+        # Tasks whose dataset is unhealthy are selected less often until it recovers
+        task_p = task_probabilities(self.config.neuron.tasks, self.config.neuron.task_p)
         bt.logging.info(
-            f"📋 Selecting task... from {self.config.neuron.tasks} with distribution {self.config.neuron.task_p}"
+            f"📋 Selecting task... from {self.config.neuron.tasks} with distribution {task_p}"
         )
         # Create a specific task
         task_name = np.random.choice(
-            self.config.neuron.tasks, p=self.config.neuron.task_p
+            self.config.neuron.tasks, p=task_p
         )
         bt.logging.info(f"📋 Creating {task_name} task... ")
         try:
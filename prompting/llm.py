@@ -25,6 +25,15 @@ from prompting.mock import MockPipeline
 
 from prompting.cleaners.cleaner import CleanerPipeline
 
+# Default generation settings of HuggingFaceLLM, also part of the reference fingerprint
+GENERATION_KWARGS = dict(
+    do_sample=True,
+    temperature=0.7,
+    top_k=50,
+    top_p=0.95,
+    max_new_tokens=256,
+)
+
 
 def load_pipeline(model_id, device=None, torch_dtype=None, mock=False, model_kwargs:dict = None):
     """Loads the HuggingFace pipeline for the LLM, or a mock pipeline if mock=True"""
@@ -59,11 +68,11 @@ class HuggingFaceLLM:
         self,
         llm_pipeline: Pipeline,
         system_prompt,
-        max_new_tokens=256,
-        do_sample=True,
-        temperature=0.7,
-        top_k=50,
-        top_p=0.95,
+        max_new_tokens=GENERATION_KWARGS["max_new_tokens"],
+        do_sample=GENERATION_KWARGS["do_sample"],
+        temperature=GENERATION_KWARGS["temperature"],
+        top_k=GENERATION_KWARGS["top_k"],
+        top_p=GENERATION_KWARGS["top_p"],
     ):
         self.llm_pipeline = llm_pipeline
         self.system_prompt = system_prompt
@@ -2,6 +2,7 @@ from .reward import (
     BaseRewardModel,
     RewardResult,
     RewardEvent,
+    RewardPlan,
     BatchRewardOutput,
     RewardModelTypeEnum,
 )
@@ -1,36 +1,109 @@
 import difflib
+import threading
 import torch
-from typing import List
+from functools import lru_cache
+from typing import List, Sequence, Tuple
 from prompting.rewards import (
     BaseRewardModel,
     BatchRewardOutput,
     RewardModelTypeEnum,
 )
+from prompting.rewards.sandbox import SANDBOX
+from prompting.rewards.features import CompletionFeatures, line_hash
 import time
 
+# Matchers of the current reference of each thread, so that concurrent reward models do not share a matcher
+_MATCHERS = threading.local()
+
+
+def _matcher(reference: Sequence, autojunk: bool = True) -> difflib.SequenceMatcher:
+    """Returns a matcher of the calling thread whose indexed side is `reference`, indexing it only when the reference changes.
+    Characters and line hashes are compared with and without autojunk, so a batch which mixes both keeps one matcher of each."""
+    matchers = getattr(_MATCHERS, "matchers", None)
+    if matchers is None:
+        matchers = _MATCHERS.matchers = {}
+    indexed, matcher = matchers.get(autojunk, (None, None))
+    if matcher is None or indexed != reference:
+        matcher = difflib.SequenceMatcher(None, autojunk=autojunk)
+        matcher.set_seq2(reference)
+        matchers[autojunk] = (reference, matcher)
+    return matcher
+
 
 class DiffRewardModel(BaseRewardModel):
     @property
     def name(self) -> str:
         return "diff"
 
-    def __init__(self, lines=False, threshold=None, **kwargs):
+    def __init__(self, lines=False, threshold=None, timeout=2.0, max_chars=20_000, cutoff=0.1, **kwargs):
+        """
+        Args:
+            lines (bool, optional): If True, the reward is the number of lines of the unified diff. Defaults to False.
+            threshold (float, optional): Logged with the rewards. Defaults to None.
+            timeout (float, optional): Time limit in seconds for scoring each completion in the sandbox, as diffs are quadratic in the length of the code. None scores in process. Defaults to 2.
+            max_chars (int, optional): Pairs with more characters than this are compared line by line instead of character by character, which approximates the ratio. None always compares characters. Defaults to 20000.
+            cutoff (float, optional): Ratios below this are scored 0, which skips the full comparison of completions whose cheap upper bounds are already below it. Defaults to 0.1.
+        """
         super().__init__()
         self.lines = lines
         self.threshold = threshold
+        self.timeout = timeout
+        self.max_chars = max_chars
+        self.cutoff = cutoff
 
     def unified_diff(self, reference, completion):
-        return len(
-            difflib.unified_diff(
+        return sum(
+            1 for _ in difflib.unified_diff(
                 reference.splitlines(), completion.splitlines()
             )
         )
 
-    def seq_match(self, reference, completion):
-        return difflib.SequenceMatcher(None, reference, completion).ratio()
+    def seq_match(self, reference, completion, line_hashes=None):
+        """Character level `SequenceMatcher(None, completion, reference).ratio()`, or the line level ratio of long pairs, and 0 below the cutoff.
+        `line_hashes` are the precomputed line hashes of the completion, which are only used for long pairs."""
+        if reference == completion:
+            return 1.0
+        if not reference or not completion:
+            return 0.0
+        if self.max_chars is not None and len(reference) + len(completion) > self.max_chars:
+            return self.line_match(reference, completion, line_hashes=line_hashes)
+
+        # the reference is the indexed side, so it is only indexed once for all completions of the batch
+        matcher = _matcher(reference)
+        matcher.set_seq1(completion)
+        return self._ratio(matcher)
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _reference_lines(reference: str) -> Tuple[Tuple[int], Tuple[int]]:
+        """Hashes and lengths of the lines of the reference, which are computed once per batch."""
+        lines = reference.splitlines(keepends=True)
+        return tuple(line_hash(line) for line in lines), tuple(map(len, lines))
+
+    def line_match(self, reference, completion, line_hashes=None):
+        """Ratio of the characters in matching lines, which is close to the character level ratio for code with few changes per line."""
+        reference_hashes, reference_lengths = self._reference_lines(reference)
+        if line_hashes is None:
+            line_hashes = [line_hash(line) for line in completion.splitlines(keepends=True)]
+        matcher = _matcher(reference_hashes, autojunk=False)
+        matcher.set_seq1(line_hashes)
+        if matcher.real_quick_ratio() == 0 or matcher.quick_ratio() == 0:
+            return 0.0
+
+        # matching lines are equal, so their lengths are taken from the reference
+        matched = sum(sum(reference_lengths[j:j + size]) for _, j, size in matcher.get_matching_blocks())
+        ratio = 2.0 * matched / (sum(reference_lengths) + len(completion))
+        return ratio if ratio >= self.cutoff else 0.0
+
+    def _ratio(self, matcher: difflib.SequenceMatcher) -> float:
+        # upper bounds of the ratio which are cheap to compute
+        if matcher.real_quick_ratio() < self.cutoff or matcher.quick_ratio() < self.cutoff:
+            return 0.0
+        ratio = matcher.ratio()
+        return ratio if ratio >= self.cutoff else 0.0
 
     def reward(
-        self, reference: str, completions: List[str]
+        self, reference: str, completions: List[str], features: CompletionFeatures = None
     ) -> BatchRewardOutput:
         """Get the score between two strings.
         lines: If True, return a unified diff. If False, return a ratio.
@@ -38,22 +111,31 @@ class DiffRewardModel(BaseRewardModel):
 
         rewards = []
         timings = []
+        timeouts = 0
 
-        if self.lines:
-            for completion in completions:
-                t0 = time.time()
-                rewards.append(self.unified_diff(reference, completion))
-                timings.append(time.time() - t0)
+        func = self.unified_diff if self.lines else self.seq_match
+        items = [(reference, completion) for completion in completions]
+        if not self.lines and self.max_chars is not None and features is not None:
+            long_pairs = [len(reference) + len(completion) > self.max_chars for completion in completions]
+            if any(long_pairs):
+                # the shared line hashes are only needed for the long pairs which are compared line by line
+                items = [
+                    (reference, completion, hashes if is_long else None)
+                    for completion, hashes, is_long in zip(completions, features.line_hashes(), long_pairs)
+                ]
+
+        if self.timeout is not None:
+            rewards, timings, timeouts = SANDBOX.map(func, items, timeout=self.timeout)
         else:
-            for completion in completions:
+            for item in items:
                 t0 = time.time()
-                rewards.append(self.seq_match(reference, completion))
+                rewards.append(func(*item))
                 timings.append(time.time() - t0)
 
         output = BatchRewardOutput(
             rewards=torch.FloatTensor(rewards),
             timings=torch.FloatTensor(timings),            
-            extra_info={"threshold": self.threshold, "lines": self.lines},
+            extra_info={"threshold": self.threshold, "lines": self.lines, "timeouts": timeouts},
         )
 
         return output
@@ -1,13 +1,47 @@
 import time
 import torch
 import re
-import pandas as pd
 import numpy as np
-from typing import List
+from datetime import date
+from typing import List, Tuple
 from prompting.rewards import BaseRewardModel, BatchRewardOutput, RewardModelTypeEnum
+from prompting.rewards.features import CompletionFeatures
 import bittensor as bt
 
 
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+MONTH_NUMBERS = {month: number for number, month in enumerate(MONTHS, start=1)}
+_MONTH = "|".join(MONTHS)
+
+# (pattern, index of the year group). The first two groups hold the day and month. Patterns are tried in order.
+DATE_PATTERNS = [
+    (re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{3,4})\b"), 3),  # MM/DD/YYYY or DD/MM/YYYY
+    (re.compile(r"\b(\d{1,2})[-/](\d{1,2})[-/](\d{2})\b"), 3),   # MM/DD/YY or DD/MM/YY
+    (re.compile(rf"\b(\d{{1,2}}) ({_MONTH}) (\d{{3,4}})\b"), 3),  # DD Month, YYYY
+    (re.compile(rf"\b({_MONTH}) (\d{{1,2}})(,\s*)?(\d{{3,4}})\b"), 4),  # Month DD, YYYY
+]
+
+
+def day_and_month(first: str, second: str) -> date:
+    """Parses the day and month of a date in the year 2000 the same way as `pd.to_datetime(f"{first}/{second}/2000")`, or returns None.
+
+    Numbers are read as month/day, unless the first one cannot be a month, in which case they are read as day/month.
+    """
+    if first in MONTH_NUMBERS:
+        month, day = MONTH_NUMBERS[first], int(second)
+    elif second in MONTH_NUMBERS:
+        month, day = MONTH_NUMBERS[second], int(first)
+    else:
+        month, day = int(first), int(second)
+        if month > 12:
+            month, day = day, month
+    try:
+        # year 2000 is a leap year, so February 29 is valid
+        return date(2000, month, day)
+    except ValueError:
+        return None
+
+
 class DateRewardModel(BaseRewardModel):
     @property
     def name(self) -> str:
@@ -25,63 +59,50 @@ class DateRewardModel(BaseRewardModel):
         except Exception as e:
             return 500
 
-    def parse_dates_from_text(self, text: str) -> tuple:
+    def parse_dates_from_text(self, text: str) -> Tuple[date, str]:
         """
-        Parses dates from a body of text, handling various formats, and returns pandas datetime objects.
+        Parses dates from a body of text, handling various formats.
 
         Args:
             text (str): The text to parse.
         
         Returns:
-            tuple: A tuple containing a datemtime object with they year set at 2000 and the actual year. 
+            tuple: A tuple containing a date object with they year set at 2000 and the actual year. 
         """
-
-        date_patterns = [
-            r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{3,4})\b",  # MM/DD/YYYY or DD/MM/YYYY
-            r"\b(\d{1,2})[-/](\d{1,2})[-/](\d{2})\b",   # MM/DD/YY or DD/MM/YY
-            r"\b(\d{1,2}) (January|February|March|April|May|June|July|August|September|October|November|December) (\d{3,4})\b",  # DD Month, YYYY
-            r"\b(January|February|March|April|May|June|July|August|September|October|November|December) (\d{1,2})(,\s*)?(\d{3,4})\b",  # Month DD, YYYY
-        ]
-        
-        for pattern in date_patterns:
-            matches = re.findall(pattern, text)
-            for match in matches:
-                try:
-                    # Attempt to create a datetime object with year 2000 (datetime objects cannot take dates more than 200 years in the past)
-                    parsed_date = pd.to_datetime(match[0] + "/" + match[1] + "/" + "2000")
-                    year = match[-1]
-                    # Check if the year is a number
-                    if year.isdigit():
-                        # If the year is a digit, return the parsed date and the year in a tuple
-                        return (parsed_date, year)
-                    else:
-                        raise ValueError
-                except ValueError:
-                    pass
+        for pattern, year_group in DATE_PATTERNS:
+            for match in pattern.finditer(text):
+                # the date is created in the year 2000 as dates cannot be more than a few hundred years in the past
+                parsed_date = day_and_month(match.group(1), match.group(2))
+                if parsed_date is not None:
+                    return (parsed_date, match.group(year_group))
 
         return 
 
-    def date_score(self, reference: str, completion: str) -> float:
+    def date_score(self, reference: str, completion: str, ref_date: Tuple[date, str] = None, comp_date: Tuple[date, str] = None) -> float:
         """Assign a score based on the difference between two dates using a negative exponential function.
         
         Args:
             reference (str): The reference date.
             completion (str): The completion date.
+            ref_date (Tuple[date, str], optional): The parsed reference, so that it is only parsed once per batch. Defaults to None.
+            comp_date (Tuple[date, str], optional): The parsed completion. Defaults to None, which parses the completion.
             
         Returns:
             float: The score."""
         score = 0
         if not completion:
             return score
-        ref_date = self.parse_dates_from_text(reference)
-        comp_date = self.parse_dates_from_text(completion)
+        if ref_date is None:
+            ref_date = self.parse_dates_from_text(reference)
+        if comp_date is None:
+            comp_date = self.parse_dates_from_text(completion)
         score =np.exp(-(self.date_diff(ref_date, comp_date)**2/1000))
         # Clip any very small scores
         if score < 0.001:
             score = 0
         return score
 
-    def reward(self, reference: str, completions: List[str]) -> BatchRewardOutput:
+    def reward(self, reference: str, completions: List[str], features: CompletionFeatures = None) -> BatchRewardOutput:
         """Compute difference scores given a completion and reference pair.
         
         Args:
@@ -92,10 +113,12 @@ class DateRewardModel(BaseRewardModel):
             BatchRewardOutput: A BatchRewardOutput object containing the rewards and timings."""
         rewards = []
         timings = []
+        ref_date = self.parse_dates_from_text(reference)
+        comp_dates = features.get("dates", self.parse_dates_from_text) if features is not None else [None] * len(completions)
 
-        for completion in completions:
+        for completion, comp_date in zip(completions, comp_dates):
             t0 = time.time()
-            reward = self.date_score(reference, completion) 
+            reward = self.date_score(reference, completion, ref_date=ref_date, comp_date=comp_date)
             timings.append(time.time() - t0)
             rewards.append(reward)
 
@@ -0,0 +1,43 @@
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, List
+
+
+def line_hash(line: str) -> int:
+    """Hash of a line which is the same in every process, unlike `hash`, so it can be compared in sandbox workers."""
+    return int.from_bytes(hashlib.blake2b(line.encode(), digest_size=8).digest(), "little")
+
+
+class CompletionFeatures:
+    """Preprocessed features of the unique completions of a step, such as tokens, n-grams and line hashes.
+
+    Each feature is computed lazily for all completions the first time a reward model asks for it, and then shared by every reward
+    and penalty model of the step, including ones which run concurrently.
+    """
+
+    def __init__(self, completions: List[str]):
+        self.completions = completions
+        self._features: Dict[Hashable, List[Any]] = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(completions={len(self.completions)}, features={list(self._features)})"
+
+    def get(self, key: Hashable, compute: Callable[[str], Any]) -> List[Any]:
+        """Returns the feature of each completion, computing it with `compute` if no model has asked for `key` yet."""
+        features = self._features.get(key)
+        if features is not None:
+            return features
+
+        with self._lock:
+            lock = self._locks[key]
+        # other models wait for the feature instead of computing it again
+        with lock:
+            if key not in self._features:
+                self._features[key] = [compute(completion) for completion in self.completions]
+        return self._features[key]
+
+    def line_hashes(self) -> List[List[int]]:
+        return self.get("line_hashes", lambda completion: [line_hash(line) for line in completion.splitlines(keepends=True)])
@@ -1,8 +1,126 @@
+import re
+import ast
+import math
 import time
 import torch
-from typing import List
+import operator
+from fractions import Fraction
+from functools import lru_cache
+from typing import List, Union
 from sympy.parsing.sympy_parser import parse_expr
 from prompting.rewards import BaseRewardModel, BatchRewardOutput, RewardModelTypeEnum
+from prompting.rewards.sandbox import SANDBOX
+from prompting.rewards.features import CompletionFeatures
+
+# Plain and scientific notation numbers, which float() parses to the same value as sympy
+NUMBER_PATTERN = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_]\w*')
+DIGIT_PATTERN = re.compile(r'\d')
+# Names which sympy evaluates to numbers. Other words without digits are not passed to sympy.
+SYMPY_CONSTANTS = {'pi', 'E', 'I', 'oo', 'zoo', 'nan', 'EulerGamma', 'GoldenRatio', 'Catalan', 'TribonacciConstant'}
+# Longest word which is passed to sympy
+MAX_SYMPY_LENGTH = 40
+# Maximum size in bits of exact powers. Larger powers are computed approximately with floats.
+MAX_POWER_BITS = 4096
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+def _power(base: Union[Fraction, float], exponent: Union[Fraction, float]) -> Union[Fraction, float]:
+    if isinstance(base, Fraction) and isinstance(exponent, Fraction) and exponent.denominator == 1:
+        exponent = exponent.numerator
+        # exact powers are only computed while the result is small, so that inputs like 9**9**9**9 cannot stall the validator
+        if abs(exponent) * (abs(base.numerator).bit_length() + base.denominator.bit_length()) <= MAX_POWER_BITS or base in (0, 1, -1):
+            return base ** (exponent if base not in (1, -1) else exponent % 2)
+
+        sign = -1 if base < 0 and exponent % 2 else 1
+        log2_result = exponent * (math.log2(abs(base.numerator)) - math.log2(base.denominator))
+        if abs(log2_result) > 1100:
+            # far outside the float range, so only the sign matters
+            return sign * (math.inf if log2_result > 0 else 0.0)
+        return sign * 2.0 ** log2_result
+
+    result = float(base) ** float(exponent)
+    if isinstance(result, complex):
+        raise ValueError(f'{base}**{exponent} is complex')
+    return result
+
+
+def _evaluate(node: ast.AST) -> Union[Fraction, float]:
+    """Evaluates an arithmetic expression of number literals. Integers are kept as exact fractions, like sympy rationals."""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return Fraction(node.value) if isinstance(node.value, int) else node.value
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        return UNARY_OPERATORS[type(node.op)](_evaluate(node.operand))
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+        return _power(_evaluate(node.left), _evaluate(node.right))
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return BINARY_OPERATORS[type(node.op)](_evaluate(node.left), _evaluate(node.right))
+    raise ValueError(f'Unsupported expression {ast.dump(node)}')
+
+
+def safe_eval(expression: str) -> float:
+    """Evaluates a simple arithmetic expression such as '2*10+3' or '1/2' without sympy.
+
+    Raises:
+        ValueError: If the expression is not plain arithmetic on numbers or cannot be evaluated.
+    """
+    try:
+        value = _evaluate(ast.parse(expression, mode='eval').body)
+    except (SyntaxError, ZeroDivisionError, OverflowError, RecursionError, MemoryError) as e:
+        raise ValueError(f'Cannot evaluate {expression!r}: {e}')
+
+    try:
+        return float(value)
+    except OverflowError:
+        return math.inf if value > 0 else -math.inf
+
+
+def parse_number(word: str) -> float:
+    """Parses a cleaned word into a number, or returns None.
+
+    Tries a number regex, then a safe arithmetic evaluator, which has no length limit as it only walks the syntax tree, and only
+    then sympy, for short words which may contain sympy constants or functions. Finally float() is tried, which also parses 'inf'
+    and 'nan'. Results of words which are short enough for sympy are memoized, so that long words of miners cannot fill the cache.
+    """
+    if len(word) <= MAX_SYMPY_LENGTH:
+        return _parse_short_number(word)
+    return _parse_number(word)
+
+
+def _parse_number(word: str) -> float:
+    if NUMBER_PATTERN.fullmatch(word):
+        return float(word)
+
+    try:
+        return safe_eval(word)
+    except ValueError:
+        pass
+
+    use_sympy = len(word) <= MAX_SYMPY_LENGTH and (
+        DIGIT_PATTERN.search(word) or any(name in SYMPY_CONSTANTS for name in IDENTIFIER_PATTERN.findall(word))
+    )
+    if use_sympy:
+        try:
+            return float(parse_expr(word).evalf())
+        except Exception:
+            pass
+
+    try:
+        return float(word)
+    except Exception:
+        return None
+
+
+_parse_short_number = lru_cache(maxsize=2**16)(_parse_number)
 
 
 class FloatDiffModel(BaseRewardModel):
@@ -10,31 +128,34 @@ class FloatDiffModel(BaseRewardModel):
     def name(self) -> str:
         return 'float_diff'
 
-    def __init__(self, **kwargs):
+    def __init__(self, timeout=2.0, **kwargs):
+        """
+        Args:
+            timeout (float, optional): Time limit in seconds for scoring each completion in the sandbox. Completions which take longer score 0. None scores in process without a limit. Defaults to 2.
+        """
         super().__init__()
+        self.timeout = timeout
+
+    @staticmethod
+    def number_words(text: str) -> List[str]:
+        """Cleaned words of the text from last to first, without repeats, which are the candidates for the number in the text."""
+        return list(dict.fromkeys(word.strip('.').replace(',', '') for word in reversed(text.split())))
 
     @staticmethod
-    def extract_number(text: str) -> float:
-        """Extract a number from a string."""
-        # loop over all words reversed and try to cast as a float, break when you find the first one
-        words = text.split()
-        for word in reversed(words):
-            cleaned = word.strip('.').replace(',', '')
-            try:
-                return float(parse_expr(cleaned).evalf())
-            except Exception:
-                # fall back to simpler parsing if required
-                try:
-                    return float(cleaned)
-                except Exception:
-                    continue
+    def extract_number(text: str, words: List[str] = None) -> float:
+        """Extract a number from a string, or from its precomputed `number_words`."""
+        # loop over all words reversed and try to parse them as a number, break when you find the first one
+        for cleaned in FloatDiffModel.number_words(text) if words is None else words:
+            number = parse_number(cleaned)
+            if number is not None:
+                return number
 
     @staticmethod
-    def math_score(reference: str, completion: str) -> float:
+    def math_score(reference: str, completion: str, words: List[str] = None) -> float:
         """Compute a score based on the difference between a reference and a completion."""
         # Convert the strings to a float
         reference = float(reference)
-        pred = FloatDiffModel.extract_number(completion)
+        pred = FloatDiffModel.extract_number(completion, words=words)
         if pred is None:
             return 0.0
 
@@ -53,20 +174,28 @@ class FloatDiffModel(BaseRewardModel):
             return 0.0
 
 
-    def reward(self, reference: str, completions: List[str]) -> BatchRewardOutput:
+    def reward(self, reference: str, completions: List[str], features: CompletionFeatures = None) -> BatchRewardOutput:
         """Compute difference scores given a completion and reference pair."""
         rewards = []
         timings = []
+        timeouts = 0
+        # only the candidate words are sent to the sandbox, which is less than the whole completion for long prose
+        all_words = features.get("number_words", self.number_words) if features is not None else [None] * len(completions)
 
-        for completion in completions:
-            t0 = time.time()
-            reward = self.math_score(reference, completion)
-            timings.append(time.time() - t0)
-            rewards.append(reward)
+        if self.timeout is not None:
+            # untrusted expressions are parsed by sympy, which can run for minutes
+            items = [(reference, completion if words is None else '', words) for completion, words in zip(completions, all_words)]
+            rewards, timings, timeouts = SANDBOX.map(self.math_score, items, timeout=self.timeout)
+        else:
+            for completion, words in zip(completions, all_words):
+                t0 = time.time()
+                reward = self.math_score(reference, completion, words=words)
+                timings.append(time.time() - t0)
+                rewards.append(reward)
 
         output = BatchRewardOutput(
             rewards = torch.FloatTensor(rewards),
             timings = torch.FloatTensor(timings),
-            extra_info = {'type': 'math', },
+            extra_info = {'type': 'math', 'timeouts': timeouts},
         )
         return output
@@ -3,6 +3,7 @@ from typing import List
 from prompting.tasks import TASKS
 from prompting.rewards import (
     BaseRewardModel,
+    RewardPlan,
     RougeRewardModel,
     DiffRewardModel,
     RelevanceRewardModel,
@@ -34,6 +35,13 @@ class RewardPipeline:
     def __repr__(self):
         return f'RewardPipeline({self.reward_models})'
 
+    def plan(self, task) -> RewardPlan:
+        """Returns the compiled reward plan of the task, or compiles one if the task is not one of the selected tasks."""
+        plan = self.plans.get(type(task))
+        if plan is None:
+            plan = RewardPlan.compile(task.reward_definition, task.penalty_definition, device=self.device)
+        return plan
+
     def validate_tasks(self):
 
         for task in self.selected_tasks:
@@ -97,4 +105,9 @@ class RewardPipeline:
             reward_models[name] = cls(device=self.device, **params)
 
         self.reward_models = reward_models
+        # model order, weights and penalty mask of each task are only worked out once
+        self.plans = {
+            TASKS[task]: RewardPlan.compile(TASKS[task].reward_definition, TASKS[task].penalty_definition, device=self.device)
+            for task in self.selected_tasks
+        }
 
@@ -1,7 +1,9 @@
 import time
 import torch
-from typing import List
+from typing import List, Tuple
 from angle_emb import AnglE
+from prompting.utils.embeddings import EmbeddingCache
+from prompting.rewards.features import CompletionFeatures
 from torch.nn.functional import cosine_similarity
 from prompting.rewards import (
     BaseRewardModel,
@@ -15,9 +17,14 @@ class RelevanceRewardModel(BaseRewardModel):
     def name(self) -> str:
         return "relevance"
 
-    def __init__(self, threshold=None, device=None, pooling_strategy="cls"):
+    def __init__(self, threshold=None, device=None, pooling_strategy="cls", batch_size=32, cache_bytes=64 * 2**20, cache_path=None):
         super().__init__()
         self.threshold = threshold
+        self.batch_size = batch_size
+        # embeddings are reused across steps and for identical completions, such as empty or copied ones
+        self.cache = EmbeddingCache(
+            namespace=f"WhereIsAI/UAE-Large-V1:{pooling_strategy}", max_bytes=cache_bytes, path=cache_path
+        )
         self.model = AnglE.from_pretrained(
             "WhereIsAI/UAE-Large-V1", pooling_strategy=pooling_strategy, device=device
         )        
@@ -25,41 +32,69 @@ class RelevanceRewardModel(BaseRewardModel):
             # This line is necessary to pass the model to the device defined at its initialization
             self.model = self.model.cuda()
 
+        # embedding of an empty string (a failed completion), which the baseline score is computed from
+        self.empty_embedding = self.model.encode([""], to_numpy=False).reshape(1, -1)
+
+    def embed(self, texts: List[str]) -> Tuple[torch.Tensor, List[float]]:
+        """Encodes the texts in batches of `batch_size`. Texts are sorted by length first, so that each batch is padded to a similar length.
+
+        Returns:
+            Tuple[torch.Tensor, List[float]]: The embeddings in the order of the texts, and the time of each text, which is its share of the time of its batch.
+        """
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = [None] * len(texts)
+        timings = [0.0] * len(texts)
+
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            t0 = time.time()
+            batch_embeddings = self.model.encode([texts[i] for i in batch], to_numpy=False).reshape(len(batch), -1)
+            batch_time = time.time() - t0
+
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+                timings[i] = batch_time / len(batch)
 
+        return torch.stack(embeddings), timings
 
-    def reward(self, reference: str, completions: List[str]) -> BatchRewardOutput:
+    def reward(self, reference: str, completions: List[str], features: CompletionFeatures = None) -> BatchRewardOutput:
         """Calculates the cosine similarity between sentence embeddings of the reference and completions.
         We subtract a baseline score which is what an empty string would get (a failed completion). This is usually around 0.35
         We also clip the rewards between 0 and 1. The maximum effective score is around 0.65
         """
-        reference_embedding = self.model.encode(reference, to_numpy=False)
-        rewards = []
-        timings = []
-        # baseline is the cosine similarity between the reference and an empty string
-        baseline = cosine_similarity(
-            reference_embedding.reshape(1, -1),
-            self.model.encode("", to_numpy=False).reshape(1, -1),
-        )
+        texts = [reference, *completions]
+        # the cache keys of the completions are shared with the other relevance models of the step, e.g. the penalty
+        if features is not None:
+            completion_keys = features.get(("embedding_key", self.cache.namespace), self.cache.key)
+        else:
+            completion_keys = [self.cache.key(completion) for completion in completions]
+        keys = dict(zip(texts, [self.cache.key(reference), *completion_keys]))
+        embeddings = self.cache.get_many(texts, keys=[keys[text] for text in texts])
+        # the reference is encoded in the same batches as the completions, and each distinct text is only encoded once
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        timings = [0.0] * len(texts)
+        if missing:
+            encoded, encode_timings = self.embed(missing)
+            for text, embedding in zip(missing, encoded):
+                self.cache.set(text, embedding.float().cpu().numpy(), key=keys[text])
+            encoded = dict(zip(missing, zip(encoded, encode_timings)))
+            for i, text in enumerate(texts):
+                if embeddings[i] is None:
+                    embeddings[i], timings[i] = encoded[text]
 
-        for comp in completions:
-            t0 = time.time()
-
-            emb = self.model.encode(comp, to_numpy=False)
-            # Calculate cosine similarity between reference and completion embeddings, and subtract baseline
-            score = (
-                cosine_similarity(
-                    reference_embedding.reshape(1, -1), emb.reshape(1, -1)
-                )
-                - baseline
-            )
+        device = self.empty_embedding.device
+        embeddings = torch.stack([torch.as_tensor(embedding, device=device).float() for embedding in embeddings])
+        reference_embedding = embeddings[:1]
 
-            rewards.append(score)
-            timings.append(time.time() - t0)
+        # baseline is the cosine similarity between the reference and an empty string
+        baseline = cosine_similarity(reference_embedding, self.empty_embedding.float())
+        # Calculate cosine similarity between reference and completion embeddings, and subtract baseline
+        rewards = cosine_similarity(embeddings[1:], reference_embedding) - baseline
 
         output = BatchRewardOutput(
-            rewards=torch.FloatTensor(rewards).clip(min=0, max=1),
-            timings=torch.FloatTensor(timings),
-            extra_info={"threshold": self.threshold},
+            rewards=rewards.float().cpu().clip(min=0, max=1),
+            timings=torch.FloatTensor(timings[1:]),
+            extra_info={"threshold": self.threshold, **{f"embedding_cache_{key}": value for key, value in self.cache.stats().items()}},
         )
 
         return output
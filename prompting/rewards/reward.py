@@ -1,7 +1,10 @@
 import torch
 import time
+import threading
 import bittensor as bt
-from typing import List
+from typing import List, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from prompting.rewards.features import CompletionFeatures
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
@@ -25,18 +28,89 @@ class RewardEvent:
     extra_info: dict
 
     # implement custom asdict to return a dict with the same keys as the dataclass using the model name
-    def asdict(self) -> dict:
+    def asdict(self, rewards: list = None, rewards_normalized: list = None, timings: list = None) -> dict:
+        """Returns the event with keys prefixed by the model name. The tensors can be passed as lists which were already converted."""
         return {
-            f"{self.model_name}_raw_{self.model_type.value}": self.rewards.tolist(),
-            f"{self.model_name}_{self.model_type.value}": self.rewards_normalized.tolist(),
-            f"{self.model_name}_{self.model_type.value}_timings": self.timings.tolist(),
+            f"{self.model_name}_raw_{self.model_type.value}": self.rewards.tolist() if rewards is None else rewards,
+            f"{self.model_name}_{self.model_type.value}": self.rewards_normalized.tolist() if rewards_normalized is None else rewards_normalized,
+            f"{self.model_name}_{self.model_type.value}_timings": self.timings.tolist() if timings is None else timings,
             f"{self.model_name}_{self.model_type.value}_batch_time": self.batch_time,
             f"{self.model_name}_{self.model_type.value}_extra_info": self.extra_info,
         }
 
 
+@dataclass
+class RewardPlan:
+    """Reward and penalty models of a task in evaluation order, with their weights as one vector and a mask of the penalty rows,
+    so that the rewards of all models are aggregated with a few matrix operations."""
+    reward_definition: List[dict]
+    penalty_definition: List[dict]
+    weights: torch.FloatTensor
+    penalty_mask: torch.BoolTensor
+
+    @classmethod
+    def compile(cls, reward_definition: List[dict], penalty_definition: List[dict] = None, device=None) -> "RewardPlan":
+        reward_definition = list(reward_definition)
+        penalty_definition = list(penalty_definition or [])
+        models = reward_definition + penalty_definition
+        return cls(
+            reward_definition=reward_definition,
+            penalty_definition=penalty_definition,
+            weights=torch.tensor([model["weight"] for model in models], dtype=torch.float32, device=device),
+            penalty_mask=torch.tensor([False] * len(reward_definition) + [True] * len(penalty_definition), dtype=torch.bool, device=device),
+        )
+
+    @property
+    def model_names(self) -> List[str]:
+        return [model["name"] for model in self.reward_definition + self.penalty_definition]
+
+    def aggregate(self, rewards: torch.FloatTensor) -> torch.FloatTensor:
+        """Combines the rewards of the models into the total reward of each completion.
+
+        Args:
+            rewards (torch.FloatTensor): Rewards of shape [models x completions], with the rows in the order of the plan.
+
+        Returns:
+            torch.FloatTensor: Weighted sum of the reward rows, multiplied by (1 - weight * penalty) of each penalty row.
+        """
+        weights = self.weights.to(rewards.device)
+        mask = self.penalty_mask.to(rewards.device)
+        weighted = weights.unsqueeze(1) * rewards
+        return weighted[~mask].sum(dim=0) * (1 - weighted[mask]).prod(dim=0)
+
+
+def deduplicate(completions: List[str]) -> Tuple[List[str], torch.LongTensor]:
+    """Collapses the completions to unique texts.
+
+    Returns:
+        Tuple[List[str], torch.LongTensor]: The unique completions in order of first occurrence, and the index of each completion in them, so that `unique[inverse[i]] == completions[i]`.
+    """
+    positions = {}
+    inverse = [positions.setdefault(completion, len(positions)) for completion in completions]
+    return list(positions), torch.tensor(inverse, dtype=torch.long)
+
+
+# Shared by all reward results, as a new RewardResult is created for each step
+_EXECUTOR: ThreadPoolExecutor = None
+_EXECUTOR_WORKERS = 0
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def reward_executor(max_workers: int) -> ThreadPoolExecutor:
+    """Returns the thread pool which reward models are evaluated in, creating it on first use or when the number of workers changes."""
+    global _EXECUTOR, _EXECUTOR_WORKERS
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_WORKERS != max_workers:
+            if _EXECUTOR is not None:
+                # models already submitted to the old pool still run to completion
+                _EXECUTOR.shutdown(wait=False)
+            _EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reward")
+            _EXECUTOR_WORKERS = max_workers
+        return _EXECUTOR
+
+
 class RewardResult:
-    def __init__(self, reward_pipeline, agent, response_event, device):
+    def __init__(self, reward_pipeline, agent, response_event, device, max_workers: int = 8):
         """Passes the responses through the reward models and calculates the total reward
 
         Args:
@@ -44,40 +118,66 @@ class RewardResult:
             task (Task): Task instance which contains reward_definition (list of reward model requirements) and a reference answer (str)
             response_event (DendriteResponseEvent): Network responses to the prompt
             device (str): Device to run the reward models on
+            max_workers (int, optional): Number of threads which the reward and penalty models are evaluated in concurrently, so that
+                GPU and CPU models overlap. Values below 2 evaluate the models one after another. Defaults to 8.
         """
 
         self.reward_pipeline = reward_pipeline
         self.response_event = response_event
         self.device = device
-        self.task_rewards = agent.task.reward_definition
-        self.task_penalties = agent.task.penalty_definition
-        self.reward_events = self.reward_responses(
+        self.max_workers = max_workers
+        # the pipeline compiles the plans of its tasks once, other tasks are compiled here
+        if hasattr(reward_pipeline, "plan"):
+            self.plan = reward_pipeline.plan(agent.task)
+        else:
+            self.plan = RewardPlan.compile(agent.task.reward_definition, agent.task.penalty_definition, device=device)
+        self.task_rewards = self.plan.reward_definition
+        self.task_penalties = self.plan.penalty_definition
+        # each unique completion is scored once by every model, and the results are scattered back to uid order
+        self.unique_completions, self.inverse = deduplicate(response_event.completions)
+        # tokens, n-grams and line hashes of the completions are computed once and shared by all models
+        self.features = CompletionFeatures(self.unique_completions)
+
+        # penalties do not depend on rewards, so all models are dispatched before waiting for any of them
+        reward_futures = self.submit_responses(
             reference=agent.task.reference, 
             models=self.task_rewards,
             reward_type=RewardModelTypeEnum.WEIGHTED_REWARD
         )
-        self.penalty_events = self.reward_responses(
+        penalty_futures = self.submit_responses(
             reference=agent.challenge, 
             models=self.task_penalties,
             reward_type=RewardModelTypeEnum.PENALTY
         )
+        self.reward_events = [future.result() for future in reward_futures]
+        self.penalty_events = [future.result() for future in penalty_futures]
+        # rewards of all models as one [models x completions] matrix, in the order of the plan
+        self.reward_matrix = self.stack_events("rewards")
         self.rewards = self.total_reward()
 
+    def stack_events(self, attribute: str) -> torch.FloatTensor:
+        """Stacks a tensor attribute of the reward and penalty events into a [models x completions] matrix."""
+        events = self.reward_events + self.penalty_events
+        if not events:
+            return torch.zeros(0, len(self.inverse))
+        return torch.stack([getattr(event, attribute) for event in events])
+
     def __state_dict__(self, full=False):
 
         state = {"rewards": self.rewards.tolist()}
-        for event in self.reward_events+self.penalty_events:
-            state.update(event.asdict())
+        # each matrix is converted to lists at once, rather than each tensor of each event
+        columns = zip(
+            self.reward_matrix.tolist(),
+            self.stack_events("rewards_normalized").tolist(),
+            self.stack_events("timings").tolist(),
+        )
+        for event, (rewards, rewards_normalized, timings) in zip(self.reward_events + self.penalty_events, columns):
+            state.update(event.asdict(rewards=rewards, rewards_normalized=rewards_normalized, timings=timings))
         return state
 
-    def reward_responses(self, reference: str, models: List[dict], reward_type: RewardModelTypeEnum) -> List[RewardEvent]:
-        """Calculates the rewards for the responses given the task and returns a RewardEvent for each reward model
-        reward_events: List[RewardEvent] = [
-            RewardEvent(model_name='rouge', rewards=torch.zeros(50), timings=torch.zeros(50), ...),
-            RewardEvent(model_name='relevance', rewards=torch.zeros(50), timings=torch.zeros(50), ...),
-        ]
-        """
-        reward_events = []
+    def submit_responses(self, reference: str, models: List[dict], reward_type: RewardModelTypeEnum) -> List[Future]:
+        """Dispatches each reward model to the reward thread pool and returns the futures of the RewardEvents in the order of the models."""
+        futures = []
 
         for reward_info in models:
 
@@ -88,27 +188,22 @@ class RewardResult:
                     f"Reward model {reward_info['name']} not supported. Please choose from {self.reward_pipeline.keys()}"
                 )
             # Compute the rewards for the responses given the prompt
-            reward_event = reward_model.apply(reference, self.response_event, reward_type=reward_type)
-            reward_events.append(reward_event)
+            kwargs = dict(reward_type=reward_type, unique_completions=(self.unique_completions, self.inverse), features=self.features)
+            if self.max_workers > 1:
+                futures.append(reward_executor(self.max_workers).submit(reward_model.apply, reference, self.response_event, **kwargs))
+            else:
+                future = Future()
+                future.set_result(reward_model.apply(reference, self.response_event, **kwargs))
+                futures.append(future)
 
-        return reward_events
+        return futures
 
     def total_reward(self) -> torch.FloatTensor:
         """Combines the rewards from all the reward models into a single reward tensor"""
 
         # TODO: How would using the Agent as a reward model fit into this flow?
-        # Compute the rewards for the responses given the prompt
-        rewards = torch.zeros_like(self.response_event.uids, dtype=torch.float32, device=self.device)
-
-        for event in self.reward_events:
-             for reward_info in filter(lambda x: x['name'] == event.model_name, self.task_rewards):
-                rewards += reward_info["weight"] * event.rewards.to(self.device)
-
-        for event in self.penalty_events:
-            for reward_info in filter(lambda x: x['name'] == event.model_name, self.task_penalties):
-                rewards *= (1 - reward_info["weight"] * event.rewards.to(self.device))
-
-        return rewards
+        # the events are in the order of the plan, so the rows of the matrix line up with its weights
+        return self.plan.aggregate(self.reward_matrix.to(self.device))
 
     def __str__(self):
         return f"{self.__class__.__name__}(rewards={self.rewards!r}, reward_events={self.reward_events!r}, penalty_events={self.penalty_events!r})"
@@ -140,26 +235,43 @@ class BaseRewardModel(ABC):
 
     @abstractmethod
     def reward(
-        self, reference: str, completions: List[str]
+        self, reference: str, completions: List[str], features: CompletionFeatures = None
     ) -> BatchRewardOutput:
+        """Scores the completions. `features` holds preprocessed features of the completions which are shared with other models."""
         pass
 
-    def apply(self, reference: str, response_event, reward_type) -> RewardEvent:
+    def apply(
+        self,
+        reference: str,
+        response_event,
+        reward_type,
+        unique_completions: Tuple[List[str], torch.LongTensor] = None,
+        features: CompletionFeatures = None,
+    ) -> RewardEvent:
+        """Scores the unique completions of the response event and scatters the rewards and timings back to uid order.
+
+        Args:
+            unique_completions (Tuple[List[str], torch.LongTensor], optional): Output of `deduplicate` for the completions, so that it is shared between models. Defaults to None, which deduplicates the completions.
+            features (CompletionFeatures, optional): Shared features of the unique completions. Defaults to None, which creates them for this model only.
+        """
+        completions, inverse = unique_completions or deduplicate(response_event.completions)
+        if features is None:
+            features = CompletionFeatures(completions)
 
         t0 = time.time()
         batch_rewards_output = self.reward(
-            reference, response_event.completions
+            reference, completions, features=features
         )
         batch_rewards_time = time.time() - t0
 
         return RewardEvent(
             model_name=self.name,
-            rewards=batch_rewards_output.rewards,
-            rewards_normalized=batch_rewards_output.rewards_normalized,
+            rewards=batch_rewards_output.rewards[inverse],
+            rewards_normalized=batch_rewards_output.rewards_normalized[inverse],
             model_type=reward_type,
             batch_time=batch_rewards_time,
             extra_info=batch_rewards_output.extra_info,
-            timings=batch_rewards_output.timings,
+            timings=batch_rewards_output.timings[inverse],
         )
 
 
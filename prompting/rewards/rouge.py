@@ -1,12 +1,137 @@
 import time
 import torch
-from typing import List
-from rouge import Rouge
+from itertools import chain
+from collections import Counter
+from typing import Dict, List, Set
 from prompting.rewards import (
     BaseRewardModel,
     BatchRewardOutput,
     RewardModelTypeEnum,
 )
+from prompting.rewards.features import CompletionFeatures
+
+NGRAMS = {"rouge-1": 1, "rouge-2": 2, "rouge-3": 3, "rouge-4": 4, "rouge-5": 5}
+
+
+def split_sentences(text: str) -> List[List[str]]:
+    """Splits the text into sentences of words the same way as the `rouge` package: sentences are split on periods and their
+    whitespace is normalized, then words are split on single spaces. Blank sentences therefore consist of one empty word.
+    """
+    return [" ".join(sentence.split()).split(" ") for sentence in text.split(".") if sentence]
+
+
+def f_r_p(hyp_count: int, ref_count: int, overlap: int) -> Dict[str, float]:
+    precision = overlap / hyp_count if hyp_count else 0.0
+    recall = overlap / ref_count if ref_count else 0.0
+    return {"f": 2.0 * ((precision * recall) / (precision + recall + 1e-8)), "p": precision, "r": recall}
+
+
+def lcs_rows(x: List[str], masks: Dict[str, int], length: int) -> List[int]:
+    """Bit-parallel LCS (Hyyrö, 2004) of `x` against the sequence that `masks` was built from.
+
+    Returns the bit vector of each row of the LCS table. The number of zero bits among the lowest j bits of row i is the LCS
+    length of x[:i] and y[:j].
+    """
+    full = (1 << length) - 1
+    row = full
+    rows = [row]
+    for word in x:
+        matches = row & masks.get(word, 0)
+        row = ((row + matches) | (row - matches)) & full
+        rows.append(row)
+    return rows
+
+
+def match_masks(y: List[str]) -> Dict[str, int]:
+    """Bit mask of the positions of each word in the sequence."""
+    masks = {}
+    for j, word in enumerate(y):
+        masks[word] = masks.get(word, 0) | (1 << j)
+    return masks
+
+
+def lcs_words(x: List[str], y: List[str], masks: Dict[str, int]) -> List[str]:
+    """Reconstructs the longest common subsequence with the same tie breaking as the `rouge` package."""
+    rows = lcs_rows(x, masks, len(y))
+
+    def table(i, j):
+        return j - bin(rows[i] & ((1 << j) - 1)).count("1")
+
+    words = []
+    i, j = len(x), len(y)
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            words.append(x[i - 1])
+            i, j = i - 1, j - 1
+        elif table(i - 1, j) > table(i, j - 1):
+            i -= 1
+        else:
+            j -= 1
+    return words
+
+
+class RougeText:
+    """Text which is tokenized once, along with its n-grams and LCS match masks, so that it can be scored against many others."""
+
+    def __init__(self, text: str, n: int = None, exclusive: bool = True):
+        self.sentences = split_sentences(text)
+        self.words = list(chain.from_iterable(self.sentences))
+        self.exclusive = exclusive
+        self.word_set = set(self.words)
+        self.sentence_sets = [set(sentence) for sentence in self.sentences]
+        self._masks = None
+
+        if n is not None:
+            ngrams = (tuple(self.words[i:i + n]) for i in range(len(self.words) - n + 1))
+            self.ngrams = set(ngrams) if exclusive else Counter(ngrams)
+            self.num_ngrams = len(self.ngrams) if exclusive else sum(self.ngrams.values())
+
+    def __bool__(self):
+        return bool(self.sentences)
+
+    @property
+    def masks(self) -> List[Dict[str, int]]:
+        if self._masks is None:
+            self._masks = [match_masks(sentence) for sentence in self.sentences]
+        return self._masks
+
+    @property
+    def num_words(self) -> int:
+        return len(self.word_set) if self.exclusive else len(self.words)
+
+
+def rouge_n(hyp: RougeText, ref: RougeText) -> Dict[str, float]:
+    """ROUGE-N of two texts which were tokenized with the same n. The overlap is a set or Counter intersection."""
+    if hyp.exclusive:
+        overlap = len(hyp.ngrams & ref.ngrams)
+    else:
+        overlap = sum((hyp.ngrams & ref.ngrams).values())
+    return f_r_p(hyp.num_ngrams, ref.num_ngrams, overlap)
+
+
+def rouge_l(hyp: RougeText, ref: RougeText) -> Dict[str, float]:
+    """Summary level ROUGE-L, which is based on the union of the LCS of every pair of reference and hypothesis sentences.
+
+    As in the `rouge` package, the union is a set of words when `exclusive` is set, so a pair of sentences only needs to be
+    aligned if it has common words which are not in the union yet. Otherwise the LCS lengths are summed.
+    """
+    if hyp.exclusive:
+        union: Set[str] = set()
+        for ref_sentence, ref_set in zip(ref.sentences, ref.sentence_sets):
+            for hyp_sentence, hyp_set, masks in zip(hyp.sentences, hyp.sentence_sets, hyp.masks):
+                if (ref_set & hyp_set) - union:
+                    union.update(lcs_words(ref_sentence, hyp_sentence, masks))
+        overlap = len(union)
+    else:
+        overlap = 0
+        for ref_sentence in ref.sentences:
+            for hyp_sentence, masks in zip(hyp.sentences, hyp.masks):
+                row = lcs_rows(ref_sentence, masks, len(hyp_sentence))[-1]
+                overlap += len(hyp_sentence) - bin(row).count("1")
+
+    recall = overlap / ref.num_words
+    precision = overlap / hyp.num_words
+    return {"f": 2.0 * ((precision * recall) / (precision + recall + 1e-8)), "p": precision, "r": recall}
 
 
 class RougeRewardModel(BaseRewardModel):
@@ -14,30 +139,49 @@ class RougeRewardModel(BaseRewardModel):
     def name(self) -> str:
         return "rouge"
 
-    def __init__(self, ngram="rouge-l", metric="f", avg=False, device=None, **kwargs):
+    def __init__(self, ngram="rouge-l", metric="f", avg=False, device=None, exclusive=True, **kwargs):
         super().__init__()
+        if ngram != "rouge-l" and ngram not in NGRAMS:
+            raise ValueError(f"Unknown ngram {ngram!r}. Please choose from {['rouge-l', *NGRAMS]}")
+        if metric not in ("f", "p", "r"):
+            raise ValueError(f"Unknown metric {metric!r}. Please choose from ['f', 'p', 'r']")
+
         self.ngram = ngram
         self.metric = metric
         self.avg = avg
-        self.rouge = Rouge(**kwargs)
+        self.exclusive = exclusive
+
+    def tokenize(self, text: str) -> RougeText:
+        return RougeText(text, n=NGRAMS.get(self.ngram), exclusive=self.exclusive)
 
     def rouge_score(self, reference, completion):
+        """Scores the completion the same way as `Rouge().get_scores(reference, completion)`. Both may be pre-tokenized."""
         if not completion or not reference:
             return 0.0
-        return self.rouge.get_scores(reference, completion, avg=self.avg)[0][
-            self.ngram
-        ][self.metric]
+
+        hypothesis = reference if isinstance(reference, RougeText) else self.tokenize(reference)
+        completion = completion if isinstance(completion, RougeText) else self.tokenize(completion)
+        # texts which only consist of periods have no sentences
+        if not hypothesis or not completion:
+            return 0.0
+
+        score = rouge_l if self.ngram == "rouge-l" else rouge_n
+        return score(hypothesis, completion)[self.metric]
 
     def reward(
-        self, reference: str, completions: List[str]
+        self, reference: str, completions: List[str], features: CompletionFeatures = None
     ) -> BatchRewardOutput:
         """Compute ROUGE scores given a completion and reference pair."""
         rewards = []
         timings = []
+        # the reference is only tokenized once per batch, and the completions once per step as they are shared with the penalty
+        tokenized_reference = self.tokenize(reference) if reference else reference
+        if features is not None:
+            completions = features.get(("rouge", NGRAMS.get(self.ngram), self.exclusive), self.tokenize)
 
         for completion in completions:
             t0 = time.time()
-            rewards.append(self.rouge_score(reference, completion))
+            rewards.append(self.rouge_score(tokenized_reference, completion))
             timings.append(time.time() - t0)
 
         output = BatchRewardOutput(
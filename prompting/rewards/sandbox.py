@@ -0,0 +1,258 @@
+import time
+import threading
+import multiprocessing
+import bittensor as bt
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Any, Callable, Deque, List, Sequence, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _worker(conn, max_memory: int = None):
+    """Runs batches of (index, args) items and sends back (index, success, result, time) after each item, so that the parent
+    knows which item is running and can kill the worker if it takes too long."""
+    if max_memory and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+
+        func, items = message
+        for index, args in items:
+            t0 = time.perf_counter()
+            try:
+                result, success = func(*args), True
+            except Exception as e:
+                result, success = repr(e), False
+            conn.send((index, success, result, time.perf_counter() - t0))
+
+
+class _Worker:
+    def __init__(self, context, max_memory: int = None):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child_conn, max_memory), daemon=True)
+        self.process.start()
+        child_conn.close()
+        # items of the current batch which have not been returned yet, and the time of the last result
+        self.batch: Deque[Tuple[int, tuple]] = deque()
+        self.progress = 0.0
+
+    def submit(self, func: Callable, batch: List[Tuple[int, tuple]]):
+        self.batch = deque(batch)
+        self.progress = time.perf_counter()
+        self.conn.send((func, batch))
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class SandboxPool:
+    """Pool of worker processes which runs CPU bound reward kernels on untrusted completions.
+
+    Items are sent to the workers in batches to keep the IPC overhead low, but the time limit applies to each item: a worker
+    whose current item runs longer than the timeout is killed and replaced, the item gets the default result and the rest of its
+    batch is sent to the new worker. Items which raise also get the default result. Each call also has a time budget: items
+which have not finished when it runs out get the default result, so that a batch of adversarial completions which each run
+just below the timeout cannot stall the step. Workers are only started on first use and
+    are reused across calls. Each call checks out the idle workers it needs, so concurrent calls run side by side on separate
+    workers. By default workers are forked from a forkserver which has preloaded the reward models, so replacing a worker is cheap.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        timeout: float = 2.0,
+        budget: float = 10.0,
+        batch_size: int = 8,
+        max_memory: int = None,
+        start_method: str = "forkserver",
+        preload: Sequence[str] = ("prompting.rewards",),
+    ):
+        """
+        Args:
+            num_workers (int, optional): Number of worker processes. Defaults to 2.
+            timeout (float, optional): Default wall clock limit of each item in seconds. Defaults to 2.
+            budget (float, optional): Default wall clock limit of each call in seconds. Defaults to 10, None means no limit.
+            batch_size (int, optional): Maximum number of items which are sent to a worker at once. Defaults to 8.
+            max_memory (int, optional): Address space limit of each worker in bytes. Defaults to None, which means no limit.
+            start_method (str, optional): Multiprocessing start method of the workers. Defaults to 'forkserver'.
+            preload (Sequence[str], optional): Modules which the forkserver imports before forking workers. Defaults to the reward models.
+        """
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self.budget = budget
+        self.batch_size = batch_size
+        self.max_memory = max_memory
+        self.start_method = start_method
+        self.preload = list(preload)
+        self.num_timeouts = 0
+        self.num_errors = 0
+        self.num_restarts = 0
+
+        self._context = None
+        self._idle: List[_Worker] = []
+        # number of workers which are idle or checked out by a call
+        self._num_started = 0
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(num_workers={self.num_workers}, timeout={self.timeout}, timeouts={self.num_timeouts}, restarts={self.num_restarts})"
+
+    def _checkout(self, num_batches: int) -> List[_Worker]:
+        """Takes up to `num_batches` workers, starting new ones up to `num_workers`. Waits until at least one is available."""
+        with self._cond:
+            if self._context is None:
+                self._context = multiprocessing.get_context(self.start_method)
+                if self.start_method == "forkserver" and self.preload:
+                    self._context.set_forkserver_preload(self.preload)
+            while not self._idle and self._num_started >= self.num_workers:
+                self._cond.wait()
+
+            workers = []
+            while len(workers) < num_batches and (self._idle or self._num_started < self.num_workers):
+                if self._idle:
+                    workers.append(self._idle.pop())
+                else:
+                    workers.append(_Worker(self._context, self.max_memory))
+                    self._num_started += 1
+            return workers
+
+    def _checkin(self, workers: List[_Worker]):
+        with self._cond:
+            self._idle.extend(workers)
+            self._cond.notify_all()
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        with self._cond:
+            self.num_restarts += 1
+        return _Worker(self._context, self.max_memory)
+
+    def map(
+        self, func: Callable, items: Sequence[tuple], default: Any = 0.0, timeout: float = None, budget: float = None
+    ) -> Tuple[List[Any], List[float], int]:
+        """Runs `func(*args)` for each args tuple of `items` in the workers.
+
+        Args:
+            func (Callable): Picklable function, such as a module level function or a static method.
+            items (Sequence[tuple]): Arguments of each call.
+            default (Any, optional): Result of items which time out or raise. Defaults to 0.0.
+            timeout (float, optional): Wall clock limit of each item in seconds. Defaults to the timeout of the pool.
+            budget (float, optional): Wall clock limit of the call in seconds. Defaults to the budget of the pool.
+
+        Returns:
+            Tuple[List[Any], List[float], int]: The result and the run time of each item, in the order of the items, and the number of
+                items which timed out, including those which did not finish within the budget.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        budget = self.budget if budget is None else budget
+        results = [default] * len(items)
+        timings = [0.0] * len(items)
+        num_timeouts = 0
+        indexed = list(enumerate(items))
+        pending = deque(indexed[i:i + self.batch_size] for i in range(0, len(indexed), self.batch_size))
+        if not pending:
+            return results, timings, num_timeouts
+
+        idle = self._checkout(len(pending))
+        busy = {}
+        # the budget starts once workers are available, waiting for other calls is not counted
+        end = time.perf_counter() + budget if budget is not None else float("inf")
+        try:
+            while pending or busy:
+                while pending and idle:
+                    worker = idle.pop()
+                    worker.submit(func, pending.popleft())
+                    busy[worker.conn] = worker
+
+                deadline = min(min(worker.progress for worker in busy.values()) + timeout, end)
+                for conn in wait(list(busy), timeout=max(0.0, deadline - time.perf_counter())):
+                    worker = busy[conn]
+                    try:
+                        index, success, result, elapsed = conn.recv()
+                    except (EOFError, OSError):
+                        # the worker died, e.g. because it ran out of memory
+                        self._fail(worker, busy, idle, pending, results, timings, "crashed")
+                        continue
+
+                    worker.batch.popleft()
+                    worker.progress = time.perf_counter()
+                    timings[index] = elapsed
+                    if success:
+                        results[index] = result
+                    else:
+                        self.num_errors += 1
+                        bt.logging.debug(f"{getattr(func, '__qualname__', func)} failed on item {index}: {result}")
+
+                    if not worker.batch:
+                        del busy[conn]
+                        idle.append(worker)
+
+                now = time.perf_counter()
+                for worker in [worker for worker in busy.values() if now - worker.progress > timeout]:
+                    num_timeouts += 1
+                    self._fail(worker, busy, idle, pending, results, timings, f"timed out after {timeout}s")
+
+                if now >= end and (pending or busy):
+                    # the unfinished items keep the default result and the busy workers are replaced below
+                    for worker in busy.values():
+                        index, _ = worker.batch[0]
+                        timings[index] = now - worker.progress
+                    num_skipped = sum(len(worker.batch) for worker in busy.values()) + sum(len(batch) for batch in pending)
+                    num_timeouts += num_skipped
+                    bt.logging.warning(f"Reward kernel {getattr(func, '__qualname__', func)} ran out of its {budget}s budget, {num_skipped} items get the default result ({self})")
+                    break
+        finally:
+            # workers which are still busy after an error are in an unknown state
+            for worker in busy.values():
+                idle.append(self._replace(worker))
+            self._checkin(idle)
+
+        with self._cond:
+            self.num_timeouts += num_timeouts
+        return results, timings, num_timeouts
+
+    def _fail(self, worker: _Worker, busy: dict, idle: list, pending: deque, results: list, timings: list, reason: str):
+        """Scores the current item of the worker with the default result, replaces the worker and requeues the rest of its batch."""
+        index, _ = worker.batch.popleft()
+        timings[index] = time.perf_counter() - worker.progress
+        bt.logging.warning(f"Reward kernel {reason} on item {index}, restarting worker ({self})")
+
+        del busy[worker.conn]
+        if worker.batch:
+            pending.appendleft(list(worker.batch))
+        idle.append(self._replace(worker))
+
+    def close(self):
+        """Stops the idle workers. Workers which are checked out by a running call are returned to the pool afterwards."""
+        with self._cond:
+            for worker in self._idle:
+                worker.close()
+            self._num_started -= len(self._idle)
+            self._idle = []
+
+
+# Shared by the CPU bound reward models
+SANDBOX = SandboxPool()
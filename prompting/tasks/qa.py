@@ -59,20 +59,23 @@ class QuestionAnsweringTask(Task):
         dict(name="remove_roles"),
     ]
 
+    max_context_tokens = 1536
+
     def __init__(self, llm_pipeline, context, create_reference=True):
 
 
         self.context = context
+        content = self.window_context(context.content, llm_pipeline)
 
         self.query_system_prompt = QUERY_SYSTEM_PROMPT
         self.query_prompt = QUERY_PROMPT_TEMPLATE.format(
-            context = context.content
+            context = content
         )
         self.query = self.generate_query(llm_pipeline)
 
         self.reference_system_prompt = REFERENCE_SYSTEM_PROMPT
         self.reference_prompt = REFERENCE_PROMPT_TEMPLATE.format(
-            context = context.content, question = self.query
+            context = content, question = self.query
         )
         if create_reference:
             self.reference = self.generate_reference(llm_pipeline)
@@ -48,17 +48,19 @@ class SummarizationTask(Task):
     ]
 
     static_query = True
+    max_context_tokens = 1536
 
     def __init__(self, llm_pipeline: Pipeline, context: str, create_reference=True):
 
         self.context = context
+        content = self.window_context(context.content, llm_pipeline)
 
         # Query is just the article title and section name
         self.query = context.title + ', ' + context.topic
 
         self.reference_system_prompt = SUMMARIZATION_SYSTEM_PROMPT
         self.reference_prompt = REFERENCE_PROMPT_TEMPLATE.format(
-            context = context.content
+            context = content
         )
         if create_reference:
             self.reference = self.generate_reference(llm_pipeline)
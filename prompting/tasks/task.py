@@ -1,12 +1,18 @@
 import time
+import hashlib
 import bittensor as bt
 from abc import ABC
 from dataclasses import dataclass, asdict
 from enum import Enum
 from typing import List, Union, Dict
-from prompting.llm import HuggingFaceLLM
+from prompting.llm import HuggingFaceLLM, GENERATION_KWARGS
 from transformers import Pipeline
 from prompting.cleaners.cleaner import CleanerPipeline
+from prompting.utils.windowing import count_tokens, window_text
+from prompting.utils.cache import LRUCache
+
+# Generated references, keyed by a fingerprint of the prompts and the generation settings
+REFERENCE_CACHE = LRUCache(max_bytes=64 * 2**20, ttl=24 * 3600)
 
 
 class TaskEvaluationType(Enum):
@@ -42,6 +48,8 @@ class Task(ABC):
     query_system_prompt = ""
     query_prompt = ""
     cleaner = None
+    # Token budget of the context which is pasted into the prompts. None means no limit.
+    max_context_tokens = None
 
     def __str__(self):
         return f"{self.__class__.__name__}(name={self.name!r}, desc={self.desc!r}, goal={self.goal!r}, query={self.query!r}, reference={self.reference!r}, topic={self.topic!r}, subtopic={self.subtopic!r}, tags={self.tags!r})"
@@ -58,15 +66,31 @@ class Task(ABC):
             "query_time": getattr(self, "query_time", 0),
             "reference": self.reference,
             "reference_time": getattr(self, "reference_time", 0),
+            "reference_cache_hit": getattr(self, "reference_cache_hit", False),
             "topic": self.topic,
             "subtopic": self.subtopic,
             "context_time": self.context.stats.get("fetch_time", 0.0),
+            "context_length": getattr(self, "context_length", 0),
+            "query_prompt_length": getattr(self, "query_prompt_length", 0),
+            "reference_prompt_length": getattr(self, "reference_prompt_length", 0),
         }
         if full:
             state.update(asdict(self.context))
 
         return state
 
+    def window_context(self, content: str, llm: Pipeline) -> str:
+        """Cuts the context to `max_context_tokens` tokens at a sentence boundary, so that long sections do not blow up the prompts."""
+        tokenizer = getattr(llm, "tokenizer", None)
+        if self.max_context_tokens is None:
+            self.context_length = count_tokens(content, tokenizer)
+            return content
+
+        window, self.context_length = window_text(content, self.max_context_tokens, tokenizer)
+        if len(window) < len(content):
+            bt.logging.debug(f"Context of {self.__class__.__name__} was cut to {self.context_length} tokens ({len(window)}/{len(content)} chars)")
+        return window
+
     def generate(self, system: str, prompt: str, llm: Pipeline, clean=True) -> str:
         """Uses the llm to generate a response to a prompt"""
 
@@ -77,18 +101,35 @@ class Task(ABC):
             message=prompt, cleaner=cleaner
         )
 
+    def reference_fingerprint(self, llm: Pipeline, clean=True) -> str:
+        """Fingerprint of everything which determines the reference: the model, the generation settings and the prompts, which contain the context."""
+        model = getattr(getattr(llm, "model", None), "name_or_path", None) or repr(llm)
+        cleaning = getattr(self, "cleaning_pipeline", None) if clean else None
+        key = repr((self.__class__.__name__, model, sorted(GENERATION_KWARGS.items()), cleaning, self.reference_system_prompt, self.reference_prompt))
+        return hashlib.sha1(key.encode()).hexdigest()
+
     def generate_reference(self, llm: Pipeline, clean=True) -> str:
-        """Generates a reference answer to be used for scoring miner completions"""
+        """Generates a reference answer to be used for scoring miner completions. References for identical prompts are reused."""
         t0 = time.time()
         if not self.static_reference:
-            bt.logging.info("🤖 Generating reference...")
-
-            self.reference = self.generate(
-                system=self.reference_system_prompt,
-                prompt=self.reference_prompt,
-                llm=llm,
-                clean=clean,
-            )
+            self.reference_prompt_length = count_tokens(self.reference_prompt, getattr(llm, "tokenizer", None))
+            fingerprint = self.reference_fingerprint(llm, clean=clean)
+            reference = REFERENCE_CACHE.get(fingerprint)
+            self.reference_cache_hit = reference is not None
+
+            if reference is None:
+                bt.logging.info("🤖 Generating reference...")
+                reference = self.generate(
+                    system=self.reference_system_prompt,
+                    prompt=self.reference_prompt,
+                    llm=llm,
+                    clean=clean,
+                )
+                REFERENCE_CACHE.set(fingerprint, reference)
+            else:
+                bt.logging.info(f"🤖 Reusing cached reference. Reference cache hit rate: {REFERENCE_CACHE.hit_rate:.1%} ({REFERENCE_CACHE})")
+
+            self.reference = reference
 
         self.reference_time = time.time() - t0
         return self.reference
@@ -98,6 +139,7 @@ class Task(ABC):
         t0 = time.time()
         if not self.static_query:
             bt.logging.info("🤖 Generating query...")
+            self.query_prompt_length = count_tokens(self.query_prompt, getattr(llm, "tokenizer", None))
             self.query = self.generate(
                 system=self.query_system_prompt,
                 prompt=self.query_prompt,
@@ -1,5 +1,6 @@
 from .context import Context
 from .base import Dataset
+from .health import HEALTH, HealthTracker
 from .code import HFCodingDataset, StackOverflowDataset
 from .math import MathDataset
 from .mock import MockDataset
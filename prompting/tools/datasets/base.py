@@ -17,19 +17,62 @@
 # DEALINGS IN THE SOFTWARE.
 
 import time
+import inspect
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List
 import bittensor as bt
 
 from ..selector import Selector
 from .context import Context
-from prompting.utils.exceptions import MaxRetryError
+from .health import HEALTH
+from prompting.utils.exceptions import CircuitOpenError, MaxRetryError
+
+# Shared pool used to run speculative fetches. Fetches are network bound so threads are sufficient.
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+_MAX_WORKERS = 16
+
+# Valid samples which were fetched but not used yet, keyed by (dataset class, dataset config, method, kwargs)
+_SPARES: Dict[tuple, deque] = {}
+# Titles of the most recently returned samples, with the same keys
+_RECENT_TITLES: Dict[tuple, deque] = {}
+_SPARES_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _init_parameters(cls: type) -> tuple:
+    return tuple(name for name in inspect.signature(cls.__init__).parameters if name != 'self')
+
+
+def _is_config_value(value) -> bool:
+    """Whether the value is a plain setting, rather than state such as a store, a random generator or a counter object."""
+    if isinstance(value, (list, tuple)):
+        return all(_is_config_value(item) for item in value)
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix="dataset")
+    return _EXECUTOR
 
 
 class Dataset(ABC):
     """Base class for datasets."""
 
     max_tries: int = 10
+    # Number of fetches which are fired concurrently by `next`. Values above 1 require `random`/`search` to be thread-safe.
+    speculative_fetches: int = 1
+    # Maximum number of unused valid samples kept for later `next` calls
+    max_spares: int = 8
+    # Maximum number of consecutive samples with the same title which are returned by `next`. None means no limit.
+    max_consecutive_per_title: int = None
 
     @abstractmethod
     def search(self, name):
@@ -43,38 +86,166 @@ class Dataset(ABC):
     def get(self, name):
         ...
 
+    def random_contexts(self, selector: Selector = None, **kwargs) -> List[Dict]:
+        """Returns the samples produced by a single random fetch. Datasets which can produce several samples from one fetch should override this."""
+        info = self.random(selector=selector, **kwargs)
+        return [info] if info else []
+
+    def random_local(self, selector: Selector = None, **kwargs) -> Dict:
+        """Returns a random sample without using any remote backend, or None. Used while the circuit breaker of the dataset is open."""
+        return None
+
+    def config(self) -> tuple:
+        """The constructor arguments which are kept as plain attributes, e.g. `min_length_words`."""
+        values = ((name, getattr(self, name, None)) for name in _init_parameters(type(self)))
+        return tuple((name, value) for name, value in values if _is_config_value(value))
+
+    def _spare_key(self, method: str, kwargs: dict) -> tuple:
+        # spares are only shared between instances with the same config, as it decides which samples are valid
+        return (self.__class__.__name__, repr(self.config()), method, repr(sorted(kwargs.items())))
+
+    def _pop_spare(self, key: tuple) -> Dict:
+        """Returns the oldest spare sample which does not exceed `max_consecutive_per_title`."""
+        with _SPARES_LOCK:
+            spares = _SPARES.get(key)
+            if not spares:
+                return None
+
+            recent = _RECENT_TITLES.get(key)
+            for i, info in enumerate(spares):
+                if self.max_consecutive_per_title is None or not recent or len(recent) < recent.maxlen \
+                        or any(title != info.get('title') for title in recent):
+                    del spares[i]
+                    return info
+
+    def _add_spares(self, key: tuple, infos: List[Dict]):
+        with _SPARES_LOCK:
+            _SPARES.setdefault(key, deque(maxlen=self.max_spares)).extend(infos)
+
+    def _record_title(self, key: tuple, title: str):
+        if self.max_consecutive_per_title is None:
+            return
+        with _SPARES_LOCK:
+            _RECENT_TITLES.setdefault(key, deque(maxlen=self.max_consecutive_per_title)).append(title)
+
+    def _fetch_speculatively(self, fetch: callable, num_fetches: int, spare_key: tuple = None, **kwargs):
+        """Fires `num_fetches` concurrent fetches and returns the samples of the first one which succeeds.
+
+        Fetches which have not started yet are cancelled. Samples from fetches that were already running are kept as spares if `spare_key` is provided.
+
+        Returns:
+            Tuple[List[Dict], int]: The samples of the first successful fetch (or an empty list) and the number of fetches which were wasted.
+        """
+        pending = {_get_executor().submit(fetch, **kwargs) for _ in range(num_fetches)}
+        infos = []
+        wasted = 0
+        error = None
+
+        while pending and not infos:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    bt.logging.debug(f"Speculative fetch failed for {self.__class__.__name__}: {e}")
+                    error = e
+                    result = None
+
+                if result and not infos:
+                    infos = result
+                elif result and spare_key is not None:
+                    self._add_spares(spare_key, result)
+                else:
+                    wasted += 1
+
+        for future in pending:
+            wasted += 1
+            if future.cancel() or spare_key is None:
+                continue
+
+            def keep(future):
+                if not future.cancelled() and future.exception() is None and future.result():
+                    self._add_spares(spare_key, future.result())
+
+            future.add_done_callback(keep)
+
+        if not infos and error is not None:
+            raise error
+
+        return infos, wasted
+
     def next(self, method: str = 'random', selector: Selector = Selector(), **kwargs) -> Dict:
-        tries = 1
+        tries = 0
+        wasted = 0
         t0 = time.time()
 
-        while True:
-
-            # TODO: Multithread the get method so that we don't have to suffer nonexistent pages
-            info = {}
-            if method == 'random':
-                info = self.random(selector=selector, **kwargs)
-            elif method == 'search':
-                info = self.search(selector=selector, **kwargs)
-            elif method == 'get':
-                info = self.get(selector=selector, **kwargs)
-            else:
-                raise ValueError(f"Unknown dataset get method {method!r}")
-
-            if info:
-                break
-
-            bt.logging.debug(f"Could not find any samples which meet {self.__class__.__name__} requirements after {tries} tries. Retrying... ({self.max_tries - tries} tries remaining.)")
-
-            tries += 1
-            if tries >= self.max_tries:
-                raise MaxRetryError(
-                    f"Could not find any samples which meet {self.__class__.__name__} requirements after {tries} tries."
-                )
+        def as_list(info):
+            return [info] if info else []
+
+        if method == 'random':
+            fetch = self.random_contexts
+        elif method == 'search':
+            fetch = lambda **kwargs: as_list(self.search(**kwargs))
+        elif method == 'get':
+            fetch = lambda **kwargs: as_list(self.get(**kwargs))
+        else:
+            raise ValueError(f"Unknown dataset get method {method!r}")
+
+        # Repeated `get` calls are for the same page, so there is nothing to gain from speculation
+        num_fetches = self.speculative_fetches if method != 'get' else 1
+        # Only random samples are interchangeable, so only they can be reused by later calls
+        spare_key = self._spare_key(method, kwargs) if method == 'random' else None
+
+        info = self._pop_spare(spare_key) if spare_key else None
+
+        name = self.__class__.__name__
+        if not info and method == 'random' and HEALTH.is_open(name):
+            # the dataset is unhealthy, so only use samples which do not need its remote backend
+            info = self.random_local(selector=selector, **kwargs)
+            if not info:
+                raise CircuitOpenError(f"Circuit breaker of {name} is open and there are no local samples. {HEALTH.stats(name)}")
+            method = 'random_local'
+
+        try:
+            while not info:
+
+                num_fetches = min(num_fetches, self.max_tries - tries)
+                if num_fetches > 1:
+                    infos, num_wasted = self._fetch_speculatively(fetch, num_fetches, spare_key=spare_key, selector=selector, **kwargs)
+                    wasted += num_wasted
+                else:
+                    infos = fetch(selector=selector, **kwargs)
+                    wasted += int(not infos)
+
+                tries += num_fetches
+                if infos:
+                    info, *spares = infos
+                    if spares and spare_key:
+                        self._add_spares(spare_key, spares)
+                    break
+
+                bt.logging.debug(f"Could not find any samples which meet {name} requirements after {tries} tries. Retrying... ({self.max_tries - tries} tries remaining.)")
+
+                if tries >= self.max_tries:
+                    raise MaxRetryError(
+                        f"Could not find any samples which meet {name} requirements after {tries} tries."
+                    )
+        except Exception:
+            HEALTH.record(name, latency=time.time() - t0, num_tries=max(tries, 1), success=False)
+            raise
+
+        # samples which were buffered or local did not touch the backend, so they say nothing about its health
+        if tries:
+            HEALTH.record(name, latency=time.time() - t0, num_tries=tries, success=True)
+
+        if spare_key:
+            self._record_title(spare_key, info.get('title'))
 
         info['stats'] = {
             'creator': self.__class__.__name__,
             'fetch_time': time.time() - t0,
             'num_tries': tries,
+            'num_wasted': wasted,
             'fetch_method': method,
             'next_kwargs': kwargs
             }
@@ -16,18 +16,90 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import os
 import re
 import time
+import threading
 import random
 import requests
 import itertools
+from functools import lru_cache
+from typing import Dict, Iterator, List, Set, Tuple
 
 import bittensor as bt
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 from .base import Dataset
+from .shards import CodeShardStore
+from .mediawiki import USER_AGENT
 from ..selector import Selector
 from datasets import load_dataset
+from datasets.distributed import split_dataset_by_node
+from prompting.utils.cache import CACHE_DIR, DiskCache
+from prompting.utils.index import SearchIndex
+
+# Local index of the code samples in the store, so that they can be searched without network calls.
+# Documents are keyed by (store path, bucket, entry) and loaded from the store when a search hits them.
+CODE_INDEX = SearchIndex(max_docs=20_000)
+# Local store of streamed code samples, bucketed by language and line count
+CODE_STORE = CodeShardStore(path=os.path.join(CACHE_DIR, "code"))
+
+STACKEXCHANGE_API_URL = "https://api.stackexchange.com/2.3"
+# Persistent cache of parsed StackOverflow question and answer pairs
+STACKOVERFLOW_CACHE = DiskCache(path=os.path.join(CACHE_DIR, "stackoverflow.sqlite"), ttl=7 * 24 * 3600, max_bytes=256 * 2**20)
+_session = None
+_session_lock = threading.Lock()
+# Time until which requests wait, when the API asked clients to back off
+_backoff_until = 0
+
+
+def _stackexchange_session(pool_size: int = 16) -> requests.Session:
+    """Returns the shared pooled session for StackExchange API requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers["User-Agent"] = USER_AGENT
+        return _session
+
+
+# Dataset streams are shared by all dataset instances, as a new dataset is created for each task
+_STREAMS = {}
+_STREAMS_LOCK = threading.Lock()
+# Held while the store is filled from a stream, so that only one background fill runs at a time
+_FILL_LOCK = threading.Lock()
+# (store path, bucket) -> number of entries of the bucket which have been indexed
+_INDEXED_ENTRIES: Dict[Tuple[str, str], int] = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def index_store(store: CodeShardStore, max_items: int = None) -> int:
+    """Adds the samples which were appended to the store since the last call to the local search index.
+
+    Args:
+        store (CodeShardStore): Store of the samples.
+        max_items (int, optional): If there are more new samples, only the last ones are indexed. Defaults to no limit.
+
+    Returns:
+        int: The number of samples which were indexed.
+    """
+    with _INDEX_LOCK:
+        pending = []
+        for name, size in store.sizes().items():
+            pending.extend((name, i) for i in range(_INDEXED_ENTRIES.get((store.path, name), 0), size))
+            _INDEXED_ENTRIES[(store.path, name)] = size
+        if max_items is not None:
+            pending = pending[max(len(pending) - max_items, 0):]
+
+        for name, i in pending:
+            info = store.read(name, i)
+            CODE_INDEX.add((store.path, name, i), ' '.join([info['repo_name'], info['path'], info['language'], info['code']]))
+    return len(pending)
+
 
 LANGUAGES = {
     "C++": {
@@ -67,22 +139,78 @@ LANGUAGES = {
     },
 }
 
+# Block comments which can span several lines, as (start, end) delimiters
+MULTILINE_COMMENTS = {
+    "C++": [('/*', '*/')],
+    "HTML": [('<!--', '-->')],
+    "Java": [('/*', '*/')],
+    "JavaScript": [('/*', '*/')],
+    "SQL": [('/*', '*/')],
+}
+
+
+@lru_cache(maxsize=None)
+def _comment_patterns(language: str) -> Tuple[re.Pattern, re.Pattern]:
+    """Compiles a pattern which matches the block comments of the language and one which matches lines that start with a comment symbol."""
+    multiline = None
+    if MULTILINE_COMMENTS.get(language):
+        multiline = re.compile('|'.join(f'{re.escape(start)}.*?{re.escape(end)}' for start, end in MULTILINE_COMMENTS[language]), re.DOTALL)
+
+    symbols = sorted(LANGUAGES[language]['comments'], key=len, reverse=True)
+    line = re.compile(r'\s*(?:' + '|'.join(map(re.escape, symbols)) + ')')
+    return multiline, line
+
+
 def filter_comments(code, language):
-    # TODO: multiline comments
-    # filter out comments
+    """Removes block comments and the lines which start with a comment symbol, and lowercases the remaining code."""
+    multiline, line_comment = _comment_patterns(language)
+    if multiline is not None:
+        code = multiline.sub('', code)
+
+    return '\n'.join(line for line in code.lower().splitlines() if not line_comment.match(line))
 
-    # for start_tag, end_tag in languages[language]['multiline-comments']:
-    #     code = re.sub(rf'{start_tag}.*?{end_tag}', '', code, flags=re.DOTALL)
 
-    lines = []
-    for line in code.splitlines():
-        # TODO: use regex
-        if any(line.strip().startswith(symbol) for symbol in LANGUAGES[language]['comments']):
-            continue
+def _is_boundary(text: str, i: int) -> bool:
+    """Whether position i of the text is a word boundary, like `\\b` in a regex."""
+    before = i > 0 and (text[i - 1].isalnum() or text[i - 1] == '_')
+    after = i < len(text) and (text[i].isalnum() or text[i] == '_')
+    return before != after
 
-        lines.append(line.lower())
 
-    return '\n'.join(lines)
+class KeywordMatcher:
+    """Finds which of a set of keywords occur as whole words in a text, in a single pass of one compiled regex.
+
+    The alternation tries longer keywords first. Shorter keywords which start at the same position (e.g. 'react' in 'react-redux')
+    are checked separately, so the result is the same as searching for each keyword on its own.
+    """
+
+    def __init__(self, keywords: List[str]):
+        self.keywords = sorted(set(keywords), key=len, reverse=True)
+        self.pattern = re.compile(r'\b(?:' + '|'.join(map(re.escape, self.keywords)) + r')\b') if self.keywords else None
+        # keyword -> shorter keywords which are prefixes of it
+        self.prefixes = {
+            keyword: [other for other in self.keywords if len(other) < len(keyword) and keyword.startswith(other)]
+            for keyword in self.keywords
+        }
+
+    def __call__(self, text: str) -> Set[str]:
+        matches = set()
+        if self.pattern is None:
+            return matches
+
+        match = self.pattern.search(text)
+        while match:
+            keyword = match.group()
+            matches.add(keyword)
+            matches.update(prefix for prefix in self.prefixes[keyword] if _is_boundary(text, match.start() + len(prefix)))
+            # continue from the next character, so that keywords which overlap the match are also found
+            match = self.pattern.search(text, match.start() + 1)
+        return matches
+
+
+@lru_cache(maxsize=None)
+def keyword_matcher(language: str, field: str) -> KeywordMatcher:
+    return KeywordMatcher(LANGUAGES[language].get(field, []))
 
 
 #TODO: why not define the chain_in, chain_out logic in the class itself?
@@ -94,9 +222,26 @@ class HFCodingDataset(Dataset):
         seed=None,
         languages=None,
         buffer_size=10000,
+        store: CodeShardStore = CODE_STORE,
+        fill_size=1000,
+        low_water=200,
     ):
+        """
+        Args:
+            dataset_id (str, optional): Hugging Face dataset which is streamed into the store. Defaults to "codeparrot/github-code".
+            seed (int, optional): Shuffle seed of the stream. Defaults to the seed which is saved in the store, so that a restarted validator resumes the same stream.
+            languages (List[str], optional): Languages to sample. Defaults to all LANGUAGES.
+            buffer_size (int, optional): Shuffle buffer size of the stream. Defaults to 10000.
+            store (CodeShardStore, optional): Local store which samples are drawn from. Defaults to CODE_STORE.
+            fill_size (int, optional): Number of stream items which are added to the store per fill. Defaults to 1000.
+            low_water (int, optional): The store is filled in the background when fewer matching samples have not been drawn yet. Defaults to 200.
+        """
+        self.store = store
+        if seed is None:
+            seed = store.state.get("stream_seed")
         if seed is None:
             seed = random.randint(0, 1000)
+            store.update_state(stream_seed=seed)
         self.seed = seed
 
         if languages is None:
@@ -104,22 +249,77 @@ class HFCodingDataset(Dataset):
         self.languages = languages
 
         self.dataset_id = dataset_id
-        self.dataset = iter(
-            load_dataset(
-                dataset_id,
-                split="train",
-                streaming=True,
-                languages=self.languages,
-            ).shuffle(seed=seed, buffer_size=buffer_size)
-        )
+        self.buffer_size = buffer_size
+        self.fill_size = fill_size
+        self.low_water = low_water
+
+    @property
+    def dataset(self) -> Iterator[Tuple[dict, Tuple[int, int]]]:
+        """Iterator over the dataset stream from the position which is saved in the store. Created on first use."""
+        key = (self.dataset_id, tuple(self.languages), self.seed, self.buffer_size, self.store.path)
+        with _STREAMS_LOCK:
+            if key not in _STREAMS:
+                _STREAMS[key] = self._stream()
+            return _STREAMS[key]
+
+    def _stream(self) -> Iterator[Tuple[dict, Tuple[int, int]]]:
+        """Yields the items of the dataset with their position, as the index of the shard in the stream and the offset in the shard.
+
+        Shards are streamed one after another in an order which depends on the seed, and each shard is shuffled. A restarted
+        validator resumes at the saved position, so it only skips the items of the current shard which were already consumed.
+        """
+        dataset = load_dataset(self.dataset_id, split="train", streaming=True, languages=self.languages)
+        shards = list(range(dataset.n_shards))
+        random.Random(self.seed).shuffle(shards)
+
+        position, offset = self.store.state.get("stream_position", (0, 0))
+        for position in range(position, len(shards)):
+            shard = split_dataset_by_node(dataset, rank=shards[position], world_size=len(shards))
+            for item in shard.shuffle(seed=self.seed, buffer_size=self.buffer_size).skip(offset):
+                offset += 1
+                yield item, (position, offset)
+            offset = 0
+
+    def fill(self, num_items: int = None):
+        """Streams items into the local store and the search index, and saves the position in the stream."""
+        with _FILL_LOCK:
+            t0 = time.time()
+            dataset = self.dataset
+            with _STREAMS_LOCK:
+                items = list(itertools.islice(dataset, num_items or self.fill_size))
+            if not items:
+                bt.logging.warning(f"Code dataset stream {self.dataset_id!r} is exhausted")
+                return
+
+            num_stored = self.store.add([item for item, _ in items], consumed=len(items), stream_position=items[-1][1])
+            index_store(self.store, max_items=CODE_INDEX.max_docs)
+            bt.logging.info(f"Added {num_stored} of {len(items)} streamed code samples to {self.store} in {time.time() - t0:.2f}s")
+
+    def top_up(self):
+        """Fills the store in a background thread, unless a fill is already running."""
+        if not _FILL_LOCK.locked():
+            threading.Thread(target=self.fill, daemon=True, name="code-fill").start()
 
     def get(self, min_lines=5, max_lines=100, selector: Selector = None):
-
-        info = next(self.dataset)
-
-        if not (min_lines <= len(info["code"].splitlines()) <= max_lines):
+        # samples are drawn from the local store without replacement, and the store is topped up before it runs out
+        kwargs = dict(languages=self.languages, min_lines=min_lines, max_lines=max_lines)
+        info = self.store.sample(**kwargs, replace=False)
+        if info is None:
+            # wait for a running fill to finish before starting a new one
+            with _FILL_LOCK:
+                pass
+            info = self.store.sample(**kwargs, replace=False)
+        if info is None:
+            self.fill()
+            info = self.store.sample(**kwargs, replace=False)
+        if info is None:
             return None
 
+        if self.store.remaining(**kwargs) < self.low_water:
+            self.top_up()
+        return self._context(info, selector)
+
+    def _context(self, info: dict, selector: Selector) -> dict:
         present_keywords, present_libraries = self.get_special_contents(info["code"], info["language"])
         keywords = list(present_keywords) + list(present_libraries)
         code_words = ['code','programming','coding','code reference','programming technique']
@@ -141,23 +341,33 @@ class HFCodingDataset(Dataset):
             'extra': {'size': info['size'], 'license': info['license']}
         }
 
-    def search(self, query, min_lines=5, max_lines=100, selector: Selector = None, **kwargs):
+    def search(self, query, min_lines=5, max_lines=100, results=10, selector: Selector = None, **kwargs):
+        """Finds code samples which match the query among the samples in the local store. Does not make any network calls."""
         # TODO: Would be great to be able to get other files from the same repo
-        raise NotImplementedError(f"Search is not implemented for {self.__class__.__name__}")
+        index_store(self.store, max_items=CODE_INDEX.max_docs)
+
+        def where(key):
+            path, name, i = key
+            return path == self.store.path and min_lines <= self.store.num_lines(name, i) <= max_lines
+
+        keys = CODE_INDEX.search(query, results=results, where=where)
+        if not keys:
+            return None
+        _, name, i = selector(keys)
+        return self._context(self.store.read(name, i), selector)
 
     def random(self, min_lines=5, max_lines=100, selector: Selector = None, **kwargs):
         return self.get(min_lines, max_lines, selector)
 
+    def random_local(self, min_lines=5, max_lines=100, selector: Selector = None, **kwargs):
+        """Draws a sample from the local store without refilling it from the stream."""
+        info = self.store.sample(languages=self.languages, min_lines=min_lines, max_lines=max_lines)
+        return self._context(info, selector) if info else None
 
-    def extract_keywords(self, code, language, field):
-        matches = set()
 
+    def extract_keywords(self, code, language, field):
         # check which keywords and libraries are present in the code
-        for keyword in LANGUAGES[language].get(field,[]):
-            if re.search(r'\b' + keyword + r'\b', code):
-                matches.add(keyword)
-
-        return matches
+        return keyword_matcher(language, field)(code)
 
     def get_special_contents(self, code, language, remove_comments=True):
 
@@ -172,66 +382,121 @@ class HFCodingDataset(Dataset):
 
 
 class StackOverflowDataset:
-    def __init__(self):
-        # Stack Overflow API endpoint for a random article
-        self.url = "https://api.stackexchange.com/2.3/questions"
+    """Highest voted StackOverflow questions with their highest voted answers.
+
+    Questions are fetched 100 at a time and the answers of the whole page are fetched in bulk, with up to 100 question ids per
+    request. Connections are pooled, and the parsed question and answer pairs are stored in a persistent cache.
+    """
+
+    def __init__(
+        self,
+        api_url: str = STACKEXCHANGE_API_URL,
+        session: requests.Session = None,
+        cache: DiskCache = STACKOVERFLOW_CACHE,
+        timeout: float = 10,
+        max_answer_pages: int = 10,
+    ):
+        """
+        Args:
+            api_url (str, optional): StackExchange API endpoint. Defaults to STACKEXCHANGE_API_URL.
+            session (requests.Session, optional): Session to use for requests. Defaults to a shared pooled session.
+            cache (DiskCache, optional): Cache of parsed question and answer pairs. Defaults to STACKOVERFLOW_CACHE.
+            timeout (float, optional): Timeout of each request in seconds. Defaults to 10.
+            max_answer_pages (int, optional): Maximum number of answer pages which are fetched per page of questions. Defaults to 10.
+        """
+        self.api_url = api_url.rstrip("/")
+        self.url = f"{self.api_url}/questions"
+        self.session = session or _stackexchange_session()
+        self.cache = cache
+        self.timeout = timeout
+        self.max_answer_pages = max_answer_pages
+        self.num_requests = 0
         self.questions = []
 
-    def get_stack_questions(self, min_upvotes=10):
-        params = {
-            "order": "desc",
-            "sort": "votes",  # Sorting by votes means that it's likely that the same questions will be fetched again
-            "site": "stackoverflow",
-            "pagesize": 100,  # Fetch 100 questions per API call
-            "page": random.randint(1, 5),
-        }
+    def request(self, path: str, params: dict) -> dict:
+        """Makes an API request and returns the parsed JSON response. Waits for any backoff which the API asked for."""
+        global _backoff_until
+        delay = _backoff_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
 
-        # Fetch questions
-        response = requests.get(self.url, params=params)
+        response = self.session.get(f"{self.api_url}/{path}", params={"site": "stackoverflow", **params}, timeout=self.timeout)
         response.raise_for_status()
+        self.num_requests += 1
+
+        result = response.json()
+        if "backoff" in result:
+            bt.logging.warning(f"StackExchange API asked to back off for {result['backoff']}s")
+            _backoff_until = time.time() + result["backoff"]
+        return result
+
+    def get_stack_answers(self, question_ids: List[int]) -> Dict[int, str]:
+        """Fetches the text of the highest voted answer of each question, with up to 100 question ids per request.
+
+        Answers are returned in order of decreasing votes across all questions, so pages are fetched until every question has an answer.
+        """
+        answers = {}
+        for i in range(0, len(question_ids), 100):
+            ids = question_ids[i:i + 100]
+            for page in range(1, self.max_answer_pages + 1):
+                result = self.request(
+                    f"questions/{';'.join(map(str, ids))}/answers",
+                    {"order": "desc", "sort": "votes", "filter": "withbody", "pagesize": 100, "page": page},
+                )
+                for answer in result["items"]:
+                    if answer["question_id"] not in answers:
+                        answers[answer["question_id"]] = BeautifulSoup(answer["body"], "html.parser").get_text(separator="\n")
+
+                if not result.get("has_more") or all(question_id in answers for question_id in ids):
+                    break
+        return answers
+
+    def get_stack_page(self, page: int, min_upvotes: int = 10) -> List[dict]:
+        """Returns the question and answer pairs of a page of the highest voted questions. Pairs are cached, so each page is only fetched once."""
+        key = DiskCache.make_key("stackoverflow.page", page=page, min_upvotes=min_upvotes)
+        pairs = self.cache.get(key)
+        if pairs is not None:
+            return pairs
+
+        # Sorting by votes means that it's likely that the same questions will be fetched again
+        result = self.request("questions", {"order": "desc", "sort": "votes", "pagesize": 100, "page": page})
+        # Filter questions by minimum upvotes
+        questions = [q for q in result["items"] if q["score"] >= min_upvotes]
 
-        # Parse response
-        questions = response.json()["items"]
+        answers = self.get_stack_answers([q["question_id"] for q in questions])
+        missing = [q for q in questions if q["question_id"] not in answers]
+        if missing:
+            bt.logging.warning(f"No answers found for {len(missing)} of {len(questions)} questions!")
 
-        # Filter questions by minimum upvotes
-        filtered_questions = [q for q in questions if q["score"] >= min_upvotes]
+        pairs = [
+            {"question": q["title"], "answer": answers[q["question_id"]], "question_id": q["question_id"]}
+            for q in questions if q["question_id"] in answers
+        ]
+        self.cache.set(key, pairs)
+        return pairs
+
+    def get_stack_questions(self, min_upvotes=10):
+        pairs = list(self.get_stack_page(random.randint(1, 5), min_upvotes=min_upvotes))
         # Shuffle the questions
-        random.shuffle(filtered_questions)
+        random.shuffle(pairs)
 
         # Add the questions to the list of questions
-        self.questions.extend(filtered_questions)
+        self.questions.extend(pairs)
         return
 
     def get_stack_question(self) -> dict:
         # If the list of questions is empty, fetch more questions
         if not self.questions:
             self.get_stack_questions()
-        question = self.questions.pop()
-        # Fetch the highest voted answer for the selected question
-        answer = self.get_stack_answer(question)
-        return {"question": question["title"], "answer": answer}
-
-    def get_stack_answer(self, question):
-        question_id = question["question_id"]
-        url_answers = (
-            f"https://api.stackexchange.com/2.3/questions/{question_id}/answers"
-        )
-        params_answers = {
-            "order": "desc",
-            "sort": "votes",
-            "site": "stackoverflow",
-            "filter": "withbody",  #'!9_bDDxJY5'
-        }
-        response_answers = requests.get(url_answers, params=params_answers)
-        response_answers.raise_for_status()
-        answers = response_answers.json()["items"]
-        if not answers:
-            bt.logging.warning("No answers found for the question!")
+        pair = self.questions.pop()
+        return {"question": pair["question"], "answer": pair["answer"]}
 
-        highest_voted_answer = answers[0]  # The first answer is the highest voted
-        soup = BeautifulSoup(highest_voted_answer["body"], "html.parser")
-        full_content = soup.get_text(separator="\n")
-        return full_content
+    def get_stack_answer(self, question) -> str:
+        """Fetches the highest voted answer of a single question, or returns None if it has no answers, so that the caller can retry with another question."""
+        answer = self.get_stack_answers([question["question_id"]]).get(question["question_id"])
+        if answer is None:
+            bt.logging.warning(f"No answers found for question {question['question_id']}!")
+        return answer
 
     def next(self):
         bt.logging.debug("Retrieving data from prompting.dataset...")
@@ -239,4 +504,3 @@ class StackOverflowDataset:
         info = self.get_stack_question()
         info["fetch_time"] = time.time() - t0
         return info
-
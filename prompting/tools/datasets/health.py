@@ -0,0 +1,198 @@
+# The MIT License (MIT)
+# Copyright © 2024 Yuma Rao
+# Copyright © 2023 Opentensor Foundation
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import time
+import threading
+import numpy as np
+import bittensor as bt
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass
+class DatasetHealth:
+    """Rolling fetch statistics and circuit breaker state of a single dataset."""
+
+    # (latency, number of tries, success) of the most recent fetches
+    records: Deque[Tuple[float, int, bool]]
+    state: str = CLOSED
+    consecutive_failures: int = 0
+    num_opened: int = 0
+    opened_at: float = 0
+    cooldown: float = 0
+    total_fetches: int = 0
+    total_failures: int = 0
+    # time at which the probe of a half open breaker was let through, or None if no probe is in flight
+    probe_started_at: float = None
+
+
+class HealthTracker:
+    """Tracks the latency and failure rate of each dataset and trips a circuit breaker for unhealthy ones.
+
+    The breaker opens after `max_consecutive_failures` failures in a row, or when the failure rate of the last `window` fetches
+    exceeds `max_failure_rate`. While it is open the dataset only uses its local backend and the selection weight of its tasks
+    is lowered to `open_weight`. After the cooldown a single probe is allowed (half open). A successful probe closes the breaker,
+    while a failed one opens it again with twice the cooldown, up to `max_cooldown`.
+    """
+
+    def __init__(
+        self,
+        window: int = 100,
+        min_fetches: int = 10,
+        max_failure_rate: float = 0.5,
+        max_consecutive_failures: int = 3,
+        cooldown: float = 60,
+        max_cooldown: float = 900,
+        open_weight: float = 0.1,
+    ):
+        """
+        Args:
+            window (int, optional): Number of recent fetches which the statistics are computed over. Defaults to 100.
+            min_fetches (int, optional): Minimum number of fetches before the failure rate can open the breaker. Defaults to 10.
+            max_failure_rate (float, optional): Failure rate above which the breaker opens. Defaults to 0.5.
+            max_consecutive_failures (int, optional): Number of failures in a row which open the breaker. Defaults to 3.
+            cooldown (float, optional): Initial time in seconds before an open breaker allows a probe. Defaults to 60.
+            max_cooldown (float, optional): Maximum cooldown in seconds. Defaults to 900.
+            open_weight (float, optional): Selection weight multiplier of datasets with an open breaker. Defaults to 0.1.
+        """
+        self.window = window
+        self.min_fetches = min_fetches
+        self.max_failure_rate = max_failure_rate
+        self.max_consecutive_failures = max_consecutive_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.open_weight = open_weight
+
+        self.datasets: Dict[str, DatasetHealth] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({ {name: health.state for name, health in self.datasets.items()} })"
+
+    def _health(self, name: str) -> DatasetHealth:
+        if name not in self.datasets:
+            self.datasets[name] = DatasetHealth(records=deque(maxlen=self.window))
+        return self.datasets[name]
+
+    def record(self, name: str, latency: float, num_tries: int, success: bool):
+        """Records the outcome of a fetch and updates the circuit breaker."""
+        with self._lock:
+            health = self._health(name)
+            health.records.append((latency, num_tries, success))
+            health.total_fetches += 1
+            health.probe_started_at = None
+
+            if success:
+                health.consecutive_failures = 0
+                if health.state != CLOSED:
+                    bt.logging.info(f"Closing circuit breaker of {name} after a successful fetch")
+                health.state = CLOSED
+                health.cooldown = 0
+                return
+
+            health.total_failures += 1
+            health.consecutive_failures += 1
+            failure_rate = self._failure_rate(health)
+            if (
+                health.state == HALF_OPEN
+                or health.consecutive_failures >= self.max_consecutive_failures
+                or (len(health.records) >= self.min_fetches and failure_rate > self.max_failure_rate)
+            ):
+                self._open(name, health)
+
+    def _open(self, name: str, health: DatasetHealth):
+        health.cooldown = min(self.max_cooldown, health.cooldown * 2 if health.cooldown else self.cooldown)
+        health.opened_at = time.time()
+        health.num_opened += 1
+        if health.state != OPEN:
+            bt.logging.warning(f"Opening circuit breaker of {name} for {health.cooldown:.0f}s: {self._stats(health)}")
+        health.state = OPEN
+
+    @staticmethod
+    def _failure_rate(health: DatasetHealth) -> float:
+        if not health.records:
+            return 0.0
+        return sum(not success for _, _, success in health.records) / len(health.records)
+
+    def state(self, name: str) -> str:
+        """Returns the breaker state of the dataset. An open breaker becomes half open once its cooldown has passed."""
+        with self._lock:
+            health = self._health(name)
+            if health.state == OPEN and time.time() - health.opened_at >= health.cooldown:
+                health.state = HALF_OPEN
+            return health.state
+
+    def is_open(self, name: str) -> bool:
+        """Whether requests to the remote backend of the dataset should be skipped.
+
+        While the breaker is half open, the first caller is let through as the probe and the others are turned away until the probe
+        is recorded. A probe which is not recorded within the cooldown is assumed to be lost, and another one is let through.
+        """
+        state = self.state(name)
+        if state != HALF_OPEN:
+            return state == OPEN
+
+        with self._lock:
+            health = self._health(name)
+            now = time.time()
+            if health.probe_started_at is not None and now - health.probe_started_at < health.cooldown:
+                return True
+            health.probe_started_at = now
+            return False
+
+    def weight(self, name: str) -> float:
+        """Selection weight multiplier of the tasks which use the dataset."""
+        return self.open_weight if self.state(name) == OPEN else 1.0
+
+    def _stats(self, health: DatasetHealth) -> Dict[str, float]:
+        latencies = np.array([latency for latency, _, _ in health.records]) if health.records else np.zeros(1)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {
+            "latency_p50": float(p50),
+            "latency_p90": float(p90),
+            "latency_p99": float(p99),
+            "failure_rate": self._failure_rate(health),
+            "mean_tries": float(np.mean([tries for _, tries, _ in health.records])) if health.records else 0.0,
+            "fetches": health.total_fetches,
+            "failures": health.total_failures,
+            "circuit_open": health.state == OPEN,
+            "circuit_opened": health.num_opened,
+        }
+
+    def stats(self, name: str) -> Dict[str, float]:
+        """Returns the rolling latency percentiles, failure rate and retry count of the dataset."""
+        self.state(name)
+        with self._lock:
+            return self._stats(self._health(name))
+
+    def state_dict(self) -> Dict[str, float]:
+        """Flat metrics of all tracked datasets, e.g. `health_WikiDataset_latency_p90`, for logging in events."""
+        return {
+            f"health_{name}_{key}": value
+            for name in list(self.datasets)
+            for key, value in self.stats(name).items()
+        }
+
+
+# Shared by all dataset instances, as a new dataset is created for each task
+HEALTH = HealthTracker()
@@ -0,0 +1,234 @@
+# The MIT License (MIT)
+# Copyright © 2024 Yuma Rao
+# Copyright © 2023 Opentensor Foundation
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import re
+import sys
+import requests
+from typing import Dict, List, Tuple
+from requests.adapters import HTTPAdapter
+from wikipedia.exceptions import DisambiguationError, PageError, RedirectError, WikipediaException
+
+API_URL = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = "prompting (https://github.com/opentensor/prompting)"
+# Maximum number of random titles which the API returns per request
+RANDOM_LIMIT = 500
+
+# Section headings in the plain text extract, e.g. "== History ==" or "=== Early life ==="
+SECTION_PATTERN = re.compile(r'^(={2,})[ \t]*(.+?)[ \t]*\1[ \t]*$', re.MULTILINE)
+
+
+def parse_sections(content: str) -> Dict[str, Tuple[int, int]]:
+    """Split the page content into sections in a single pass.
+
+    Args:
+        content (str): Plain text content of a Wikipedia page.
+    Returns:
+        dict: maps each section title to the (start, end) offsets of its text in content. The text of a section runs until the next heading of any level, so sections which only contain subsections are empty. If a title occurs more than once the first occurrence is used, as in `WikipediaPage.section`.
+    """
+    index = {}
+    matches = list(SECTION_PATTERN.finditer(content))
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match else len(content)
+        index.setdefault(match.group(2), (match.end(), end))
+    return index
+
+
+class WikiPage:
+    """Compact page record with the fields that the wiki datasets use. Mirrors the interface of `wikipedia.WikipediaPage`.
+
+    The content is kept as a single string, and sections and the summary are stored as offsets into it.
+    """
+
+    __slots__ = ("title", "pageid", "url", "content", "section_offsets", "summary_end", "links", "categories", "length")
+
+    def __init__(
+        self,
+        title: str,
+        pageid: int,
+        url: str,
+        content: str,
+        links: Tuple[str] = (),
+        categories: Tuple[str] = (),
+        section_offsets: Dict[str, Tuple[int, int]] = None,
+    ):
+        self.title = title
+        self.pageid = pageid
+        self.url = url
+        self.content = content
+        self.links = tuple(links)
+        self.categories = tuple(categories)
+        self.section_offsets = parse_sections(content) if section_offsets is None else section_offsets
+
+        match = SECTION_PATTERN.search(content)
+        self.summary_end = match.start() if match else len(content)
+        self.length = len(content.split())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(title={self.title!r}, pageid={self.pageid!r}, url={self.url!r})"
+
+    @property
+    def sections(self) -> List[str]:
+        return list(self.section_offsets.keys())
+
+    @property
+    def summary(self) -> str:
+        """The introduction of the page, which is the text before the first heading."""
+        return self.content[:self.summary_end].strip()
+
+    def section(self, section_title: str) -> str:
+        start, end = self.section_offsets.get(section_title, (None, None))
+        if start is None:
+            return None
+        return self.content[start:end].strip()
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the record in bytes."""
+        return (
+            sys.getsizeof(self.content)
+            + sum(map(sys.getsizeof, self.links))
+            + sum(map(sys.getsizeof, self.categories))
+            + sys.getsizeof(self.section_offsets)
+            + sum(sys.getsizeof(title) + 64 for title in self.section_offsets)
+            + sys.getsizeof(self.links)
+            + sys.getsizeof(self.categories)
+            + sys.getsizeof(self.title)
+            + sys.getsizeof(self.url)
+            + 128
+        )
+
+
+class MediaWikiClient:
+    """Fetches Wikipedia pages from the MediaWiki API.
+
+    Content, links, categories and page info are requested in a single combined query, and the continuations that are needed for
+    pages with many links or categories are followed with the largest allowed batch sizes. Connections are pooled.
+    """
+
+    def __init__(self, api_url: str = API_URL, session: requests.Session = None, timeout: float = 10, pool_size: int = 16):
+        """
+        Args:
+            api_url (str, optional): MediaWiki API endpoint. Defaults to the English Wikipedia.
+            session (requests.Session, optional): Session to use for requests. Defaults to a new pooled session.
+            timeout (float, optional): Timeout of each request in seconds. Defaults to 10.
+            pool_size (int, optional): Number of pooled connections. Defaults to 16.
+        """
+        self.api_url = api_url
+        self.timeout = timeout
+        self.num_requests = 0
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+        self.session = session
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(api_url={self.api_url!r})"
+
+    def request(self, params: Dict) -> Dict:
+        """Makes a single API request and returns the parsed JSON response."""
+        params = {"action": "query", "format": "json", "formatversion": 2, **params}
+        response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        self.num_requests += 1
+
+        result = response.json()
+        if "error" in result:
+            raise WikipediaException(result["error"].get("info", result["error"]))
+        return result
+
+    def query(self, params: Dict) -> Dict:
+        """Runs a query and follows all continuations, merging the results of each batch into a single response."""
+        result = self.request(params)
+        pages = {page.get("pageid", page.get("title")): page for page in result.get("query", {}).get("pages", [])}
+
+        while "continue" in result:
+            result = self.request({**params, **result["continue"]})
+            for page in result.get("query", {}).get("pages", []):
+                merged = pages.setdefault(page.get("pageid", page.get("title")), {})
+                for key, value in page.items():
+                    if isinstance(value, list):
+                        merged.setdefault(key, []).extend(value)
+                    else:
+                        merged.setdefault(key, value)
+
+        query = result.get("query", {})
+        query["pages"] = list(pages.values())
+        return query
+
+    def random_titles(self, num_titles: int = RANDOM_LIMIT) -> List[str]:
+        """Fetches the titles of random articles in batches of up to `RANDOM_LIMIT`. Titles may repeat across batches."""
+        titles = []
+        while len(titles) < num_titles:
+            result = self.request({"list": "random", "rnnamespace": 0, "rnlimit": min(num_titles - len(titles), RANDOM_LIMIT)})
+            batch = [page["title"] for page in result.get("query", {}).get("random", [])]
+            if not batch:
+                break
+            titles.extend(batch)
+        return titles
+
+    def fetch_page(self, title: str = None, pageid: int = None, redirect: bool = True) -> WikiPage:
+        """Fetches the content, links and categories of a page.
+
+        Raises:
+            PageError: If the page does not exist.
+            RedirectError: If the title is a redirect and `redirect` is False.
+            DisambiguationError: If the page is a disambiguation page. The options are the links of the page.
+        """
+        if title is None and pageid is None:
+            raise ValueError("Either a title or a pageid must be specified")
+
+        params = {
+            "prop": "extracts|links|categories|info|pageprops",
+            "explaintext": 1,
+            "exsectionformat": "wiki",
+            "pllimit": "max",
+            "plnamespace": 0,
+            "cllimit": "max",
+            "inprop": "url",
+            "ppprop": "disambiguation",
+        }
+        if redirect:
+            params["redirects"] = 1
+        if pageid is not None:
+            params["pageids"] = pageid
+        else:
+            params["titles"] = title
+
+        query = self.query(params)
+        if not query["pages"] or query["pages"][0].get("missing") or query["pages"][0].get("invalid"):
+            raise PageError(None, title) if pageid is None else PageError(pageid)
+
+        page = query["pages"][0]
+        links = [link["title"] for link in page.get("links", [])]
+        if not redirect and "redirect" in page:
+            raise RedirectError(page["title"])
+        if "disambiguation" in page.get("pageprops", {}):
+            raise DisambiguationError(page["title"], links)
+
+        return WikiPage(
+            title=page["title"],
+            pageid=page["pageid"],
+            url=page.get("fullurl", ""),
+            content=page.get("extract", ""),
+            links=links,
+            categories=[re.sub(r"^Category:", "", category["title"]) for category in page.get("categories", [])],
+        )
@@ -0,0 +1,355 @@
+# The MIT License (MIT)
+# Copyright © 2024 Yuma Rao
+# Copyright © 2023 Opentensor Foundation
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import os
+import re
+import json
+import zlib
+import fcntl
+import struct
+import random
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+# Upper bounds (exclusive) of the line count buckets. Samples with more lines than the last bound are not stored.
+LINE_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000)
+# Each index entry holds the offset, compressed length and line count of a record
+ENTRY = struct.Struct("<QII")
+
+
+class CodeShardStore:
+    """Local store of code samples which are bucketed by language and line count.
+
+    Each bucket is a pair of append-only files: a data file of zlib-compressed JSON records and an index file of fixed size
+    entries with the offset, length and line count of each record. Samples are drawn by picking a random entry among the ones
+    which match the requested languages and line range, so no sample is ever rejected. Samples can also be drawn without
+    replacement, in which case each sample is returned at most once. The sampling state, the samples which were drawn without
+    replacement and the position in the source stream are persisted, so sampling resumes where it stopped after a restart. Appends are guarded with a file lock,
+    so several processes can share a store.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        seed: int = None,
+        line_buckets: Tuple[int] = LINE_BUCKETS,
+        compress_level: int = 6,
+        save_every: int = 100,
+    ):
+        """
+        Args:
+            path (str): Directory of the store. Created if it does not exist.
+            seed (int, optional): Seed of the sampler, used when there is no saved sampling state. Defaults to None.
+            line_buckets (Tuple[int], optional): Upper bounds of the line count buckets. Defaults to LINE_BUCKETS.
+            compress_level (int, optional): zlib compression level. Defaults to 6.
+            save_every (int, optional): Number of samples after which the sampling state is saved. Defaults to 100.
+        """
+        self.path = os.path.expanduser(path)
+        self.line_buckets = tuple(line_buckets)
+        self.compress_level = compress_level
+        self.save_every = save_every
+        self.num_unsaved = 0
+
+        # bucket name -> (offsets, lengths, line counts)
+        self.buckets: Dict[str, Tuple[array, array, array]] = {}
+        # (bucket, min lines, max lines) -> (number of scanned entries, indices of the matching entries)
+        self._filtered: Dict[Tuple[str, int, int], Tuple[int, List[int]]] = {}
+        # (languages, min lines, max lines) -> (number of scanned entries of each bucket, entries which have not been drawn)
+        self._pools: Dict[Tuple[tuple, int, int], Tuple[Dict[str, int], List[Tuple[str, int]]]] = {}
+        # entries which have been drawn without replacement
+        self.drawn: Set[Tuple[str, int]] = set()
+        self._lock = threading.Lock()
+
+        self.state = self._load_state()
+        self.rng = random.Random(seed)
+        if "rng" in self.state:
+            version, internal, gauss = self.state["rng"]
+            self.rng.setstate((version, tuple(internal), gauss))
+        self.drawn = self._drawn_entries(self.state)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r}, samples={len(self)})"
+
+    def __len__(self):
+        self._refresh()
+        return sum(len(offsets) for offsets, _, _ in self.buckets.values())
+
+    @property
+    def consumed(self) -> int:
+        """Number of items of the source stream which have been processed."""
+        return self.state.get("consumed", 0)
+
+    def bucket_name(self, language: str, num_lines: int) -> str:
+        """Returns the name of the bucket of a sample, e.g. 'C++.20-50', or None if the sample has too many lines."""
+        low = 0
+        for high in self.line_buckets:
+            if num_lines < high:
+                return f"{language}.{low}-{high}"
+            low = high
+
+    @staticmethod
+    def _parse_bucket(name: str) -> Tuple[str, int, int]:
+        language, bounds = name.rsplit(".", 1)
+        low, high = bounds.split("-")
+        return language, int(low), int(high)
+
+    def _file(self, name: str, ext: str) -> str:
+        # language names such as 'C++' are not safe file names
+        return os.path.join(self.path, re.sub(r"[^\w.-]", lambda m: f"%{ord(m.group()):02x}", name) + ext)
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_state(self) -> dict:
+        try:
+            with open(os.path.join(self.path, "state.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _drawn_entries(state: dict) -> Set[Tuple[str, int]]:
+        return {(name, i) for name, indices in state.get("drawn", {}).items() for i in indices}
+
+    def update_state(self, **changes):
+        """Merges changes into the persisted state, which may have been updated by other processes. Increments are added to
+        'consumed', and 'drawn' entries are added to the ones which were saved."""
+        with self._file_lock():
+            state = self._load_state()
+            if "consumed" in changes:
+                changes["consumed"] += state.get("consumed", 0)
+            if "drawn" in changes:
+                drawn = self._drawn_entries(state) | set(changes["drawn"])
+                changes["drawn"] = {}
+                for name, i in sorted(drawn):
+                    changes["drawn"].setdefault(name, []).append(i)
+            state.update(changes)
+
+            path = os.path.join(self.path, "state.json")
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, path)
+        self.state = state
+
+    def save_state(self):
+        """Saves the sampling state and the drawn samples, so that a restarted store continues the same sequence of samples and
+        does not draw the same samples again."""
+        with self._lock:
+            drawn = list(self.drawn)
+        self.update_state(rng=self.rng.getstate(), drawn=drawn)
+        self.num_unsaved = 0
+
+    def _refresh(self):
+        """Loads the index entries which were appended since the last call, including the ones written by other processes."""
+        if not os.path.isdir(self.path):
+            return
+
+        with self._lock:
+            for entry in os.scandir(self.path):
+                if not entry.name.endswith(".idx"):
+                    continue
+                name = re.sub(r"%([0-9a-f]{2})", lambda m: chr(int(m.group(1), 16)), entry.name[:-len(".idx")])
+                offsets, lengths, lines = self.buckets.setdefault(name, (array("Q"), array("I"), array("I")))
+                if entry.stat().st_size < (len(offsets) + 1) * ENTRY.size:
+                    continue
+
+                with open(entry.path, "rb") as f:
+                    f.seek(len(offsets) * ENTRY.size)
+                    data = f.read()
+                # ignore a partially written entry
+                data = data[:len(data) - len(data) % ENTRY.size]
+                for offset, length, num_lines in ENTRY.iter_unpack(data):
+                    offsets.append(offset)
+                    lengths.append(length)
+                    lines.append(num_lines)
+
+    def add(self, samples: Iterable[Dict], consumed: int = 0, **state) -> int:
+        """Appends samples to their buckets.
+
+        Args:
+            samples (Iterable[Dict]): Samples with at least the 'language' and 'code' fields.
+            consumed (int, optional): Number of source stream items which produced the samples. Defaults to 0.
+            **state: Other changes to the persisted state, such as the position in the source stream.
+
+        Returns:
+            int: The number of samples which were stored.
+        """
+        records = {}
+        for sample in samples:
+            num_lines = len(sample["code"].splitlines())
+            name = self.bucket_name(sample["language"], num_lines)
+            if name is not None:
+                records.setdefault(name, []).append((num_lines, zlib.compress(json.dumps(sample).encode(), self.compress_level)))
+
+        with self._file_lock():
+            for name, bucket in records.items():
+                with open(self._file(name, ".bin"), "ab") as data, open(self._file(name, ".idx"), "ab") as index:
+                    offset = data.seek(0, os.SEEK_END)
+                    for num_lines, record in bucket:
+                        data.write(record)
+                        index.write(ENTRY.pack(offset, len(record), num_lines))
+                        offset += len(record)
+
+
+        if consumed or state:
+            self.update_state(consumed=consumed, **state)
+        return sum(len(bucket) for bucket in records.values())
+
+    def sizes(self) -> Dict[str, int]:
+        """Number of samples in each bucket."""
+        self._refresh()
+        with self._lock:
+            return {name: len(offsets) for name, (offsets, _, _) in self.buckets.items()}
+
+    def num_lines(self, name: str, i: int) -> int:
+        return self.buckets[name][2][i]
+
+    def read(self, name: str, i: int) -> Dict:
+        """Reads sample i of a bucket."""
+        offsets, lengths, _ = self.buckets[name]
+        with open(self._file(name, ".bin"), "rb") as f:
+            f.seek(offsets[i])
+            return json.loads(zlib.decompress(f.read(lengths[i])))
+
+    def _matches(self, name: str, languages: List[str], min_lines: int, max_lines: int) -> bool:
+        """Whether some samples of the bucket may match the languages and line range."""
+        language, low, high = self._parse_bucket(name)
+        return not (languages and language not in languages) and high > min_lines and low <= max_lines
+
+    def _candidates(self, languages: List[str], min_lines: int, max_lines: int) -> List[Tuple[str, List[int], int]]:
+        """Returns (bucket, indices, count) for each bucket with matching samples. Indices is None if the whole bucket matches."""
+        # buckets may be added by a concurrent refresh
+        with self._lock:
+            buckets = list(self.buckets.items())
+
+        candidates = []
+        for name, (_, _, lines) in buckets:
+            if not lines or not self._matches(name, languages, min_lines, max_lines):
+                continue
+
+            _, low, high = self._parse_bucket(name)
+            # line counts are appended last, so every entry which they cover is complete
+            if min_lines <= low and high - 1 <= max_lines:
+                candidates.append((name, None, len(lines)))
+            else:
+                indices = self._filter(name, min_lines, max_lines)
+                if indices:
+                    candidates.append((name, indices, len(indices)))
+        return candidates
+
+    def _filter(self, name: str, min_lines: int, max_lines: int) -> List[int]:
+        """Indices of the samples of a bucket which are within the line range. Only new entries are scanned on repeated calls."""
+        lines = self.buckets[name][2]
+        scanned, indices = self._filtered.get((name, min_lines, max_lines), (0, []))
+        indices = indices + [i for i in range(scanned, len(lines)) if min_lines <= lines[i] <= max_lines]
+        self._filtered[(name, min_lines, max_lines)] = (len(lines), indices)
+        return indices
+
+    def count(self, languages: List[str] = None, min_lines: int = 0, max_lines: int = None) -> int:
+        """Number of stored samples which match the languages and line range."""
+        self._refresh()
+        max_lines = self.line_buckets[-1] if max_lines is None else max_lines
+        return sum(count for _, _, count in self._candidates(languages, min_lines, max_lines))
+
+    def _pool(self, languages: List[str], min_lines: int, max_lines: int) -> List[Tuple[str, int]]:
+        """Entries which match the languages and line range and have not been drawn. Only new entries are scanned on repeated calls.
+        Must be called with the lock held."""
+        scanned, pool = self._pools.setdefault((tuple(languages or ()), min_lines, max_lines), ({}, []))
+        for name, (offsets, _, lines) in self.buckets.items():
+            if not self._matches(name, languages, min_lines, max_lines):
+                continue
+            pool.extend(
+                (name, i) for i in range(scanned.get(name, 0), len(offsets))
+                if min_lines <= lines[i] <= max_lines and (name, i) not in self.drawn
+            )
+            scanned[name] = len(offsets)
+        return pool
+
+    def remaining(self, languages: List[str] = None, min_lines: int = 0, max_lines: int = None) -> int:
+        """Number of matching samples which have not been drawn without replacement."""
+        self._refresh()
+        max_lines = self.line_buckets[-1] if max_lines is None else max_lines
+        with self._lock:
+            return len(self._pool(languages, min_lines, max_lines))
+
+    def sample(self, languages: List[str] = None, min_lines: int = 0, max_lines: int = None, replace: bool = True) -> Dict:
+        """Draws a uniformly random sample which matches the languages and line range, or None if there is none.
+
+        If `replace` is False, samples which were already drawn without replacement are skipped, and None is returned once all
+        matching samples have been drawn.
+        """
+        self._refresh()
+        max_lines = self.line_buckets[-1] if max_lines is None else max_lines
+        if not replace:
+            return self._sample_without_replacement(languages, min_lines, max_lines)
+
+        candidates = self._candidates(languages, min_lines, max_lines)
+        total = sum(count for _, _, count in candidates)
+        if not total:
+            return None
+
+        k = self.rng.randrange(total)
+        for name, indices, count in candidates:
+            if k < count:
+                break
+            k -= count
+
+        self._sampled()
+        return self.read(name, k if indices is None else indices[k])
+
+    def _sample_without_replacement(self, languages: List[str], min_lines: int, max_lines: int) -> Dict:
+        with self._lock:
+            pool = self._pool(languages, min_lines, max_lines)
+            entry = None
+            while pool:
+                # swap a random entry to the end, so that it is removed in constant time
+                j = self.rng.randrange(len(pool))
+                pool[j], pool[-1] = pool[-1], pool[j]
+                entry = pool.pop()
+                # the entry may have been drawn from the pool of another line range
+                if entry not in self.drawn:
+                    self.drawn.add(entry)
+                    break
+                entry = None
+
+        if entry is None:
+            return None
+        self._sampled()
+        return self.read(*entry)
+
+    def _sampled(self):
+        # the sampling state is saved periodically rather than after each sample, which would be a locked disk write
+        self.num_unsaved += 1
+        if self.num_unsaved >= self.save_every:
+            self.save_state()
+
+    def __iter__(self) -> Iterator[Dict]:
+        self._refresh()
+        for name, (offsets, _, _) in list(self.buckets.items()):
+            for i in range(len(offsets)):
+                yield self.read(name, i)
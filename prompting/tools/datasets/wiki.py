@@ -16,63 +16,232 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import os
 import re
-import sys
+import heapq
 import random
+import time
 import datetime
+import threading
 import bittensor as bt
 import wikipedia as wiki
-from typing import Dict, Union, List, Tuple
+from typing import Callable, Dict, List, Tuple
+from collections import OrderedDict, deque
 
 from functools import lru_cache
 from .base import Dataset
 from ..selector import Selector
+from .mediawiki import MediaWikiClient, WikiPage
+from prompting.utils.cache import DiskCache, LRUCache, disk_cache, memory_cache, CACHE_DIR
+from prompting.utils.index import SearchIndex
+
+# Persistent cache of API responses which is shared between processes and survives restarts
+WIKI_CACHE = DiskCache(path=os.path.join(CACHE_DIR, "wiki.sqlite"), ttl=7 * 24 * 3600, max_bytes=1024 * 2**20)
+# In-memory cache of compact page records, bounded by their total size rather than their number
+PAGE_CACHE = LRUCache(max_bytes=256 * 2**20, sizeof=lambda page: page.nbytes)
+WIKI_CLIENT = MediaWikiClient()
+
+# Number of most relevant links that are kept in cached page records
+MAX_LINKS = 100
 
 # speed up page loading
-@lru_cache(maxsize=1000)
-def _get_page(title, pageid=None, auto_suggest=False, redirect=True, seed=None) -> wiki.WikipediaPage:
-    """Cached Wikipedia page loading.
+@memory_cache(PAGE_CACHE)
+@disk_cache(WIKI_CACHE, namespace="page.v3")
+def _get_page(title, pageid=None, auto_suggest=False, redirect=True, seed=None, max_links=MAX_LINKS) -> WikiPage:
+    """Cached Wikipedia page loading. Content, links and categories are fetched in one batched API query and stored as a compact record.
+
+    Args:
+        max_links (int, optional): Number of most relevant links to keep. If None, all links are kept. Defaults to MAX_LINKS.
     """
     try:
-        page = wiki.page(title=title, pageid=pageid, auto_suggest=auto_suggest, redirect=redirect)
-        # create sections manually if not found
-        if not page.sections:
-            page._sections = [line.strip('= ') for line in page.content.splitlines() if re.search(r'=+\s+.*\s+=+',line)]
-        return page
+        page = WIKI_CLIENT.fetch_page(title=title, pageid=pageid, redirect=redirect)
+        bt.logging.debug(f"Loaded page {page.title!r} ({page.nbytes} bytes). Page cache: {PAGE_CACHE}")
+        return compact_page(page, max_links=max_links)
 
     except wiki.DisambiguationError as e:
         bt.logging.debug(f"{e.__class__.__name__} loading page {title!r}: {e}")
-        # exc info contains a tuple of (requested_title: str, possible_matches: List[str])
-        pages = sys.exc_info()[1].args[1]
-        if not type(pages) == list:
+        # the options of a disambiguation page are its links
+        pages = e.options
+        if not pages:
             return None
         title = random.Random(seed).choice(pages)
-        return _get_page(title, auto_suggest=auto_suggest, redirect=redirect)
+        return _get_page(title, auto_suggest=auto_suggest, redirect=redirect, max_links=max_links)
 
     except wiki.PageError as e:
         bt.logging.warning(f"{e.__class__.__name__} loading page {title!r}: {e}")
-        if not auto_suggest:
-            return _get_page(title, auto_suggest=True, redirect=redirect)
+        if not auto_suggest and title is not None:
+            results = _wiki_search(title, results=1)
+            if results:
+                return _get_page(results[0], auto_suggest=True, redirect=redirect, max_links=max_links)
         return None
 
 @lru_cache(maxsize=1000)
+@disk_cache(WIKI_CACHE, namespace="random")
 def _get_random_titles(pages=10, seed=42) -> List:
     """Cached wikipedia random page. Approximately deterministic random titles. This is useful for testing.
-    NOTE: the actually cached result will change each session, but the result will be the same within a session.
+    NOTE: the result is persisted in the disk cache, so it is the same across sessions until the entry expires.
     """
     return wiki.random(pages=pages)
 
 @lru_cache(maxsize=1000)
+@disk_cache(WIKI_CACHE, namespace="search")
 def _wiki_search(name, results) -> List:
     """Cached Wikipedia search.
     """
     return wiki.search(name, results=results)
 
+class TitlePool:
+    """Pool of random page titles which are fetched in bulk and refilled in the background.
+
+    Titles which are known to have no valid sections are remembered and never handed out again.
+    """
+
+    def __init__(self, fetch: Callable[[int], List[str]], size: int = 500, low_water: int = 100, max_failed: int = 100_000):
+        """
+        Args:
+            fetch (Callable[[int], List[str]]): Function which returns the given number of random titles.
+            size (int, optional): Number of titles which are fetched per refill. Defaults to 500.
+            low_water (int, optional): A background refill starts when fewer titles are left. Defaults to 100.
+            max_failed (int, optional): Maximum number of failed titles which are remembered. Defaults to 100_000.
+        """
+        self.fetch = fetch
+        self.size = size
+        self.low_water = low_water
+        self.titles = deque()
+        self.failed = OrderedDict()
+        self.max_failed = max_failed
+        self.num_refills = 0
+        self._lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(titles={len(self.titles)}, failed={len(self.failed)}, refills={self.num_refills})"
+
+    def refill(self):
+        """Fetches a batch of titles and adds the ones which are not known to fail. Concurrent refills are skipped."""
+        if not self._refill_lock.acquire(blocking=False):
+            return
+        try:
+            titles = self.fetch(self.size)
+            with self._lock:
+                self.titles.extend(title for title in titles if title not in self.failed)
+                self.num_refills += 1
+        except Exception as e:
+            bt.logging.warning(f"Failed to refill {self}: {e}")
+        finally:
+            self._refill_lock.release()
+
+    def pop(self) -> str:
+        """Returns a random title. Blocks on a refill only if the pool is empty."""
+        while True:
+            with self._lock:
+                title = self.titles.popleft() if self.titles else None
+                remaining = len(self.titles)
+
+            if title is None:
+                # wait for a running refill to finish before starting a new one
+                with self._refill_lock:
+                    pass
+                if not self.titles:
+                    self.refill()
+                if not self.titles:
+                    raise wiki.WikipediaException(f"Could not fetch random titles for {self}")
+                continue
+
+            if remaining < self.low_water and not self._refill_lock.locked():
+                threading.Thread(target=self.refill, daemon=True, name="title-pool").start()
+
+            if title not in self.failed:
+                return title
+
+    def mark_failed(self, title: str):
+        """Remembers that the title has no valid sections, so that it is not returned again."""
+        with self._lock:
+            self.failed[title] = None
+            self.failed.move_to_end(title)
+            while len(self.failed) > self.max_failed:
+                self.failed.popitem(last=False)
+
+
+# Shared by all dataset instances, as a new dataset is created for each task
+TITLE_POOL = TitlePool(fetch=WIKI_CLIENT.random_titles)
+
+
+# Local full-text indices so that search does not need the live API. Articles are indexed by title and summary, date pages by event.
+WIKI_INDEX = SearchIndex(max_docs=200_000)
+DATE_INDEX = SearchIndex()
+DATE_PATTERN = re.compile(r'^(January|February|March|April|May|June|July|August|September|October|November|December) \d{1,2}$')
+# Maximum number of pages in the persistent cache which are indexed after a restart
+MAX_CACHED_PAGES = 20_000
+_INDEXED_DATES = set()
+_INDEX_LOCK = threading.Lock()
+_cache_indexed = False
+
+
+def index_page(page: WikiPage):
+    """Adds a page to the local search indices. Date pages are only added to the date index. Pages which are already indexed are skipped."""
+    if not DATE_PATTERN.match(page.title):
+        if page.title not in WIKI_INDEX:
+            WIKI_INDEX.add(page.title, ' '.join([page.title, page.title, page.summary, *page.sections, *page.categories]))
+
+    elif page.title not in _INDEXED_DATES:
+        _INDEXED_DATES.add(page.title)
+        for (header, section_title), lines in WikiDateDataset.event_sections(page).items():
+            for line in lines:
+                DATE_INDEX.add((page.title, header, section_title, line), ' '.join([line, section_title, page.title]))
+
+
+def _index_cache(max_pages: int):
+    t0 = time.time()
+    num_pages = 0
+    for value in WIKI_CACHE.values():
+        if isinstance(value, WikiPage):
+            index_page(value)
+            num_pages += 1
+            if num_pages >= max_pages:
+                break
+    bt.logging.debug(f"Indexed {num_pages} cached pages in {time.time() - t0:.2f}s: {WIKI_INDEX}, {DATE_INDEX}")
+
+
+def index_cached_pages(max_pages: int = MAX_CACHED_PAGES) -> threading.Thread:
+    """Indexes up to `max_pages` pages of the persistent cache, so that a restarted validator can search offline.
+
+    This runs once per process in a background thread, so searches do not wait for it and are answered from the pages which
+    have been indexed so far. Returns the thread on the first call and None afterwards.
+    """
+    global _cache_indexed
+    with _INDEX_LOCK:
+        if _cache_indexed:
+            return None
+        _cache_indexed = True
+
+    thread = threading.Thread(target=_index_cache, args=(max_pages,), daemon=True, name="wiki-index")
+    thread.start()
+    return thread
+
+
+def compact_page(page: WikiPage, max_links: int = MAX_LINKS) -> WikiPage:
+    """Returns a copy of the page which only keeps the most relevant links and the categories which are used as tags."""
+    links = page.links if max_links is None else most_relevant_links(page, num_links=max_links)
+    return WikiPage(
+        title=page.title,
+        pageid=page.pageid,
+        url=page.url,
+        content=page.content,
+        links=links,
+        categories=filter_categories(page.categories, exclude=WikiDataset.EXCLUDE_CATEGORIES),
+        section_offsets=page.section_offsets,
+    )
+
+
 def process_page(page, valid_header: callable = None, valid_content: callable = None) -> Dict:
     """Process a Wikipedia page and return a dictionary of sections with their content.
 
     Args:
-        page: wikipedia.WikipediaPage
+        page: WikiPage
         valid_header: callable to determine if a section header is valid
         valid_content: callable to determine if a section content is valid
     Returns:
@@ -103,25 +272,37 @@ def process_page(page, valid_header: callable = None, valid_content: callable =
 
 def most_relevant_links(page, num_links=10, num_summary_words=50, return_scores=False):
     """Return the most relevant links to a Wikipedia page based on the intersection over union (IOU) of the link and the page summary."""
-    link_scores = {}
-    summary_words = set(page.summary.split()[:num_summary_words])
-    for link in page.links:
-        link_words = set(link.split())
-        iou = len(summary_words.intersection(link_words)) / len(summary_words.union(link_words))
-        link_scores[link] = iou / len(link.split())
-
-    sorted_links = sorted(link_scores.items(), key=lambda x: x[1], reverse=True)
+    summary_words = frozenset(page.summary.split()[:num_summary_words])
+
+    def score(link):
+        words = link.split()
+        link_words = set(words)
+        intersection = sum(word in summary_words for word in link_words)
+        union = len(summary_words) + len(link_words) - intersection
+        return intersection / union / len(words) if union else 0.0
+
+    # nlargest is equivalent to a stable descending sort, so ties keep their original order.
+    # This also means that ranking the links of a compact page gives the same result as ranking all links.
+    sorted_links = heapq.nlargest(num_links, ((link, score(link)) for link in page.links), key=lambda x: x[1])
     if return_scores:
-        return sorted_links[:num_links]
+        return sorted_links
+
+    return [link for link, _ in sorted_links]
+
+
+@lru_cache(maxsize=128)
+def _compile_patterns(patterns: Tuple[str]) -> re.Pattern:
+    return re.compile('|'.join(patterns), re.IGNORECASE)
 
-    return [link for link, _ in sorted_links[:num_links]]
 
 def filter_categories(categories, exclude=None, include=None):
     """Filter categories based on a list of categories to exclude and/or include."""
     if exclude:
-        categories = [cat for cat in categories if not re.search('|'.join(exclude), cat,re.IGNORECASE)]
+        pattern = _compile_patterns(tuple(exclude))
+        categories = [cat for cat in categories if not pattern.search(cat)]
     if include:
-        categories = [cat for cat in categories if re.search('|'.join(include), cat,re.IGNORECASE)]
+        pattern = _compile_patterns(tuple(include))
+        categories = [cat for cat in categories if pattern.search(cat)]
     return categories
 
 class WikiDataset(Dataset):
@@ -130,18 +311,27 @@ class WikiDataset(Dataset):
     EXCLUDE_HEADERS = ('See also', 'References', 'Further reading', 'External links')
     EXCLUDE_CATEGORIES = ('articles', 'wiki', 'pages', 'cs1')
 
+    # Many random pages have no valid sections, so fire several fetches at once
+    speculative_fetches = 4
+    # Each random page yields several contexts, which are buffered for later calls
+    max_spares = 16
+    max_consecutive_per_title = 2
+
     def __init__(
         self,
         min_length_words: int = 50,
         max_links: int = 10,
+        contexts_per_page: int = 3,
     ):
         """
         Args:
             min_length_words (int, optional): Minimum section length. Defaults to 50.
             max_links (int, optional): _description_. Defaults to 10.
+            contexts_per_page (int, optional): Maximum number of contexts which are extracted from each random page. Defaults to 3.
         """
         self.min_length_words = min_length_words
         self.max_links = max_links
+        self.contexts_per_page = contexts_per_page
 
 
     def get(self, name: str, selector: Selector = None, include: List = None, exclude: List = None, **kwargs) -> Dict:
@@ -159,10 +349,34 @@ class WikiDataset(Dataset):
         Returns:
             Dict: _description_
         """
+        contexts = self.get_contexts(name, selector=selector, include=include, exclude=exclude, max_contexts=1, **kwargs)
+        return contexts[0] if contexts else None
+
+    def get_contexts(
+        self,
+        name: str,
+        selector: Selector = None,
+        include: List = None,
+        exclude: List = None,
+        max_contexts: int = None,
+        **kwargs,
+    ) -> List[Dict]:
+        """Get a specified Wikipedia page and extract up to `max_contexts` distinct sections based on the selector.
+
+        Args:
+            name (str): Title of the page.
+            selector (Selector, optional): Selector used to pick each section. Defaults to None.
+            include (List, optional): Headers to include. Defaults to None.
+            exclude (List, optional): Headers to exclude. Defaults to None.
+            max_contexts (int, optional): Maximum number of contexts. Defaults to all valid sections.
 
+        Returns:
+            List[Dict]: Contexts in the order they were selected. Empty if the page has no valid sections.
+        """
         page = _get_page(title=name, **kwargs)
         if page is None:
-            return None
+            return []
+        index_page(page)
 
         # Only return a sections with a minimum number of words
         exclude = (exclude or []) + list(self.EXCLUDE_HEADERS)
@@ -170,35 +384,68 @@ class WikiDataset(Dataset):
                                 valid_header=lambda x: x not in exclude and (not include or x in include),
                                 valid_content=lambda x: len(x.split())>=self.min_length_words
                                 )
-        if not sections:
-            return None
 
-        key = header, section_title = selector(list(sections.keys()))
-        content = '\n'.join(sections[key])
-        section_length = len(content.split())
-        return {
-            "title": name, # title of wiki article
-            "topic": header or section_title, # title of wiki section
-            'subtopic': section_title,
-            'content': content,
-            'internal_links': list(filter(lambda x: x not in exclude, page.sections)),
-            'external_links': most_relevant_links(page, num_links=self.max_links), 
-            'tags': filter_categories(page.categories, exclude=self.EXCLUDE_CATEGORIES),
-            'source': 'Wikipedia',
-            'extra': {'url': page.url, 'page_length': len(page.content.split()), 'section_length': section_length},
-        }
+        # Fields which are shared by all sections of the page
+        internal_links = list(filter(lambda x: x not in exclude, page.sections))
+        external_links = most_relevant_links(page, num_links=self.max_links)
+        tags = filter_categories(page.categories, exclude=self.EXCLUDE_CATEGORIES)
+
+        contexts = []
+        keys = list(sections.keys())
+        while keys and (max_contexts is None or len(contexts) < max_contexts):
+            key = header, section_title = selector(keys)
+            keys.remove(key)
+            content = '\n'.join(sections[key])
+            section_length = len(content.split())
+            contexts.append({
+                "title": name, # title of wiki article
+                "topic": header or section_title, # title of wiki section
+                'subtopic': section_title,
+                'content': content,
+                'internal_links': list(internal_links),
+                'external_links': list(external_links),
+                'tags': list(tags),
+                'source': 'Wikipedia',
+                'extra': {'url': page.url, 'page_length': page.length, 'section_length': section_length},
+            })
+        return contexts
 
     def search(self, name, results=3, selector: Selector = None) -> Dict:
-        titles = _wiki_search(name, results=results)
+        index_cached_pages()
+        titles = WIKI_INDEX.search(name, results=results)
+        if not titles:
+            # fall back to the live API for queries which do not match any local page
+            titles = _wiki_search(name, results=results)
         title = selector(titles)
         return self.get(title, selector=selector)
 
     def random(self, pages=10, seed=None, selector: Selector = None, **kwargs) -> Dict:
-        titles = wiki.random(pages=pages) if seed is None else _get_random_titles(pages=pages, seed=seed)
-        title = selector(titles)
-        return self.get(title, selector=selector)
+        contexts = self.random_contexts(pages=pages, seed=seed, selector=selector, max_contexts=1, **kwargs)
+        return contexts[0] if contexts else None
 
+    def random_contexts(self, pages=10, seed=None, selector: Selector = None, max_contexts: int = None, **kwargs) -> List[Dict]:
+        """Extracts up to `contexts_per_page` contexts from a random page, so that one fetch serves several tasks.
 
+        The page is taken from the shared title pool. If a seed is given, it is chosen from `pages` deterministic random titles instead.
+        """
+        if seed is None:
+            # random titles come from a prefetched pool, so there is no network round trip per call
+            title = TITLE_POOL.pop()
+        else:
+            title = selector(_get_random_titles(pages=pages, seed=seed))
+
+        contexts = self.get_contexts(title, selector=selector, max_contexts=max_contexts or self.contexts_per_page)
+        if not contexts:
+            TITLE_POOL.mark_failed(title)
+        return contexts
+
+    def random_local(self, selector: Selector = None, **kwargs) -> Dict:
+        """Returns a random context from a page which has already been loaded, so it is usually served from the page caches."""
+        titles = list(WIKI_INDEX.docs)
+        if not titles:
+            return None
+        contexts = self.get_contexts(random.choice(titles), selector=selector, max_contexts=1)
+        return contexts[0] if contexts else None
 
 
 class WikiDateDataset(Dataset):
@@ -207,6 +454,8 @@ class WikiDateDataset(Dataset):
     MONTHS = ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December")
     EXCLUDE_CATEGORIES = ('articles', 'wiki', 'pages', 'cs1')
 
+    speculative_fetches = 4
+
     def __init__(self, max_tries: int = 10, seed=None):
         self.max_tries = max_tries
         self.seed = seed
@@ -228,6 +477,14 @@ class WikiDateDataset(Dataset):
         # Step 2: Format the date for Wikipedia URL
         return random_date.strftime("%B %-d")  # E.g., "January 1"
 
+    @classmethod
+    def event_sections(cls, page: WikiPage) -> Dict:
+        """Returns the sections of a date page which contain event-like lines, e.g. "1999 - Some event happened"."""
+        return process_page(page,
+                            valid_header=lambda x: x in cls.INCLUDE_HEADERS,
+                            valid_content=lambda x: any([re.search(r'^\d+',line) for line in x.splitlines()])
+                            )
+
     def get(self, name, pageid=None, auto_suggest=False, redirect=False, selector: Selector = None) -> Dict:
 
         # Check that name is correctly formatted e.g., "January 1"
@@ -236,21 +493,25 @@ class WikiDateDataset(Dataset):
         assert date[0] in self.MONTHS, f"Month should be one of {self.MONTHS}, but got {date[0]!r}"
         assert date[1].isdigit(), f"Day should be a number, but got {date[1]!r}"
 
-        page = _get_page(title=name, pageid=pageid, auto_suggest=auto_suggest, redirect=redirect)
+        # keep all links as they are matched against the selected event
+        page = _get_page(title=name, pageid=pageid, auto_suggest=auto_suggest, redirect=redirect, max_links=None)
         if page is None:
             return None
+        index_page(page)
 
         # Only return a sections which contain event-like format
         # e.g. "1999 - Some event happened"
-        sections = process_page(page,
-                                valid_header=lambda x: x in self.INCLUDE_HEADERS,
-                                valid_content=lambda x: any([re.search(r'^\d+',line) for line in x.splitlines()])
-                                )
+        sections = self.event_sections(page)
         if not sections:
             return None
 
-        key = header, section_title = selector(list(sections.keys()))
+        key = selector(list(sections.keys()))
         line = selector(sections[key])
+        return self._event_context(name, page, sections, key, line)
+
+    def _event_context(self, name: str, page: WikiPage, sections: Dict, key: Tuple[str, str], line: str) -> Dict:
+        header, section_title = key
+        date = name.split(' ')
         year, *event = line.replace(u'\u2013', '-').split('-')
         links = [link for link in page.links if link in line]
 
@@ -267,9 +528,27 @@ class WikiDateDataset(Dataset):
         }
 
     def search(self, name, results=5, selector: Selector = None) -> Dict:
-        raise NotImplementedError(f"Search is not implemented for {self.__class__.__name__}")
+        """Finds events which match the query in the date pages that have been loaded or cached. Does not make any network calls."""
+        index_cached_pages()
+        hits = DATE_INDEX.search(name, results=results)
+        if not hits:
+            return None
+
+        title, header, section_title, line = selector(hits)
+        # same arguments as in `get`, so that the cached page is used
+        page = _get_page(title=title, pageid=None, auto_suggest=False, redirect=False, max_links=None)
+        if page is None:
+            return None
+        return self._event_context(title, page, self.event_sections(page), (header, section_title), line)
 
     def random(self, selector: Selector = None, **kwargs) -> Dict:
         date = self._random_date()
         return self.get(date, selector=selector)
 
+    def random_local(self, selector: Selector = None, **kwargs) -> Dict:
+        """Returns an event from a date page which has already been loaded, so it is usually served from the page caches."""
+        dates = list(_INDEXED_DATES)
+        if not dates:
+            return None
+        return self.get(self.rng.choice(dates), selector=selector)
+
@@ -1,4 +1,8 @@
 from . import config
 from . import misc
+from . import cache
+from . import index
+from . import windowing
+from . import embeddings
 from . import uids
 from . import logging
@@ -0,0 +1,311 @@
+# The MIT License (MIT)
+# Copyright © 2024 Yuma Rao
+# Copyright © 2023 Opentensor Foundation
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import os
+import sys
+import time
+import zlib
+import pickle
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Iterator
+from collections import OrderedDict
+from functools import update_wrapper
+import bittensor as bt
+
+# Directory used for persistent caches. Can be overridden so that several validators share one cache.
+CACHE_DIR = os.path.expanduser(os.environ.get("PROMPTING_CACHE_DIR", "~/.cache/prompting"))
+
+_MISSING = object()
+
+
+class DiskCache:
+    """Persistent key-value cache which is safe to share between threads and processes.
+
+    Entries are pickled, zlib-compressed and stored in a sqlite database. Entries expire after `ttl` seconds and the least
+    recently used entries are evicted once the total (compressed) size exceeds `max_bytes`.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 512 * 2**20, compress_level: int = 6):
+        """
+        Args:
+            path (str): Path of the sqlite database file. Created if it does not exist.
+            ttl (float, optional): Time-to-live of each entry in seconds. Non-positive values disable expiry. Defaults to one week.
+            max_bytes (int, optional): Maximum total size of the stored payloads. Defaults to 512 MB.
+            compress_level (int, optional): zlib compression level. Defaults to 6.
+        """
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.hits = 0
+        self.misses = 0
+
+        self._local = threading.local()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r}, ttl={self.ttl}, max_bytes={self.max_bytes})"
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared between threads or forked processes, so keep one per thread and pid
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def make_key(*args, **kwargs) -> str:
+        """Creates a stable key from the arguments of a request."""
+        return hashlib.sha1(repr((args, sorted(kwargs.items()))).encode()).hexdigest()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        conn = self._connection()
+        row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+
+        if row is None or (self.ttl > 0 and now - row[1] > self.ttl):
+            if row is not None:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.misses += 1
+            return default
+
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def set(self, key: str, value: Any):
+        payload = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), self.compress_level)
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload), now, now),
+        )
+        self.evict()
+
+    def evict(self):
+        """Removes expired entries and then the least recently used entries until the cache fits in `max_bytes`."""
+        conn = self._connection()
+        if self.ttl > 0:
+            conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+            keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+
+    def values(self) -> Iterator[Any]:
+        """Yields the values of all unexpired entries. Entries which cannot be decoded are skipped."""
+        min_created = time.time() - self.ttl if self.ttl > 0 else float("-inf")
+        for payload, in self._connection().execute("SELECT value FROM entries WHERE created >= ?", (min_created,)):
+            try:
+                yield pickle.loads(zlib.decompress(payload))
+            except (pickle.UnpicklingError, zlib.error, AttributeError, ImportError, EOFError) as e:
+                bt.logging.debug(f"Skipping undecodable entry in {self}: {e}")
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries")
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def size_bytes(self) -> int:
+        return self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
+class LRUCache:
+    """Thread-safe in-memory cache which evicts the least recently used entries once the total size of the values exceeds `max_bytes`.
+
+    Unlike `functools.lru_cache`, which bounds the number of entries, this bounds memory usage when the values vary a lot in size.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, ttl: float = -1, sizeof: Callable[[Any], int] = sys.getsizeof):
+        """
+        Args:
+            max_bytes (int, optional): Maximum total size of the cached values. Defaults to 256 MB.
+            ttl (float, optional): Time-to-live of each entry in seconds. Non-positive values disable expiry. Defaults to -1.
+            sizeof (Callable, optional): Function which returns the size of a value in bytes. Defaults to sys.getsizeof.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+
+        # key -> (value, size, created)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(entries={len(self)}, size_bytes={self.size_bytes}, max_bytes={self.max_bytes}, hit_rate={self.hit_rate:.3f})"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and time.time() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Any, value: Any):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # values that can never fit are not cached at all
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, time.time())
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Any):
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+
+def memory_cache(cache: LRUCache, cache_none: bool = False):
+    """
+    Decorator that stores the return values of a function in an `LRUCache`, keyed on the function arguments.
+
+    Args:
+        cache (LRUCache): The cache to store results in.
+        cache_none (bool): If set to True, None results are also cached. Defaults to False.
+    """
+
+    def wrapper(func: Callable) -> Callable:
+        def wrapped(*args, **kwargs) -> Any:
+            key = (args, tuple(sorted(kwargs.items())))
+            value = cache.get(key, default=_MISSING)
+            if value is not _MISSING:
+                return value
+
+            value = func(*args, **kwargs)
+            if value is not None or cache_none:
+                cache.set(key, value)
+            return value
+
+        wrapped.cache = cache
+        return update_wrapper(wrapped, func)
+
+    return wrapper
+
+
+def disk_cache(cache: DiskCache, namespace: str, cache_none: bool = False):
+    """
+    Decorator that persists the return values of a function in a `DiskCache`, keyed on the namespace and the function arguments.
+    Can be stacked under `lru_cache` so that the in-memory cache is backed by the shared on-disk cache.
+
+    Args:
+        cache (DiskCache): The cache to store results in.
+        namespace (str): Prefix that separates the keys of different functions which share a cache.
+        cache_none (bool): If set to True, None results are also cached. Defaults to False.
+
+    Example:
+        @lru_cache(maxsize=1000)
+        @disk_cache(WIKI_CACHE, namespace='search')
+        def search(query):
+            return requests.get(...).json()
+    """
+
+    def wrapper(func: Callable) -> Callable:
+        def wrapped(*args, **kwargs) -> Any:
+            key = DiskCache.make_key(namespace, *args, **kwargs)
+            try:
+                value = cache.get(key, default=_MISSING)
+            except (sqlite3.Error, pickle.UnpicklingError, zlib.error) as e:
+                bt.logging.warning(f"Failed to read {namespace!r} entry from {cache}: {e}")
+                value = _MISSING
+
+            if value is not _MISSING:
+                return value
+
+            value = func(*args, **kwargs)
+            if value is not None or cache_none:
+                try:
+                    cache.set(key, value)
+                except (sqlite3.Error, pickle.PicklingError) as e:
+                    bt.logging.warning(f"Failed to write {namespace!r} entry to {cache}: {e}")
+            return value
+
+        wrapped.cache = cache
+        return update_wrapper(wrapped, func)
+
+    return wrapper
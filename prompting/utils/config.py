@@ -287,6 +287,13 @@ def add_validator_args(cls, parser):
         default=1,
     )
 
+    parser.add_argument(
+        "--neuron.reward_workers",
+        type=int,
+        help="The number of threads which reward and penalty models are evaluated in concurrently. Values below 2 evaluate them sequentially.",
+        default=8,
+    )
+
     parser.add_argument(
         "--neuron.sample_size",
         type=int,
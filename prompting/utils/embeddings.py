@@ -0,0 +1,174 @@
+# The MIT License (MIT)
+# Copyright © 2024 Yuma Rao
+# Copyright © 2023 Opentensor Foundation
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import os
+import hashlib
+import threading
+import numpy as np
+from typing import Dict, List
+
+from prompting.utils.cache import LRUCache
+
+# Header of the disk tier: next slot, number of stored vectors, vector dimension and capacity
+HEADER = ("next", "count", "dim", "capacity")
+DIGEST_SIZE = hashlib.sha1().digest_size
+
+
+class EmbeddingCache:
+    """Two tier cache of text embeddings, keyed by a hash of the namespace and the text.
+
+    The memory tier is an `LRUCache` of float32 vectors. The optional disk tier is a ring buffer of `capacity` float16 vectors in a
+    memory-mapped file, with a parallel memory-mapped array of the key digests, so it is reloaded without reading the vectors and
+    survives restarts. Disk hits are promoted to the memory tier. The disk tier is not meant to be written by several processes.
+    """
+
+    def __init__(self, namespace: str = "", max_bytes: int = 64 * 2**20, path: str = None, capacity: int = 100_000):
+        """
+        Args:
+            namespace (str, optional): Separates the embeddings of different models, e.g. the model name. Defaults to "".
+            max_bytes (int, optional): Maximum size of the memory tier. Defaults to 64 MB.
+            path (str, optional): Directory of the disk tier. Defaults to None, which disables it.
+            capacity (int, optional): Number of vectors in the disk tier. Once it is full the oldest vectors are overwritten. Defaults to 100,000.
+        """
+        self.namespace = namespace
+        self.path = os.path.expanduser(path) if path else None
+        self.capacity = capacity
+        self.memory = LRUCache(max_bytes=max_bytes, sizeof=lambda vector: vector.nbytes + 112)
+        self.disk_hits = 0
+        self.disk_misses = 0
+
+        self._header = None
+        self._keys = None
+        self._vectors = None
+        # key digest -> slot of the disk tier
+        self._slots: Dict[bytes, int] = {}
+        self._lock = threading.Lock()
+
+        if self.path and os.path.exists(os.path.join(self.path, "header.i8")):
+            self._open()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(namespace={self.namespace!r}, path={self.path!r}, hit_rate={self.hit_rate:.3f})"
+
+    def __len__(self):
+        return len(self.memory)
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.namespace}\0{text}".encode()).digest()
+
+    def _open(self, dim: int = None):
+        """Maps the files of the disk tier, creating them with the given vector dimension if they do not exist."""
+        header_path = os.path.join(self.path, "header.i8")
+        create = not os.path.exists(header_path)
+        if create:
+            os.makedirs(self.path, exist_ok=True)
+            np.array([0, 0, dim, self.capacity], dtype=np.int64).tofile(header_path)
+
+        self._header = np.memmap(header_path, dtype=np.int64, mode="r+", shape=(len(HEADER),))
+        dim, self.capacity = int(self._header[2]), int(self._header[3])
+        mode = "w+" if create else "r+"
+        self._keys = np.memmap(os.path.join(self.path, "keys.bin"), dtype=np.uint8, mode=mode, shape=(self.capacity, DIGEST_SIZE))
+        self._vectors = np.memmap(os.path.join(self.path, "vectors.f16"), dtype=np.float16, mode=mode, shape=(self.capacity, dim))
+
+        count = int(self._header[1])
+        self._slots = {self._keys[slot].tobytes(): slot for slot in range(count)}
+
+    def get(self, text: str, key: bytes = None) -> np.ndarray:
+        """Returns the cached embedding of the text, or None. `key` is the precomputed key of the text."""
+        key = self.key(text) if key is None else key
+        vector = self.memory.get(key)
+        if vector is not None or self._vectors is None:
+            return vector
+
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                self.disk_misses += 1
+                return None
+            vector = np.asarray(self._vectors[slot], dtype=np.float32)
+            self.disk_hits += 1
+
+        self.memory.set(key, vector)
+        return vector
+
+    def set(self, text: str, vector: np.ndarray, key: bytes = None):
+        key = self.key(text) if key is None else key
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        self.memory.set(key, vector)
+        if not self.path:
+            return
+
+        with self._lock:
+            if self._vectors is None:
+                self._open(dim=len(vector))
+            if key in self._slots or len(vector) != self._vectors.shape[1]:
+                return
+
+            slot = int(self._header[0])
+            # the slot of the oldest vector is reused once the ring buffer is full
+            self._slots.pop(self._keys[slot].tobytes(), None)
+            self._vectors[slot] = vector
+            self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            self._slots[key] = slot
+            self._header[0] = (slot + 1) % self.capacity
+            self._header[1] = min(int(self._header[1]) + 1, self.capacity)
+
+    def get_many(self, texts: List[str], keys: List[bytes] = None) -> List[np.ndarray]:
+        if keys is None:
+            return [self.get(text) for text in texts]
+        return [self.get(text, key=key) for text, key in zip(texts, keys)]
+
+    def flush(self):
+        """Writes the disk tier to disk."""
+        with self._lock:
+            for array in (self._header, self._keys, self._vectors):
+                if array is not None:
+                    array.flush()
+
+    def clear(self):
+        with self._lock:
+            self.memory.clear()
+            self._slots.clear()
+            if self._header is not None:
+                self._header[:2] = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory.hits + self.disk_hits
+
+    @property
+    def misses(self) -> int:
+        # memory misses which were found on disk are hits of the cache as a whole
+        return self.memory.misses - self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "memory_hits": self.memory.hits,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size_bytes,
+            "memory_evictions": self.memory.evictions,
+            "disk_hits": self.disk_hits,
+            "disk_entries": len(self._slots),
+        }
@@ -4,4 +4,10 @@ class MaxRetryError(Exception):
 
     def __init__(self, message="Maximum number of retries exceeded"):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class CircuitOpenError(MaxRetryError):
+    """Exception raised when a dataset is unhealthy and has no local samples to fall back on."""
+
+    def __init__(self, message="Circuit breaker is open"):
+        super().__init__(message)
@@ -0,0 +1,139 @@
+# The MIT License (MIT)
+# Copyright © 2024 Yuma Rao
+# Copyright © 2023 Opentensor Foundation
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import re
+import math
+import heapq
+import threading
+from operator import itemgetter
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Tuple, Union
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits the text into lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    """Incremental in-memory inverted index which ranks documents with BM25.
+
+    Documents can be added and removed at any time. Each document has a hashable key and an optional payload which is returned by
+    `get`. Once the index holds `max_docs` documents the oldest ones are removed.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_docs: int = None):
+        """
+        Args:
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 document length normalization. Defaults to 0.75.
+            max_docs (int, optional): Maximum number of documents. Defaults to no limit.
+        """
+        self.k1 = k1
+        self.b = b
+        self.max_docs = max_docs
+
+        self.postings: Dict[str, Dict[Hashable, int]] = {}
+        self.lengths: Dict[Hashable, int] = {}
+        self.docs: "OrderedDict[Hashable, Tuple[Any, Tuple[str]]]" = OrderedDict()
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(docs={len(self.docs)}, terms={len(self.postings)})"
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, key: Hashable):
+        return key in self.docs
+
+    def add(self, key: Hashable, text: str, doc: Any = None):
+        """Adds a document to the index, replacing any document with the same key."""
+        counts = Counter(tokenize(text))
+        with self._lock:
+            if key in self.docs:
+                self._remove(key)
+
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[key] = tf
+            length = sum(counts.values())
+            self.lengths[key] = length
+            self.total_length += length
+            self.docs[key] = (doc, tuple(counts))
+
+            while self.max_docs is not None and len(self.docs) > self.max_docs:
+                self._remove(next(iter(self.docs)))
+
+    def remove(self, key: Hashable):
+        with self._lock:
+            if key in self.docs:
+                self._remove(key)
+
+    def _remove(self, key: Hashable):
+        _, terms = self.docs.pop(key)
+        for term in terms:
+            postings = self.postings[term]
+            del postings[key]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(key)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the payload of the document."""
+        doc = self.docs.get(key)
+        return default if doc is None else doc[0]
+
+    def search(
+        self, query: str, results: int = 10, where: Callable[[Hashable], bool] = None, return_scores: bool = False
+    ) -> Union[List[Hashable], List[Tuple[Hashable, float]]]:
+        """Returns the keys of the documents which best match the query.
+
+        Args:
+            query (str): Search query.
+            results (int, optional): Maximum number of results. Defaults to 10.
+            where (Callable[[Hashable], bool], optional): Only documents whose keys satisfy the predicate are returned. Defaults to None.
+            return_scores (bool, optional): Whether to return (key, score) pairs. Defaults to False.
+
+        Returns:
+            list: Keys of the matching documents ordered by decreasing BM25 score. Documents which share no terms with the query are not returned.
+        """
+        scores = {}
+        with self._lock:
+            num_docs = len(self.docs)
+            if not num_docs:
+                return []
+            avg_length = self.total_length / num_docs
+
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / avg_length)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        candidates = scores.items() if where is None else ((key, score) for key, score in scores.items() if where(key))
+        top = heapq.nlargest(results, candidates, key=itemgetter(1))
+        if return_scores:
+            return top
+        return [key for key, _ in top]
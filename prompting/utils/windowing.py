@@ -0,0 +1,93 @@
+# The MIT License (MIT)
+# Copyright © 2024 Yuma Rao
+# Copyright © 2023 Opentensor Foundation
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+# documentation files (the “Software”), to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO
+# THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import re
+import hashlib
+from typing import List, Tuple
+
+from prompting.utils.cache import LRUCache
+
+# Token counts of texts, keyed by tokenizer and text hash
+TOKEN_COUNTS = LRUCache(max_bytes=32 * 2**20)
+
+# Splits after sentence ending punctuation and at line breaks, keeping the separators with the preceding sentence
+SENTENCE_PATTERN = re.compile(r'[^\n]*?(?:[.!?]+["\')\]]*(?=\s)|\n|$)\s*')
+
+
+def tokenizer_name(tokenizer) -> str:
+    if tokenizer is None:
+        return "words"
+    return getattr(tokenizer, "name_or_path", None) or tokenizer.__class__.__name__
+
+
+def count_tokens(text: str, tokenizer=None) -> int:
+    """Number of tokens in the text. Counts are cached, so each section is only tokenized once.
+
+    Args:
+        text (str): Text to count.
+        tokenizer (optional): Tokenizer with an `encode` method. If None or if it cannot encode, words are counted instead.
+    """
+    key = (tokenizer_name(tokenizer), hashlib.sha1(text.encode()).hexdigest())
+    count = TOKEN_COUNTS.get(key)
+    if count is None:
+        if hasattr(tokenizer, "encode"):
+            count = len(tokenizer.encode(text, add_special_tokens=False))
+        else:
+            count = len(text.split())
+        TOKEN_COUNTS.set(key, count)
+    return count
+
+
+def split_sentences(text: str) -> List[str]:
+    """Splits the text into sentences and lines. Joining the pieces gives back the original text."""
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence]
+
+
+def window_text(text: str, max_tokens: int, tokenizer=None) -> Tuple[str, int]:
+    """Cuts the text to at most `max_tokens` tokens at a sentence boundary.
+
+    Args:
+        text (str): Text to cut.
+        max_tokens (int): Token budget.
+        tokenizer (optional): Tokenizer used to count tokens. Defaults to counting words.
+
+    Returns:
+        Tuple[str, int]: The windowed text and its (approximate) number of tokens. If even the first sentence is over budget it is cut at a word boundary.
+    """
+    num_tokens = count_tokens(text, tokenizer)
+    if num_tokens <= max_tokens:
+        return text, num_tokens
+
+    window = []
+    num_tokens = 0
+    for sentence in split_sentences(text):
+        sentence_tokens = count_tokens(sentence, tokenizer)
+        if num_tokens + sentence_tokens > max_tokens:
+            break
+        window.append(sentence)
+        num_tokens += sentence_tokens
+
+    if not window:
+        # scale the number of words by the token density of the first sentence
+        sentence = split_sentences(text)[0]
+        words = sentence.split()
+        num_words = max(1, len(words) * max_tokens // max(count_tokens(sentence, tokenizer), 1))
+        window = [' '.join(words[:num_words])]
+        num_tokens = count_tokens(window[0], tokenizer)
+
+    return ''.join(window).strip(), num_tokens
@@ -82,6 +82,7 @@ setup(
     license="MIT",
     python_requires=">=3.8",
     install_requires=requirements,
+    extras_require={"dev": read_requirements("requirements-dev.txt")},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
@@ -0,0 +1,59 @@
+import os
+import json
+import threading
+from urllib.parse import urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSES_PATH = os.path.join(os.path.dirname(__file__), "mediawiki_responses.json")
+
+
+class MediaWikiStandIn:
+    """Local HTTP server which replays recorded MediaWiki API responses.
+
+    Each recorded response is served for requests whose query parameters contain all of its recorded parameters. When several
+    responses match, the one with the most parameters (e.g. a continuation) wins.
+    """
+
+    def __init__(self, responses_path=RESPONSES_PATH):
+        with open(responses_path) as f:
+            self.responses = json.load(f)
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/w/api.php"
+
+    def match(self, params):
+        matches = [r for r in self.responses if all(params.get(k) == v for k, v in r["params"].items())]
+        if not matches:
+            return {"error": {"code": "norecording", "info": f"No recorded response for {params}"}}
+        return max(matches, key=lambda r: len(r["params"]))["response"]
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = dict(parse_qsl(urlparse(self.path).query))
+                stand_in.requests.append(params)
+                body = json.dumps(stand_in.match(params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,70 @@
+import re
+import json
+import threading
+from urllib.parse import urlparse, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StackExchangeStandIn:
+    """Local HTTP server which serves generated questions and answers like the StackExchange API.
+
+    Question i has score 1000 - i and `answers_per_question` answers. Answers to several questions are sorted by votes across
+    all questions and paginated, like the real API.
+    """
+
+    def __init__(self, num_questions: int = 500, answers_per_question: int = 3):
+        self.questions = [
+            {"question_id": 1000 + i, "title": f"Question {i}", "score": 1000 - i} for i in range(num_questions)
+        ]
+        self.answers = [
+            {"question_id": q["question_id"], "score": q["score"] * 10 - j, "body": f"<p>Answer {j} to <code>{q['title']}</code></p>"}
+            for q in self.questions for j in range(answers_per_question)
+        ]
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/2.3"
+
+    def respond(self, path, params):
+        page, pagesize = int(params.get("page", 1)), int(params.get("pagesize", 30))
+        if path == "/2.3/questions":
+            items = self.questions
+        elif re.fullmatch(r"/2.3/questions/[\d;]+/answers", path):
+            ids = {int(i) for i in path.split("/")[3].split(";")}
+            assert len(ids) <= 100, "the API accepts at most 100 ids"
+            items = sorted((a for a in self.answers if a["question_id"] in ids), key=lambda a: -a["score"])
+        else:
+            return {"error_id": 404, "error_name": "no_method"}
+        start = (page - 1) * pagesize
+        return {"items": items[start:start + pagesize], "has_more": start + pagesize < len(items), "quota_remaining": 9999}
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                stand_in.requests.append((url.path, params))
+                body = json.dumps(stand_in.respond(url.path, params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
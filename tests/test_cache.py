@@ -0,0 +1,127 @@
+import time
+import pytest
+import multiprocessing
+
+from prompting.utils.cache import DiskCache, LRUCache, disk_cache, memory_cache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache(path=str(tmp_path / "cache.sqlite"), ttl=60, max_bytes=2**20)
+
+
+def _write_entry(path, key, value):
+    DiskCache(path=path).set(key, value)
+
+
+def test_cache_roundtrip(cache: DiskCache):
+    value = {"title": "Emilio Alvarez (bishop)", "links": ["a", "b"] * 100}
+    cache.set("key", value)
+    assert cache.get("key") == value
+    assert cache.get("missing") is None
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_cache_payloads_are_compressed(cache: DiskCache):
+    cache.set("key", "a" * 10000)
+    assert cache.size_bytes < 1000
+
+
+def test_cache_entries_expire(tmp_path):
+    cache = DiskCache(path=str(tmp_path / "cache.sqlite"), ttl=0.1)
+    cache.set("key", 1)
+    time.sleep(0.2)
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used_entries(tmp_path):
+    cache = DiskCache(path=str(tmp_path / "cache.sqlite"), max_bytes=3000, compress_level=0)
+    cache.set("first", b"x" * 1000)
+    cache.set("second", b"x" * 1000)
+    time.sleep(0.01)
+    cache.get("first")
+    cache.set("third", b"x" * 1000)
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.get("third") is not None
+    assert cache.size_bytes <= 3000
+
+
+def test_cache_is_shared_between_processes(cache: DiskCache):
+    process = multiprocessing.Process(target=_write_entry, args=(cache.path, "key", "value"))
+    process.start()
+    process.join()
+    assert cache.get("key") == "value"
+
+
+def test_disk_cache_decorator_only_calls_function_once(cache: DiskCache):
+    calls = []
+
+    @disk_cache(cache, namespace="test")
+    def fetch(name, results=3):
+        calls.append(name)
+        return [name] * results
+
+    assert fetch("page", results=2) == fetch("page", results=2) == ["page", "page"]
+    assert fetch("other") == ["other"] * 3
+    assert calls == ["page", "other"]
+
+
+def test_disk_cache_decorator_does_not_cache_none(cache: DiskCache):
+    calls = []
+
+    @disk_cache(cache, namespace="test")
+    def fetch(name):
+        calls.append(name)
+
+    fetch("page")
+    fetch("page")
+    assert calls == ["page", "page"]
+
+
+def test_lru_cache_evicts_by_total_size():
+    cache = LRUCache(max_bytes=100, sizeof=len)
+    cache.set("a", "x" * 40)
+    cache.set("b", "x" * 40)
+    cache.get("a")
+    cache.set("c", "x" * 40)
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.size_bytes == 80
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_does_not_store_values_larger_than_budget():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.set("a", "x" * 11)
+    assert len(cache) == 0 and cache.size_bytes == 0
+
+
+def test_lru_cache_entries_expire():
+    cache = LRUCache(ttl=0.1)
+    cache.set("a", 1)
+    time.sleep(0.2)
+    assert cache.get("a") is None
+
+
+def test_memory_cache_decorator_reports_hit_rate():
+    cache = LRUCache()
+
+    @memory_cache(cache)
+    def fetch(name, results=3):
+        return [name] * results
+
+    fetch("page")
+    fetch("page")
+    fetch(name="page")
+    assert cache.hits == 1 and cache.misses == 2
+    assert cache.hit_rate == pytest.approx(1 / 3)
+
+
+def test_cache_values_skip_expired_entries(tmp_path):
+    cache = DiskCache(path=str(tmp_path / "cache.sqlite"), ttl=0.1)
+    cache.set("old", 1)
+    time.sleep(0.2)
+    cache.set("new", 2)
+    assert list(cache.values()) == [2]
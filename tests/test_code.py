@@ -0,0 +1,171 @@
+import re
+import pytest
+
+from prompting.tools.datasets.code import LANGUAGES, KeywordMatcher, filter_comments, keyword_matcher
+
+CODE = {
+    "Python": '''import numpy as np
+import pandas
+# import flask
+def f(x):
+    """Docstring"""
+    return x if x is not None else lambda: yield_value
+''',
+    "JavaScript": '''import React from 'react';
+import { connect } from 'react-redux';
+/* const legacy = require('express');
+   function old() {} */
+// let unused = 1;
+export default function App() { return async () => await axios.get(url); }
+''',
+    "C++": '''#include <iostream>
+#include <vector>
+/* int legacy() */ static int counter = 0;
+int main() { for (auto x : xs) { if (x) return 1; } }
+''',
+    "Java": '''import java.awt.event.ActionEvent;
+/**
+ * class Doc extends Base
+ */
+public class App implements Runnable { private final int x = 0; }
+''',
+    "HTML": '''<html><head><title>Test</title></head>
+<!-- <script src="x.js"></script>
+<style></style> -->
+<body><div><span>text</span></div></body></html>
+''',
+}
+
+
+def naive_keywords(code, keywords):
+    return {keyword for keyword in keywords if re.search(r'\b' + re.escape(keyword) + r'\b', code)}
+
+
+@pytest.mark.parametrize("language", LANGUAGES.keys())
+@pytest.mark.parametrize("field", ("keywords", "libraries"))
+@pytest.mark.parametrize("remove_comments", (True, False))
+def test_keyword_matcher_matches_per_keyword_search(language: str, field: str, remove_comments: bool):
+    for code in CODE.values():
+        code = filter_comments(code, language) if remove_comments else code
+        assert keyword_matcher(language, field)(code) == naive_keywords(code, LANGUAGES[language].get(field, []))
+
+
+def test_keyword_matcher_finds_overlapping_keywords():
+    matcher = KeywordMatcher(["react", "react-redux", "redux", "java.awt", "java.awt.event"])
+    assert matcher("import 'react-redux'; import java.awt.event") == {"react", "react-redux", "redux", "java.awt", "java.awt.event"}
+    assert matcher("reactive java.awtx") == set()
+
+
+@pytest.mark.parametrize(
+    "language, removed, kept",
+    [
+        ("Python", ["flask"], ["numpy", "docstring"]),
+        ("JavaScript", ["express", "old", "unused"], ["react-redux", "axios"]),
+        ("C++", ["legacy"], ["static int counter", "#include <iostream>"]),
+        ("Java", ["extends", "doc"], ["implements"]),
+        ("HTML", ["script", "style"], ["span"]),
+    ],
+)
+def test_filter_comments_removes_line_and_block_comments(language: str, removed: list, kept: list):
+    code = filter_comments(CODE[language], language)
+    assert code == code.lower()
+    assert not any(word in code for word in removed)
+    assert all(word in code for word in kept)
+
+
+def test_search_loads_indexed_samples_from_the_store(tmp_path, monkeypatch):
+    from prompting.tools import Selector
+    from prompting.tools.datasets import code as code_module
+    from prompting.tools.datasets.shards import CodeShardStore
+    from prompting.utils.index import SearchIndex
+
+    monkeypatch.setattr(code_module, "CODE_INDEX", SearchIndex(max_docs=100))
+    store = CodeShardStore(path=str(tmp_path / "code"), seed=42)
+    samples = [
+        {"repo_name": f"repo{i}", "path": f"file{i}.py", "language": "Python", "code": "\n".join([f"import {library}"] * num_lines), "license": "mit", "size": 1}
+        for i, (library, num_lines) in enumerate([("numpy", 8), ("flask", 12), ("numpy", 30)])
+    ]
+    store.add(samples)
+    assert code_module.index_store(store) == 3
+    assert code_module.index_store(store) == 0
+    # only keys are held in the index
+    assert all(doc is None for doc, _ in code_module.CODE_INDEX.docs.values())
+
+    dataset = code_module.HFCodingDataset(seed=1, store=store)
+    context = dataset.search("numpy", min_lines=5, max_lines=20, selector=Selector(seed=42))
+    assert context["title"] == "repo0"
+    assert dataset.search("django", selector=Selector(seed=42)) is None
+
+
+class ShardedStream:
+    """Streaming dataset of code samples which counts how many items are read from each shard."""
+
+    def __init__(self, shards, reads):
+        self.shards = shards
+        self.reads = reads
+
+    @property
+    def n_shards(self):
+        return len(self.shards)
+
+    def shuffle(self, seed, buffer_size):
+        return self
+
+    def skip(self, n):
+        return (item for i, item in enumerate(self) if i >= n)
+
+    def __iter__(self):
+        for shard in self.shards:
+            for item in shard:
+                self.reads[item["repo_name"]] = self.reads.get(item["repo_name"], 0) + 1
+                yield item
+
+
+def test_coding_dataset_resumes_stream_at_saved_shard_and_offset(tmp_path, monkeypatch):
+    from prompting.tools.datasets import code as code_module
+    from prompting.tools.datasets.shards import CodeShardStore
+
+    reads = {}
+    shards = [
+        [{"repo_name": f"repo{shard}.{i}", "path": "a.py", "language": "Python", "code": "x = 1\n" * 10, "license": "mit", "size": 1} for i in range(5)]
+        for shard in range(3)
+    ]
+    monkeypatch.setattr(code_module, "load_dataset", lambda *args, **kwargs: ShardedStream(shards, reads))
+    monkeypatch.setattr(code_module, "split_dataset_by_node", lambda dataset, rank, world_size: ShardedStream([shards[rank]], reads))
+    monkeypatch.setattr(code_module, "_STREAMS", {})
+
+    store = CodeShardStore(path=str(tmp_path / "code"), seed=42)
+    dataset = code_module.HFCodingDataset(seed=1, store=store, fill_size=7, low_water=0)
+    dataset.fill()
+    assert store.consumed == 7
+    position, offset = store.state["stream_position"]
+    assert (position, offset) == (1, 2)
+
+    # a restarted validator only skips the consumed items of the current shard
+    monkeypatch.setattr(code_module, "_STREAMS", {})
+    reads.clear()
+    restarted = code_module.HFCodingDataset(seed=1, store=CodeShardStore(path=store.path), fill_size=8)
+    restarted.fill()
+    assert len(reads) == 10 and max(reads.values()) == 1
+    assert len({sample["repo_name"] for sample in store}) == 15
+
+
+def test_coding_dataset_draws_without_replacement_and_tops_up(tmp_path, monkeypatch):
+    from prompting.tools import Selector
+    from prompting.tools.datasets import code as code_module
+    from prompting.tools.datasets.shards import CodeShardStore
+
+    shards = [[{"repo_name": f"repo{i}", "path": "a.py", "language": "Python", "code": "x = 1\n" * 10, "license": "mit", "size": 1} for i in range(20)]]
+    monkeypatch.setattr(code_module, "load_dataset", lambda *args, **kwargs: ShardedStream(shards, {}))
+    monkeypatch.setattr(code_module, "split_dataset_by_node", lambda dataset, rank, world_size: ShardedStream([shards[rank]], {}))
+    monkeypatch.setattr(code_module, "_STREAMS", {})
+    top_ups = []
+    monkeypatch.setattr(code_module.HFCodingDataset, "top_up", lambda self: top_ups.append(self.store.remaining(self.languages, 5, 100)))
+
+    store = CodeShardStore(path=str(tmp_path / "code"), seed=42)
+    dataset = code_module.HFCodingDataset(seed=1, store=store, fill_size=5, low_water=2)
+    titles = [dataset.get(selector=Selector(seed=42))["title"] for _ in range(10)]
+    assert len(set(titles)) == 10
+    # the store is filled when it runs out and topped up when it runs low
+    assert store.consumed == 10
+    assert top_ups == [1, 0, 1, 0]
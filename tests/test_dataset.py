@@ -58,6 +58,6 @@ def test_context_field_is_not_null(dataset: Dataset, field: str):
 
 
 @pytest.mark.parametrize('dataset', DATASETS)
-@pytest.mark.parametrize('field', ('creator', 'fetch_time', 'num_tries', 'fetch_method', 'next_kwargs'))
+@pytest.mark.parametrize('field', ('creator', 'fetch_time', 'num_tries', 'num_wasted', 'fetch_method', 'next_kwargs'))
 def test_context_stats_field_contains_expected_keys(dataset: Dataset, field: str):
     assert field in CONTEXTS[dataset].stats
\ No newline at end of file
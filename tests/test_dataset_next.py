@@ -0,0 +1,168 @@
+import time
+import pytest
+import threading
+
+from prompting.tools.datasets import Dataset, base
+from prompting.tools import Context, Selector
+from prompting.tools.datasets.health import HEALTH
+from prompting.utils.exceptions import CircuitOpenError, MaxRetryError
+
+
+class FlakyDataset(Dataset):
+    """Returns a valid sample only every `period` calls."""
+
+    max_tries = 12
+
+    def __init__(self, period=3, speculative_fetches=1, delay=0.01):
+        self.period = period
+        self.speculative_fetches = speculative_fetches
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get(self, name, selector=None):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+            valid = self.calls % self.period == 0
+        if not valid:
+            return None
+
+        return {
+            'title': name,
+            'topic': 'topic',
+            'subtopic': 'subtopic',
+            'content': 'content',
+            'internal_links': [],
+            'external_links': [],
+            'source': 'Flaky',
+        }
+
+    def search(self, name, selector=None):
+        return self.get(name)
+
+    def random(self, selector=None, **kwargs):
+        return self.get('random')
+
+
+@pytest.mark.parametrize('speculative_fetches', (1, 4))
+def test_next_returns_first_valid_sample(speculative_fetches: int):
+    ds = FlakyDataset(period=3, speculative_fetches=speculative_fetches)
+    context = ds.next(method='search', selector=Selector(seed=42), name='search')
+    assert type(context) == Context
+    assert context.stats['num_tries'] >= 3
+    assert context.stats['num_wasted'] >= 2
+
+
+def test_next_raises_after_max_tries():
+    ds = FlakyDataset(period=100, speculative_fetches=4)
+    with pytest.raises(MaxRetryError):
+        ds.next(method='search', name='search')
+    assert ds.calls == ds.max_tries
+
+
+def test_next_reuses_spare_random_samples():
+    # Every fetch is valid, so all but one of the speculative fetches produce spares
+    ds = FlakyDataset(period=1, speculative_fetches=4, delay=0)
+    spares = []
+    all_added = threading.Event()
+
+    def add_spares(key, infos):
+        Dataset._add_spares(ds, key, infos)
+        spares.extend(infos)
+        if len(spares) == 3:
+            all_added.set()
+
+    ds._add_spares = add_spares
+    ds.next()
+    # the other fetches may still be running when next returns
+    assert all_added.wait(timeout=5)
+    calls = ds.calls
+    context = ds.next()
+    assert context.stats['num_tries'] == 0
+    assert ds.calls == calls
+
+
+def test_spares_are_not_shared_between_configs():
+    ds = FlakyDataset(period=1, speculative_fetches=1, delay=0)
+    other = FlakyDataset(period=2, speculative_fetches=1, delay=0)
+    ds._add_spares(ds._spare_key('random', {}), [ds.get('spare')])
+    assert other._pop_spare(other._spare_key('random', {})) is None
+    assert ds._pop_spare(FlakyDataset(period=1, speculative_fetches=1, delay=0)._spare_key('random', {}))['title'] == 'spare'
+
+
+def test_next_raises_on_unknown_method():
+    with pytest.raises(ValueError):
+        FlakyDataset().next(method='unknown')
+
+
+class MultiContextDataset(FlakyDataset):
+    """Returns `contexts_per_page` samples from each random fetch, cycling through `titles`."""
+
+    def __init__(self, titles, contexts_per_page=3, max_consecutive_per_title=None):
+        super().__init__(period=1, delay=0)
+        self.titles = titles
+        self.contexts_per_page = contexts_per_page
+        self.max_consecutive_per_title = max_consecutive_per_title
+
+    def random_contexts(self, selector=None, **kwargs):
+        title = self.titles[self.calls % len(self.titles)]
+        return [self.get(title) for _ in range(self.contexts_per_page)]
+
+
+@pytest.fixture(autouse=True)
+def clear_spares():
+    base._SPARES.clear()
+    base._RECENT_TITLES.clear()
+    HEALTH.datasets.clear()
+
+
+def test_next_buffers_contexts_from_a_single_fetch():
+    ds = MultiContextDataset(titles=['a'], contexts_per_page=3)
+    contexts = [ds.next() for _ in range(3)]
+    assert ds.calls == 3
+    assert [context.stats['num_tries'] for context in contexts] == [1, 0, 0]
+    ds.next()
+    assert ds.calls == 6
+
+
+def test_next_limits_consecutive_contexts_from_the_same_title():
+    ds = MultiContextDataset(titles=['a', 'b'], contexts_per_page=3, max_consecutive_per_title=2)
+    titles = [ds.next().title for _ in range(6)]
+    assert all(len(set(titles[i:i + 3])) > 1 for i in range(len(titles) - 2))
+
+
+class LocalFlakyDataset(FlakyDataset):
+    """Has a local backend which always works."""
+
+    def random_local(self, selector=None, **kwargs):
+        return {**self.get('random'), 'title': 'local'} if self.period == 1 else None
+
+
+@pytest.mark.parametrize('period, local', ((1, True), (100, False)))
+def test_next_uses_local_backend_while_circuit_is_open(period: int, local: bool):
+    ds = LocalFlakyDataset(period=100, speculative_fetches=4)
+    for _ in range(HEALTH.max_consecutive_failures):
+        with pytest.raises(MaxRetryError):
+            ds.next(method='search', name='search')
+    assert HEALTH.is_open('LocalFlakyDataset')
+
+    ds.period = period
+    calls = ds.calls
+    if local:
+        context = ds.next()
+        assert context.title == 'local'
+        assert context.stats['fetch_method'] == 'random_local'
+    else:
+        with pytest.raises(CircuitOpenError):
+            ds.next()
+    assert ds.calls - calls == int(local)
+
+
+def test_next_records_health_metrics():
+    ds = FlakyDataset(period=2, speculative_fetches=1, delay=0)
+    for _ in range(3):
+        ds.next(method='search', name='search')
+    stats = HEALTH.stats('FlakyDataset')
+    assert stats['fetches'] == 3 and stats['failures'] == 0
+    assert stats['mean_tries'] == 2
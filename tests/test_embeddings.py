@@ -0,0 +1,53 @@
+import numpy as np
+
+from prompting.utils.embeddings import EmbeddingCache
+
+
+def test_embedding_cache_roundtrip():
+    cache = EmbeddingCache(namespace="model")
+    cache.set("hello", np.arange(4))
+    assert np.array_equal(cache.get("hello"), np.arange(4, dtype=np.float32))
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_embedding_cache_separates_namespaces():
+    cache = EmbeddingCache(namespace="model")
+    other = EmbeddingCache(namespace="other")
+    assert cache.key("hello") != other.key("hello")
+
+
+def test_embedding_cache_uses_precomputed_keys():
+    cache = EmbeddingCache(namespace="model")
+    key = cache.key("hello")
+    cache.set("hello", np.arange(4), key=key)
+    assert np.array_equal(cache.get("hello"), np.arange(4, dtype=np.float32))
+    assert [vector is None for vector in cache.get_many(["hello", "missing"], keys=[key, cache.key("missing")])] == [False, True]
+
+
+def test_embedding_cache_disk_tier_survives_restarts(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path), capacity=8)
+    vectors = {f"text {i}": np.random.rand(16) for i in range(5)}
+    for text, vector in vectors.items():
+        cache.set(text, vector)
+    cache.flush()
+
+    reloaded = EmbeddingCache(path=str(tmp_path))
+    for text, vector in vectors.items():
+        # vectors are stored as float16
+        assert np.allclose(reloaded.get(text), vector, atol=1e-3)
+    assert reloaded.disk_hits == 5
+    # disk hits are promoted to memory
+    reloaded.get("text 0")
+    assert reloaded.disk_hits == 5 and reloaded.memory.hits == 1
+
+
+def test_embedding_cache_disk_tier_overwrites_oldest_vectors(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path), capacity=3)
+    for i in range(5):
+        cache.set(str(i), np.full(4, i))
+
+    reloaded = EmbeddingCache(path=str(tmp_path))
+    assert reloaded.get("0") is None and reloaded.get("1") is None
+    assert [reloaded.get(str(i))[0] for i in range(2, 5)] == [2, 3, 4]
+    assert reloaded.stats()["disk_entries"] == 3
@@ -0,0 +1,34 @@
+import threading
+
+from prompting.rewards.features import CompletionFeatures, line_hash
+
+
+def test_features_are_computed_once():
+    calls = []
+    features = CompletionFeatures(['a b', 'c'])
+
+    def compute(completion):
+        calls.append(completion)
+        return len(completion)
+
+    assert features.get('length', compute) == [3, 1]
+    assert features.get('length', compute) == [3, 1]
+    assert calls == ['a b', 'c']
+
+
+def test_features_are_computed_once_by_concurrent_models():
+    calls = []
+    features = CompletionFeatures(['x'] * 100)
+    threads = [threading.Thread(target=features.get, args=('upper', lambda c: calls.append(c) or c.upper())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 100
+
+
+def test_line_hashes():
+    features = CompletionFeatures(['a\nb\n', 'a\n'])
+    hashes = features.line_hashes()
+    assert hashes[0][0] == hashes[1][0] == line_hash('a\n')
+    assert len(hashes[0]) == 2
@@ -0,0 +1,76 @@
+import time
+import pytest
+
+from prompting.tools.datasets.health import HealthTracker, CLOSED, OPEN, HALF_OPEN
+
+
+@pytest.fixture
+def tracker():
+    return HealthTracker(window=10, min_fetches=4, max_failure_rate=0.5, max_consecutive_failures=3, cooldown=0.1, max_cooldown=0.3)
+
+
+def test_stats_report_latency_percentiles_and_failure_rate(tracker: HealthTracker):
+    for i in range(10):
+        tracker.record("WikiDataset", latency=i / 10, num_tries=2, success=i % 5 != 0)
+    stats = tracker.stats("WikiDataset")
+    assert stats["latency_p50"] == pytest.approx(0.45)
+    assert stats["latency_p99"] == pytest.approx(0.891)
+    assert stats["failure_rate"] == pytest.approx(0.2)
+    assert stats["mean_tries"] == 2
+    assert tracker.state("WikiDataset") == CLOSED
+
+
+def test_consecutive_failures_open_the_circuit(tracker: HealthTracker):
+    for _ in range(3):
+        assert tracker.weight("WikiDataset") == 1.0
+        tracker.record("WikiDataset", latency=1, num_tries=10, success=False)
+    assert tracker.state("WikiDataset") == OPEN
+    assert tracker.weight("WikiDataset") == tracker.open_weight
+    assert tracker.weight("MathDataset") == 1.0
+
+
+def test_failure_rate_opens_the_circuit(tracker: HealthTracker):
+    for success in (False, True, True, False, False):
+        assert tracker.state("WikiDataset") == CLOSED
+        tracker.record("WikiDataset", latency=1, num_tries=1, success=success)
+    assert tracker.state("WikiDataset") == OPEN
+
+
+def test_circuit_is_probed_after_cooldown(tracker: HealthTracker):
+    for _ in range(3):
+        tracker.record("WikiDataset", latency=1, num_tries=10, success=False)
+    time.sleep(0.1)
+    assert tracker.state("WikiDataset") == HALF_OPEN
+
+    # a failed probe opens the circuit again for twice as long
+    tracker.record("WikiDataset", latency=1, num_tries=10, success=False)
+    assert tracker.datasets["WikiDataset"].cooldown == pytest.approx(0.2)
+    time.sleep(0.1)
+    assert tracker.state("WikiDataset") == OPEN
+    time.sleep(0.1)
+    assert tracker.state("WikiDataset") == HALF_OPEN
+
+    tracker.record("WikiDataset", latency=1, num_tries=1, success=True)
+    assert tracker.state("WikiDataset") == CLOSED
+
+
+def test_half_open_circuit_lets_one_probe_through(tracker: HealthTracker):
+    for _ in range(3):
+        tracker.record("WikiDataset", latency=1, num_tries=10, success=False)
+    time.sleep(0.1)
+    assert tracker.state("WikiDataset") == HALF_OPEN
+    assert tracker.weight("WikiDataset") == 1.0
+
+    # the first caller is the probe, the others keep using the local backend until it is recorded
+    assert [tracker.is_open("WikiDataset") for _ in range(2)] == [False, True]
+    tracker.record("WikiDataset", latency=1, num_tries=1, success=True)
+    assert [tracker.is_open("WikiDataset") for _ in range(2)] == [False, False]
+
+
+def test_state_dict_flattens_metrics_of_all_datasets(tracker: HealthTracker):
+    tracker.record("WikiDataset", latency=1, num_tries=1, success=True)
+    tracker.record("MathDataset", latency=0.1, num_tries=1, success=True)
+    state = tracker.state_dict()
+    assert state["health_WikiDataset_latency_p90"] == 1
+    assert state["health_MathDataset_circuit_open"] is False
+    assert all(isinstance(value, (int, float, bool)) for value in state.values())
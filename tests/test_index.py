@@ -0,0 +1,66 @@
+import pytest
+
+from prompting.utils.index import SearchIndex, tokenize
+
+
+DOCS = {
+    "Mercury (planet)": "Mercury is the smallest planet in the Solar System and the closest to the Sun.",
+    "Mercury (element)": "Mercury is a chemical element. It is a heavy, silvery metal which is liquid at room temperature.",
+    "Venus": "Venus is the second planet from the Sun. It is a terrestrial planet.",
+    "Iron": "Iron is a chemical element and the most common element on Earth by mass.",
+}
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    for title, text in DOCS.items():
+        index.add(title, text, doc={"title": title})
+    return index
+
+
+def test_tokenize():
+    assert tokenize("Mercury (planet), 2nd-closest!") == ["mercury", "planet", "2nd", "closest"]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("smallest planet", "Mercury (planet)"),
+        ("liquid metal", "Mercury (element)"),
+        ("planet Venus", "Venus"),
+        ("common chemical element", "Iron"),
+    ],
+)
+def test_search_ranks_best_match_first(index: SearchIndex, query: str, expected: str):
+    assert index.search(query, results=1) == [expected]
+
+
+def test_search_only_returns_matching_documents(index: SearchIndex):
+    assert set(index.search("mercury")) == {"Mercury (planet)", "Mercury (element)"}
+    assert index.search("unrelated query") == []
+    keys, scores = zip(*index.search("planet", return_scores=True))
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_remove_and_replace_documents(index: SearchIndex):
+    index.remove("Venus")
+    assert "Venus" not in index
+    assert index.search("second") == []
+
+    index.add("Iron", "Iron is a metal.", doc="new")
+    assert index.get("Iron") == "new"
+    assert index.search("earth") == []
+    assert index.total_length == sum(index.lengths.values())
+
+
+def test_oldest_documents_are_removed_beyond_max_docs():
+    index = SearchIndex(max_docs=2)
+    for title, text in DOCS.items():
+        index.add(title, text)
+    assert list(index.docs) == ["Venus", "Iron"]
+    assert index.search("mercury") == []
+
+
+def test_search_filters_keys_before_ranking(index: SearchIndex):
+    assert index.search("mercury", results=1, where=lambda key: "element" in key) == ["Mercury (element)"]
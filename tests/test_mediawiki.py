@@ -0,0 +1,59 @@
+import pytest
+import wikipedia as wiki
+
+from prompting.tools.datasets.mediawiki import MediaWikiClient, WikiPage
+from .fixtures.mediawiki import MediaWikiStandIn
+
+
+@pytest.fixture(scope="module")
+def stand_in():
+    with MediaWikiStandIn() as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def client(stand_in):
+    return MediaWikiClient(api_url=stand_in.api_url)
+
+
+def test_fetch_page_returns_compact_record(client: MediaWikiClient):
+    page = client.fetch_page("Emilio Alvarez (bishop)")
+    assert isinstance(page, WikiPage)
+    assert page.pageid == 56273468
+    assert page.url == "https://en.wikipedia.org/wiki/Emilio_Alvarez_(bishop)"
+    assert page.categories == ("Articles with short description", "Living people")
+    assert page.summary == "Emilio Alvarez is an American bishop of the Union of Charismatic Orthodox Churches."
+    assert page.sections == ["Early life and education", "Ministry", "Consecration", "See also"]
+    assert page.section("Ministry") == ""
+    assert page.section("Consecration").startswith("Alvarez was consecrated")
+
+
+def test_fetch_page_follows_continuation(client: MediaWikiClient, stand_in: MediaWikiStandIn):
+    num_requests = len(stand_in.requests)
+    page = client.fetch_page("Emilio Alvarez (bishop)")
+    assert page.links == ("Bishop", "Duke Divinity School", "Drew University", "Union of Charismatic Orthodox Churches")
+    # one combined query plus one continuation
+    assert len(stand_in.requests) - num_requests == 2
+    assert stand_in.requests[-1]["plcontinue"] == "56273468|0|Drew_University"
+
+
+def test_fetch_page_raises_disambiguation_error_with_links_as_options(client: MediaWikiClient):
+    with pytest.raises(wiki.DisambiguationError) as e:
+        client.fetch_page("Mercury")
+    assert e.value.options == ["Mercury (planet)", "Mercury (element)"]
+
+
+def test_fetch_page_raises_page_error_for_missing_pages(client: MediaWikiClient):
+    with pytest.raises(wiki.PageError):
+        client.fetch_page("Nonexistent page 1234")
+
+
+def test_fetch_page_raises_on_api_error(client: MediaWikiClient):
+    with pytest.raises(wiki.WikipediaException):
+        client.fetch_page("Page without a recording")
+
+
+def test_random_titles_fetches_titles_in_bulk(client: MediaWikiClient):
+    titles = client.random_titles(3)
+    assert titles == ["Haplogroup R-M269", "Ōkubo Station (Tokyo)", "Kumbakonam"]
+    assert client.num_requests == 1
@@ -0,0 +1,71 @@
+import os
+import time
+import pytest
+
+from prompting.rewards.sandbox import SandboxPool
+
+
+def square(x):
+    if x == 'hang':
+        time.sleep(60)
+    elif x == 'crash':
+        os._exit(1)
+    return x * x
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(num_workers=2, timeout=0.5, batch_size=3, start_method='fork', preload=())
+    yield pool
+    pool.close()
+
+
+def test_sandbox_returns_results_in_order(pool: SandboxPool):
+    results, timings, num_timeouts = pool.map(square, [(i,) for i in range(10)])
+    assert results == [i * i for i in range(10)]
+    assert len(timings) == 10
+    assert num_timeouts == 0
+
+
+def test_sandbox_scores_hung_items_with_default(pool: SandboxPool):
+    t0 = time.time()
+    results, _, num_timeouts = pool.map(square, [(1,), ('hang',), (3,), (4,)], default=-1)
+    assert results == [1, -1, 9, 16]
+    assert time.time() - t0 < 5
+    assert num_timeouts == 1
+    assert pool.num_timeouts == 1 and pool.num_restarts == 1
+    # the replaced worker is used for the next call
+    assert pool.map(square, [(2,)])[0] == [4]
+
+
+def test_sandbox_scores_failed_and_crashed_items_with_default(pool: SandboxPool):
+    results, _, _ = pool.map(square, [(1,), (None,), ('crash',), (4,)], default=-1)
+    assert results == [1, -1, -1, 16]
+    assert pool.num_errors == 1
+
+
+def test_concurrent_calls_run_on_separate_workers(pool: SandboxPool):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(_):
+        return pool.map(time.sleep, [(0.3,)])
+
+    # warm up both workers, so that process start up is not timed
+    pool.map(square, [(i,) for i in range(6)])
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        outputs = list(executor.map(run, range(2)))
+    assert time.time() - t0 < 0.55
+    assert all(num_timeouts == 0 for _, _, num_timeouts in outputs)
+
+
+def test_sandbox_scores_items_after_the_budget_with_default(pool: SandboxPool):
+    t0 = time.time()
+    # each item stays below the timeout, but together they exceed the budget of the call
+    results, _, num_timeouts = pool.map(time.sleep, [(0.3,)] * 12, default=-1, budget=0.8)
+    assert time.time() - t0 < 1.5
+    assert results.count(None) + results.count(-1) == 12
+    assert 0 < results.count(-1) == num_timeouts
+    assert pool.num_timeouts == num_timeouts
+    # the interrupted workers are replaced
+    assert pool.map(square, [(i,) for i in range(6)])[0] == [i * i for i in range(6)]
@@ -68,4 +68,140 @@ reference = ['0']*len(completion)
 def test_math_score_expression_parsing_with_zeros(reference, completion, expected_result):
     score = FloatDiffModel().math_score(reference, completion)
     assert score == expected_result
-    
\ No newline at end of file
+    
+completion = ['23', '', '20', '23', '', '2*10+3']
+def test_duplicate_completions_are_scored_once():
+    from types import SimpleNamespace
+    from prompting.rewards import RewardModelTypeEnum
+    from prompting.rewards.reward import deduplicate
+
+    unique, inverse = deduplicate(completion)
+    assert unique == ['23', '', '20', '2*10+3']
+    assert [unique[i] for i in inverse] == completion
+
+    event = FloatDiffModel().apply('23', SimpleNamespace(completions=completion), reward_type=RewardModelTypeEnum.WEIGHTED_REWARD)
+    expected = [FloatDiffModel().math_score('23', comp) for comp in completion]
+    assert event.rewards.tolist() == pytest.approx(expected)
+    assert len(event.timings) == len(completion)
+
+rouge_texts = [
+    'The cat sat on the mat. The dog sat on the log.',
+    'the cat sat. on the mat the dog',
+    'A dog. A cat. A mat.',
+    'Nothing in common here',
+    '1. First step\n2. Second step. ',
+    'The  cat\tsat on the  mat',
+]
+@pytest.mark.parametrize('ngram', ['rouge-1', 'rouge-2', 'rouge-l'])
+@pytest.mark.parametrize('reference', rouge_texts)
+@pytest.mark.parametrize('completion', rouge_texts)
+def test_rouge_matches_rouge_package(ngram, reference, completion):
+    rouge = pytest.importorskip('rouge')
+    expected = rouge.Rouge().get_scores(reference, completion)[0][ngram]
+    for metric in 'fpr':
+        score = RougeRewardModel(ngram=ngram, metric=metric).rouge_score(reference, completion)
+        assert score == pytest.approx(expected[metric], abs=1e-6)
+
+def test_rouge_of_text_without_sentences_is_zero():
+    assert RougeRewardModel(ngram='rouge-l').rouge_score('. .', 'The cat sat on the mat') == 0.0
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_reward_result_is_the_same_with_concurrent_models(max_workers):
+    import torch
+    from types import SimpleNamespace
+    from prompting.rewards import RewardResult
+
+    completions = ['23', '', '20', '2*10+3', 'twenty three']
+    task = SimpleNamespace(
+        reference='23',
+        reward_definition=[dict(name='float_diff', weight=0.5), dict(name='rouge', weight=0.5)],
+        penalty_definition=[dict(name='rouge', weight=0.5)],
+    )
+    agent = SimpleNamespace(task=task, challenge='what is 20 + 3?')
+    response_event = SimpleNamespace(completions=completions, uids=torch.arange(len(completions)))
+    pipeline = {'float_diff': FloatDiffModel(), 'rouge': RougeRewardModel(ngram='rouge-1')}
+
+    result = RewardResult(pipeline, agent=agent, response_event=response_event, device='cpu', max_workers=max_workers)
+    assert [event.model_name for event in result.reward_events] == ['float_diff', 'rouge']
+    assert [event.model_name for event in result.penalty_events] == ['rouge']
+
+    expected = 0.5 * torch.tensor([FloatDiffModel().math_score('23', comp) for comp in completions])
+    expected += 0.5 * RougeRewardModel(ngram='rouge-1').reward('23', completions).rewards
+    expected *= 1 - 0.5 * RougeRewardModel(ngram='rouge-1').reward('what is 20 + 3?', completions).rewards
+    assert torch.allclose(result.rewards, expected)
+
+    state = result.__state_dict__()
+    for event in result.reward_events + result.penalty_events:
+        for key, value in event.asdict().items():
+            assert state[key] == value
+
+def test_reward_plan_aggregates_like_the_task_definition():
+    import torch
+    from prompting.rewards import RewardPlan
+
+    reward_definition = [dict(name='rouge', weight=0.25), dict(name='relevance', weight=0.75)]
+    penalty_definition = [dict(name='rouge', weight=0.5), dict(name='diff', weight=1.0)]
+    plan = RewardPlan.compile(reward_definition, penalty_definition)
+    assert plan.model_names == ['rouge', 'relevance', 'rouge', 'diff']
+    assert plan.penalty_mask.tolist() == [False, False, True, True]
+
+    rewards = torch.rand(4, 10)
+    expected = 0.25 * rewards[0] + 0.75 * rewards[1]
+    expected *= (1 - 0.5 * rewards[2]) * (1 - 1.0 * rewards[3])
+    assert torch.allclose(plan.aggregate(rewards), expected)
+    # tasks without penalties or without models
+    assert torch.allclose(RewardPlan.compile(reward_definition).aggregate(rewards[:2]), 0.25 * rewards[0] + 0.75 * rewards[1])
+    assert RewardPlan.compile([]).aggregate(torch.zeros(0, 10)).tolist() == [0.0] * 10
+
+code ='def add(a, b):\n    return a + b\n\nprint(add(1, 2))\n'
+code_completions = [code, '', 'xyz', code.replace('a + b', 'a - b'), code.replace('print', 'log'), 'def add(a, b):\n    pass\n']
+@pytest.mark.parametrize('completion', code_completions)
+def test_diff_seq_match_keeps_sequence_matcher_scores(completion):
+    import difflib
+    expected = difflib.SequenceMatcher(None, completion, code).ratio()
+    assert DiffRewardModel(cutoff=0).seq_match(code, completion) == expected
+    # ratios below the cutoff are scored 0
+    assert DiffRewardModel(cutoff=0.5).seq_match(code, completion) == (expected if expected >= 0.5 else 0.0)
+
+@pytest.mark.parametrize('completion', code_completions)
+def test_diff_line_match_is_the_ratio_of_matching_line_characters(completion):
+    import difflib
+    reference_lines, completion_lines = code.splitlines(keepends=True), completion.splitlines(keepends=True)
+    blocks = difflib.SequenceMatcher(None, completion_lines, reference_lines, autojunk=False).get_matching_blocks()
+    matched = sum(len(line) for _, j, size in blocks for line in reference_lines[j:j + size])
+    expected = 2.0 * matched / (len(code) + len(completion)) if completion != code else 1.0
+    assert DiffRewardModel(max_chars=0, cutoff=0).seq_match(code, completion) == expected
+
+def test_diff_reward_reads_shared_line_hashes():
+    from prompting.rewards.features import CompletionFeatures
+
+    features = CompletionFeatures(code_completions)
+    model = DiffRewardModel(timeout=None, max_chars=0, cutoff=0)
+    rewards = model.reward(code, code_completions, features=features).rewards
+    assert rewards.tolist() == pytest.approx([model.seq_match(code, completion) for completion in code_completions])
+    assert 'line_hashes' in repr(features)
+
+def test_diff_unified_diff_counts_lines():
+    assert DiffRewardModel(lines=True).unified_diff(code, code) == 0
+    assert DiffRewardModel(lines=True).unified_diff(code, code.replace('a + b', 'a - b')) > 0
+
+completion = ['The answer is 23.', '23 is the answer, not 20', '2**3*3-1', '(46)/2', '9**9**9**9', '23 9**9**9**9', 'no number here']
+expected_result = [23.0, 20.0, 23.0, 23.0, float('inf'), float('inf'), None]
+@pytest.mark.parametrize('completion, expected_result', zip(completion, expected_result))
+def test_math_extract_number_without_sympy(completion, expected_result):
+    import time
+    t0 = time.time()
+    assert FloatDiffModel.extract_number(completion) == expected_result
+    # huge powers are not computed
+    assert time.time() - t0 < 1
+
+def test_math_parses_long_arithmetic_expressions():
+    from prompting.rewards.float_diff import MAX_SYMPY_LENGTH, parse_number, _parse_short_number
+
+    expression = '+'.join(map(str, range(1, 30)))
+    assert len(expression) > MAX_SYMPY_LENGTH
+    cached = _parse_short_number.cache_info().currsize
+    assert parse_number(expression) == 435.0
+    # long words are not memoized
+    assert _parse_short_number.cache_info().currsize == cached
+    assert FloatDiffModel().math_score('435', f'The sum is {expression}') == 1.0
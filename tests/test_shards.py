@@ -0,0 +1,102 @@
+import pytest
+
+from prompting.tools.datasets.shards import CodeShardStore
+
+
+def make_sample(language, num_lines, i=0):
+    return {
+        "repo_name": f"repo{i}",
+        "path": f"file{i}",
+        "language": language,
+        "code": "\n".join(f"line {j}" for j in range(num_lines)),
+        "license": "mit",
+        "size": num_lines,
+    }
+
+
+SAMPLES = [make_sample(language, num_lines, i) for i, (language, num_lines) in enumerate(
+    [("Python", 3), ("Python", 7), ("Python", 42), ("C++", 12), ("C++", 99), ("Java", 150), ("Java", 5000)]
+)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CodeShardStore(path=str(tmp_path / "code"), seed=42)
+    store.add(SAMPLES, consumed=len(SAMPLES))
+    return store
+
+
+def test_samples_are_bucketed_by_language_and_line_count(store: CodeShardStore):
+    # the sample with 5000 lines is too long to be stored
+    assert len(store) == 6
+    assert sorted(store.buckets) == ["C++.10-20", "C++.50-100", "Java.100-200", "Python.0-5", "Python.20-50", "Python.5-10"]
+    assert store.consumed == len(SAMPLES)
+
+
+@pytest.mark.parametrize(
+    "languages, min_lines, max_lines, expected",
+    [
+        (None, 5, 100, {"repo1", "repo2", "repo3", "repo4"}),
+        (["C++"], 5, 100, {"repo3", "repo4"}),
+        (["Python"], 8, 50, {"repo2"}),
+        (["Java"], 5, 100, set()),
+    ],
+)
+def test_sample_only_returns_matching_samples(store: CodeShardStore, languages, min_lines, max_lines, expected):
+    assert store.count(languages, min_lines, max_lines) == len(expected)
+    repos = {store.sample(languages, min_lines, max_lines)["repo_name"] for _ in range(50)} if expected else set()
+    assert repos == expected
+    if not expected:
+        assert store.sample(languages, min_lines, max_lines) is None
+
+
+def test_sampling_resumes_after_restart(store: CodeShardStore):
+    store.sample()
+    store.save_state()
+    restarted = CodeShardStore(path=store.path, seed=42)
+    assert [store.sample()["repo_name"] for _ in range(10)] == [restarted.sample()["repo_name"] for _ in range(10)]
+    assert restarted.consumed == len(SAMPLES)
+
+
+def test_samples_added_by_other_stores_are_visible(store: CodeShardStore):
+    other = CodeShardStore(path=store.path)
+    other.add([make_sample("C++", 12, 100)], consumed=1)
+    assert store.count(["C++"], 10, 19) == 2
+    assert {sample["repo_name"] for sample in store} >= {"repo3", "repo100"}
+    assert store.sample(["C++"], 10, 19)["language"] == "C++"
+    assert CodeShardStore(path=store.path).consumed == len(SAMPLES) + 1
+
+
+def test_sampling_state_is_saved_periodically(tmp_path):
+    store = CodeShardStore(path=str(tmp_path / "code"), seed=42, save_every=5)
+    store.add(SAMPLES)
+    for _ in range(4):
+        store.sample()
+    assert "rng" not in CodeShardStore(path=store.path).state
+    store.sample()
+    restarted = CodeShardStore(path=store.path)
+    assert [store.sample()["repo_name"] for _ in range(10)] == [restarted.sample()["repo_name"] for _ in range(10)]
+
+
+def test_sample_without_replacement_returns_each_sample_once(store: CodeShardStore):
+    assert store.remaining(None, 5, 100) == 4
+    repos = [store.sample(None, 5, 100, replace=False)["repo_name"] for _ in range(4)]
+    assert sorted(repos) == ["repo1", "repo2", "repo3", "repo4"]
+    assert store.remaining(None, 5, 100) == 0
+    assert store.sample(None, 5, 100, replace=False) is None
+    # samples drawn for one line range are not drawn again for another
+    assert store.sample(["C++"], 10, 19, replace=False) is None
+
+    store.add([make_sample("C++", 12, 100)])
+    assert store.remaining(None, 5, 100) == 1
+    assert store.sample(None, 5, 100, replace=False)["repo_name"] == "repo100"
+
+
+def test_samples_drawn_without_replacement_are_not_drawn_after_restart(store: CodeShardStore):
+    drawn = {store.sample(None, 5, 100, replace=False)["repo_name"] for _ in range(2)}
+    store.save_state()
+    restarted = CodeShardStore(path=store.path)
+    assert restarted.remaining(None, 5, 100) == 2
+    repos = {restarted.sample(None, 5, 100, replace=False)["repo_name"] for _ in range(2)}
+    assert repos.isdisjoint(drawn)
+    assert restarted.sample(None, 5, 100, replace=False) is None
@@ -0,0 +1,49 @@
+import pytest
+
+from prompting.tools.datasets.code import StackOverflowDataset
+from prompting.utils.cache import DiskCache
+from .fixtures.stackexchange import StackExchangeStandIn
+
+
+@pytest.fixture(scope="module")
+def stand_in():
+    with StackExchangeStandIn(num_questions=500, answers_per_question=3) as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def dataset(stand_in, tmp_path):
+    return StackOverflowDataset(api_url=stand_in.api_url, cache=DiskCache(path=str(tmp_path / "so.sqlite")))
+
+
+def test_page_answers_are_fetched_in_bulk(dataset: StackOverflowDataset):
+    pairs = dataset.get_stack_page(page=1, min_upvotes=950)
+    # questions 0..50 have at least 950 upvotes
+    assert len(pairs) == 51
+    assert pairs[0] == {"question": "Question 0", "answer": "Answer 0 to \nQuestion 0", "question_id": 1000}
+    assert all(pair["answer"].startswith("Answer 0 ") for pair in pairs)
+    # one request for the questions, and answer pages until every question has its highest voted answer
+    assert dataset.num_requests == 1 + 2
+
+
+def test_pages_are_served_from_the_cache(dataset: StackOverflowDataset, stand_in: StackExchangeStandIn):
+    dataset.get_stack_page(page=1)
+    num_requests = len(stand_in.requests)
+    restarted = StackOverflowDataset(api_url=stand_in.api_url, cache=dataset.cache)
+    assert restarted.get_stack_page(page=1) == dataset.get_stack_page(page=1)
+    assert len(stand_in.requests) == num_requests
+
+
+def test_next_returns_question_and_answer(dataset: StackOverflowDataset):
+    infos = [dataset.next() for _ in range(5)]
+    assert all(info["answer"].startswith("Answer 0 to") for info in infos)
+    assert all(info["question"] in info["answer"] for info in infos)
+    assert {"question", "answer", "fetch_time"} == set(infos[0])
+
+
+def test_get_stack_answer_returns_highest_voted_answer(dataset: StackOverflowDataset):
+    assert dataset.get_stack_answer({"question_id": 1005}) == "Answer 0 to \nQuestion 5"
+
+
+def test_get_stack_answer_returns_none_without_answers(dataset: StackOverflowDataset):
+    assert dataset.get_stack_answer({"question_id": 1}) is None
@@ -110,4 +110,18 @@ def test_task_contains_required_definition(task: Task, definition: str, expected
 
         total_weight += weight
 
-    assert not model_infos or expected_weight is None or total_weight == expected_weight
\ No newline at end of file
+    assert not model_infos or expected_weight is None or total_weight == expected_weight
+
+@pytest.mark.parametrize('task', TASKS)
+def test_task_context_is_cut_to_token_budget(task: Task):
+    task = task(llm_pipeline=LLM_PIPELINE, context=CONTEXTS[task])
+    state = task.__state_dict__()
+    assert task.max_context_tokens is None or state['context_length'] <= task.max_context_tokens
+    assert state['reference_prompt_length'] >= 0 and state['query_prompt_length'] >= 0
+
+@pytest.mark.parametrize('task', TASKS)
+def test_task_reuses_cached_reference(task: Task):
+    first = task(llm_pipeline=LLM_PIPELINE, context=CONTEXTS[task])
+    second = task(llm_pipeline=LLM_PIPELINE, context=CONTEXTS[task])
+    assert second.reference == first.reference
+    assert first.static_reference or second.__state_dict__()['reference_cache_hit']
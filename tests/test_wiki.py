@@ -0,0 +1,169 @@
+import time
+import pytest
+import pickle
+
+from prompting.tools import Selector
+from prompting.tools.datasets import wiki as wiki_module
+from prompting.tools.datasets.mediawiki import WikiPage, parse_sections
+from prompting.tools.datasets.wiki import (
+    process_page,
+    most_relevant_links,
+    filter_categories,
+    compact_page,
+    WikiDataset,
+    WikiDateDataset,
+    TitlePool,
+)
+
+CONTENT = """Emilio Alvarez is an American bishop of the Union of Charismatic Orthodox Churches.
+
+== Early life ==
+Alvarez was born in 1980. He studied x == y at school.
+
+== Ministry ==
+
+=== Consecration ===
+He was consecrated in 2017.
+
+=== Teaching ===
+He teaches theology.
+
+== See also ==
+Other bishops
+"""
+
+PAGE = WikiPage(
+    title="Emilio Alvarez (bishop)",
+    pageid=56273468,
+    url="https://en.wikipedia.org/wiki/Emilio_Alvarez_(bishop)",
+    content=CONTENT,
+    links=["Union of Charismatic Orthodox Churches", "Bishop", "American", "Theology", "Zeta"],
+    categories=["Living people", "Articles with short description", "American bishops"],
+)
+
+
+def test_parse_sections_returns_section_offsets():
+    index = parse_sections(CONTENT)
+    assert list(index.keys()) == ["Early life", "Ministry", "Consecration", "Teaching", "See also"]
+    start, end = index["Early life"]
+    assert CONTENT[start:end].strip() == "Alvarez was born in 1980. He studied x == y at school."
+    start, end = index["Ministry"]
+    assert CONTENT[start:end].strip() == ""
+
+
+def test_process_page_uses_headers_of_empty_sections():
+    sections = process_page(PAGE, valid_content=lambda x: len(x.split()) >= 3)
+    assert list(sections.keys()) == [("", "Early life"), ("Ministry", "Consecration"), ("Ministry", "Teaching")]
+    assert sections[("Ministry", "Teaching")] == ["He teaches theology."]
+
+
+@pytest.mark.parametrize("num_links", (1, 3, 10))
+def test_most_relevant_links_matches_sorted_iou(num_links: int):
+    summary_words = set(PAGE.summary.split()[:50])
+    scores = {
+        link: len(summary_words & set(link.split())) / len(summary_words | set(link.split())) / len(link.split())
+        for link in PAGE.links
+    }
+    assert PAGE.summary == "Emilio Alvarez is an American bishop of the Union of Charismatic Orthodox Churches."
+    expected = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:num_links]
+
+    assert most_relevant_links(PAGE, num_links=num_links, return_scores=True) == expected
+    assert most_relevant_links(PAGE, num_links=num_links) == [link for link, _ in expected]
+
+
+def test_filter_categories():
+    assert filter_categories(PAGE.categories, exclude=("articles", "wiki")) == ["Living people", "American bishops"]
+    assert filter_categories(PAGE.categories, include=("bishop",)) == ["American bishops"]
+
+
+def test_compact_page_keeps_most_relevant_links_and_tags():
+    page = compact_page(PAGE, max_links=2)
+    assert page.links == tuple(most_relevant_links(PAGE, num_links=2))
+    assert most_relevant_links(page, num_links=1) == most_relevant_links(PAGE, num_links=1)
+    assert page.categories == ("Living people", "American bishops")
+    assert page.sections == PAGE.sections
+    assert page.section("Teaching") == "He teaches theology."
+    assert page.nbytes < PAGE.nbytes
+
+
+def test_compact_page_can_be_pickled():
+    page = pickle.loads(pickle.dumps(compact_page(PAGE)))
+    assert page.title == PAGE.title
+    assert page.section("Consecration") == "He was consecrated in 2017."
+    assert page.length == len(CONTENT.split())
+
+
+def test_get_contexts_extracts_distinct_sections(monkeypatch):
+    monkeypatch.setattr(wiki_module, "_get_page", lambda title, **kwargs: PAGE)
+    dataset = WikiDataset(min_length_words=3)
+    contexts = dataset.get_contexts(PAGE.title, selector=Selector(seed=42))
+    assert sorted(context["subtopic"] for context in contexts) == ["Consecration", "Early life", "Teaching"]
+    assert len(dataset.get_contexts(PAGE.title, selector=Selector(seed=42), max_contexts=2)) == 2
+    assert dataset.get(PAGE.title, selector=Selector(seed=42)) == contexts[0]
+
+
+def test_title_pool_refills_in_background_below_low_water():
+    batches = iter([[f"a{i}" for i in range(5)], [f"b{i}" for i in range(5)]])
+    pool = TitlePool(fetch=lambda size: next(batches), size=5, low_water=3)
+    assert [pool.pop() for _ in range(3)] == ["a0", "a1", "a2"]
+    time.sleep(0.1)
+    assert pool.num_refills == 2
+    assert len(pool) == 7
+
+
+def test_title_pool_drops_failed_titles():
+    pool = TitlePool(fetch=lambda size: ["a", "b", "c"], size=3, low_water=0)
+    pool.mark_failed("b")
+    assert [pool.pop(), pool.pop()] == ["a", "c"]
+    pool.mark_failed("a")
+    assert pool.pop() == "c"
+
+
+def test_search_uses_local_index(monkeypatch):
+    def offline(*args, **kwargs):
+        raise AssertionError("search should not use the live API")
+
+    monkeypatch.setattr(wiki_module, "_get_page", lambda title, **kwargs: PAGE)
+    monkeypatch.setattr(wiki_module, "_wiki_search", offline)
+    monkeypatch.setattr(wiki_module, "_cache_indexed", True)
+    wiki_module.index_page(PAGE)
+
+    context = WikiDataset(min_length_words=3).search("charismatic bishop", selector=Selector(seed=42))
+    assert context["title"] == PAGE.title
+
+
+def test_date_search_finds_indexed_events(monkeypatch):
+    page = WikiPage(
+        title="March 28",
+        pageid=19582,
+        url="https://en.wikipedia.org/wiki/March_28",
+        content="March 28 is the 87th day of the year.\n\n== Events ==\n\n=== Pre-1950 ===\n1776 – Juan Bautista de Anza finds the site of San Francisco.\n1930 – Constantinople and Angora are renamed Istanbul and Ankara.\n",
+        links=["Istanbul", "Ankara", "San Francisco"],
+    )
+    monkeypatch.setattr(wiki_module, "_get_page", lambda title, **kwargs: page)
+    monkeypatch.setattr(wiki_module, "_cache_indexed", True)
+    wiki_module.index_page(page)
+
+    context = WikiDateDataset().search("renamed Istanbul", selector=Selector(seed=42))
+    assert context["subtopic"] == "1930"
+    assert context["external_links"] == ["Istanbul", "Ankara"]
+
+
+def test_cached_pages_are_indexed_in_background_up_to_max_pages(monkeypatch):
+    from types import SimpleNamespace
+    from prompting.utils.index import SearchIndex
+
+    date_page = WikiPage(title="March 28", pageid=19582, url="", content="== Events ==\n\n=== Pre-1950 ===\n1930 – Istanbul is renamed.\n")
+    pages = [date_page] + [WikiPage(title=f"Page {i}", pageid=i, url="", content=f"Summary {i}") for i in range(5)]
+    monkeypatch.setattr(wiki_module, "WIKI_CACHE", SimpleNamespace(values=lambda: iter(["not a page", *pages])))
+    monkeypatch.setattr(wiki_module, "WIKI_INDEX", SearchIndex())
+    monkeypatch.setattr(wiki_module, "DATE_INDEX", SearchIndex())
+    monkeypatch.setattr(wiki_module, "_INDEXED_DATES", set())
+    monkeypatch.setattr(wiki_module, "_cache_indexed", False)
+
+    thread = wiki_module.index_cached_pages(max_pages=4)
+    thread.join()
+    assert wiki_module.index_cached_pages() is None
+    # date pages are only in the date index
+    assert list(wiki_module.WIKI_INDEX.docs) == ["Page 0", "Page 1", "Page 2"]
+    assert wiki_module.DATE_INDEX.search("Istanbul")[0][0] == "March 28"
@@ -0,0 +1,47 @@
+import pytest
+
+from prompting.utils.windowing import TOKEN_COUNTS, count_tokens, split_sentences, window_text
+
+TEXT = "Alvarez was born in 1980. He studied theology at Drew University!\nHe was consecrated in 2017. He teaches theology."
+
+
+class CharTokenizer:
+    """Counts each character as a token and records what it encodes."""
+
+    name_or_path = "char-tokenizer"
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, text, add_special_tokens=True):
+        self.calls.append(text)
+        return list(text)
+
+
+def test_split_sentences_preserves_text():
+    sentences = split_sentences(TEXT)
+    assert sentences[0] == "Alvarez was born in 1980. "
+    assert sentences[1] == "He studied theology at Drew University!\n"
+    assert ''.join(sentences) == TEXT
+
+
+@pytest.mark.parametrize("max_tokens, expected", [(100, TEXT), (12, "Alvarez was born in 1980. He studied theology at Drew University!"), (5, "Alvarez was born in 1980.")])
+def test_window_text_cuts_at_sentence_boundaries(max_tokens: int, expected: str):
+    window, num_tokens = window_text(TEXT, max_tokens)
+    assert window == expected
+    assert num_tokens <= max_tokens
+
+
+def test_window_text_cuts_long_first_sentence_at_words():
+    window, num_tokens = window_text(TEXT, max_tokens=3)
+    assert window == "Alvarez was born"
+    assert num_tokens == 3
+
+
+def test_token_counts_are_cached_per_tokenizer_and_text():
+    TOKEN_COUNTS.clear()
+    tokenizer = CharTokenizer()
+    assert count_tokens(TEXT, tokenizer) == len(TEXT)
+    assert count_tokens(TEXT, tokenizer) == len(TEXT)
+    assert count_tokens(TEXT) == len(TEXT.split())
+    assert tokenizer.calls == [TEXT]